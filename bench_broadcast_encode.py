@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+广播序列化开销基准测试
+对比"每个接收者各自json.dumps"与"预序列化Frame只编码一次"的CPU耗时
+
+用法: python bench_broadcast_encode.py [--repeat 5]
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime
+
+from aiohttp import WSMsgType
+
+from sync_frames import Frame
+
+CONNECTION_COUNTS = (100, 1000, 10000)
+
+
+class NullWebSocket:
+    """只记录字节数的假连接，排除网络开销，只测量序列化成本"""
+
+    def __init__(self):
+        self.bytes_sent = 0
+
+    async def send_str(self, data):
+        self.bytes_sent += len(data.encode('utf-8'))
+
+    async def send_frame(self, message, opcode):
+        assert opcode == WSMsgType.TEXT
+        self.bytes_sent += len(message)
+
+
+def sample_message():
+    """接近真实 message_sync 的载荷"""
+    return {
+        'type': 'message_sync',
+        'data': {
+            'id': 'msg_1700000000000_42',
+            'conversation_id': 'group_1024',
+            'sender_id': 'device_7f3a9c',
+            'sender_name': '张三',
+            'content': '今晚七点在老地方集合，记得带上资料。' * 3,
+            'message_type': 'text',
+            'created_at': datetime.now().isoformat(),
+            'read_by': ['device_%d' % i for i in range(8)]
+        },
+        'timestamp': datetime.now().isoformat()
+    }
+
+
+async def broadcast_per_client(clients, message):
+    """旧路径：循环内逐个json.dumps"""
+    for ws in clients:
+        await ws.send_str(json.dumps(message))
+
+
+async def broadcast_frame(clients, message):
+    """新路径：Frame只序列化一次"""
+    frame = Frame(message)
+    for ws in clients:
+        await frame.send_to(ws)
+
+
+def measure(func, clients, message, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.process_time()
+        asyncio.run(func(clients, message))
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='广播序列化开销基准测试')
+    parser.add_argument('--repeat', type=int, default=5, help='每组重复次数，取最小值')
+    args = parser.parse_args()
+
+    message = sample_message()
+    print(f"载荷大小: {len(json.dumps(message).encode('utf-8'))} 字节")
+    print(f"{'连接数':>8} {'逐个dumps(ms)':>14} {'Frame(ms)':>10} {'节省(ms)':>10} {'节省比例':>8}")
+
+    for count in CONNECTION_COUNTS:
+        clients = [NullWebSocket() for _ in range(count)]
+        old = measure(broadcast_per_client, clients, message, args.repeat) * 1000
+        new = measure(broadcast_frame, clients, message, args.repeat) * 1000
+        saved = old - new
+        ratio = saved / old if old else 0.0
+        print(f"{count:>8} {old:>14.2f} {new:>10.2f} {saved:>10.2f} {ratio:>8.1%}")
+
+
+if __name__ == "__main__":
+    main()
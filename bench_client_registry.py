@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+客户端登记表内存基准测试
+模拟大量客户端注册，对比旧的dict记录（datetime时间）与ClientRecord（__slots__ + 整数毫秒）
+每个客户端占用的字节数；连接和出站队列对象两种方式相同，用共享占位对象排除在外
+
+用法: python bench_client_registry.py [--clients 100000]
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+from datetime import datetime
+
+from sync_clients import ClientRecord
+from sync_clock import clock
+
+PLACEHOLDER = object()
+
+
+def register_dicts(count):
+    """旧结构：每个客户端一个dict，时间为datetime和float"""
+    clients = {}
+    for i in range(count):
+        clients[f'device_{i:08d}'] = {
+            'websocket': PLACEHOLDER,
+            'outbound': PLACEHOLDER,
+            'username': 'Unknown',
+            'connected_at': datetime.now(),
+            'last_heartbeat': datetime.now(),
+            'last_seen': time.monotonic()
+        }
+    return clients
+
+
+def register_records(count):
+    """新结构：ClientRecord，三个时间字段共享同一个整数"""
+    clients = {}
+    for i in range(count):
+        clients[f'device_{i:08d}'] = ClientRecord(PLACEHOLDER, 'Unknown', clock.now_ms(), outbound=PLACEHOLDER)
+    return clients
+
+
+def measure(func, count):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    clients = func(count)
+    elapsed = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del clients
+    return current, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='客户端登记表内存基准测试')
+    parser.add_argument('--clients', type=int, default=100000, help='模拟注册的客户端数')
+    args = parser.parse_args()
+
+    print(f"{'结构':<14} {'总内存(MB)':>11} {'每客户端(字节)':>15} {'注册耗时(ms)':>13}")
+    results = {}
+    for name, func in (('dict+datetime', register_dicts), ('ClientRecord', register_records)):
+        total, elapsed = measure(func, args.clients)
+        results[name] = total / args.clients
+        print(f"{name:<14} {total / 1024 / 1024:>11.2f} {total / args.clients:>15.1f} {elapsed * 1000:>13.1f}")
+
+    saved = results['dict+datetime'] - results['ClientRecord']
+    print(f"\n每客户端节省 {saved:.1f} 字节 ({saved / results['dict+datetime']:.1%})，"
+          f"{args.clients} 个客户端共节省 {saved * args.clients / 1024 / 1024:.1f} MB（含设备id键和登记表本身）")
+
+
+if __name__ == "__main__":
+    main()
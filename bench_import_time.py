@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+冷启动基准测试
+在全新的子进程中用 python -X importtime 导入各个入口模块，统计导入耗时和创建应用的耗时，
+并列出最耗时的依赖，结果保存为JSON便于在不同提交间对比
+
+用法:
+    python bench_import_time.py
+    python bench_import_time.py --runs 20 --top 15
+    python bench_import_time.py --compare bench_results/上一次.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+
+TARGETS = ('vercel_simple_server', 'vercel_sync_server', 'wsgi_app')
+
+# 导入后再取得应用，计入第一次请求之前必须完成的全部工作
+BUILD_SNIPPET = (
+    "import sys, time\n"
+    "started = time.perf_counter()\n"
+    "module = __import__(sys.argv[1])\n"
+    "module.app\n"
+    "print((time.perf_counter() - started) * 1000)\n"
+)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def parse_importtime(stderr):
+    """解析 -X importtime 的输出，返回 {模块名: (自身微秒, 累计微秒)}"""
+    timings = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        name = parts[2].strip()
+        timings[name] = (int(parts[0]), int(parts[1]))
+    return timings
+
+
+def measure_target(target, runs):
+    """导入耗时（-X importtime中该模块的累计时间）和导入+创建应用的墙钟时间，单位毫秒"""
+    import_ms, build_ms = [], []
+    heaviest = {}
+    for _ in range(runs):
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {target}'],
+            capture_output=True, text=True
+        )
+        timings = parse_importtime(proc.stderr)
+        if target not in timings:
+            raise RuntimeError(f"无法导入 {target}: {proc.stderr.strip().splitlines()[-1:]}")
+        import_ms.append(timings[target][1] / 1000)
+        for name, (own, _) in timings.items():
+            heaviest.setdefault(name, []).append(own / 1000)
+
+        output = subprocess.check_output([sys.executable, '-c', BUILD_SNIPPET, target], text=True)
+        build_ms.append(float(output.strip().splitlines()[-1]))
+    return {
+        'import_ms': statistics.median(import_ms),
+        'build_ms': statistics.median(build_ms),
+        'heaviest': sorted(
+            ((name, statistics.median(values)) for name, values in heaviest.items()),
+            key=lambda item: item[1], reverse=True
+        )
+    }
+
+
+def fmt(value):
+    return '-' if value is None else f'{value:.2f}'
+
+
+def print_results(results, top, baseline=None):
+    print(f"\n{'入口':<22} {'指标':<10} {'本次':>10}" + (f" {'基线':>10} {'变化':>8}" if baseline else ''))
+    for target, result in results.items():
+        for key in ('import_ms', 'build_ms'):
+            value = result[key]
+            line = f"{target:<22} {key:<10} {fmt(value):>10}"
+            if baseline:
+                old = baseline.get(target, {}).get(key)
+                change = f"{(value - old) / old:+.1%}" if old else '-'
+                line += f" {fmt(old):>10} {change:>8}"
+            print(line)
+    for target, result in results.items():
+        print(f"\n{target} 自身耗时最多的模块 (ms):")
+        for name, own in result['heaviest'][:top]:
+            print(f"    {own:>8.2f}  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='冷启动基准测试')
+    parser.add_argument('--targets', nargs='+', default=list(TARGETS), help='入口模块')
+    parser.add_argument('--runs', type=int, default=10, help='每个入口启动的子进程数，取中位数')
+    parser.add_argument('--top', type=int, default=10, help='列出自身耗时最多的前N个模块')
+    parser.add_argument('--output', default='bench_results', help='结果保存目录')
+    parser.add_argument('--compare', help='与之前保存的结果文件对比')
+    args = parser.parse_args()
+
+    # 子进程从仓库目录导入入口模块
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    results = {target: measure_target(target, args.runs) for target in args.targets}
+    for result in results.values():
+        result['heaviest'] = result['heaviest'][:args.top]
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+    print_results(results, args.top, baseline)
+
+    os.makedirs(args.output, exist_ok=True)
+    revision = git_revision()
+    path = os.path.join(args.output, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{revision}-import.json")
+    params = {k: v for k, v in vars(args).items() if k not in ('output', 'compare')}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'revision': revision, 'params': params, 'results': results}, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存: {path}")
+
+
+if __name__ == "__main__":
+    main()
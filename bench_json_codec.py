@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JSON编解码实现基准测试
+在真实消息形状上对比已安装的各个实现（orjson / ujson / 标准库json）
+
+用法: python bench_json_codec.py [--iterations 20000]
+"""
+
+import argparse
+import time
+
+import sync_codec
+from bench_wire_protocol import sample_messages
+
+
+def per_op_us(func, arg, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(arg)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='JSON编解码实现基准测试')
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    backends = {}
+    for name in sync_codec.BACKENDS:
+        try:
+            backends[name] = sync_codec.load_backend(name)
+        except ImportError:
+            print(f"{name}: 未安装，跳过")
+    print(f"当前选用: {sync_codec.backend}\n")
+
+    print(f"{'消息类型':<14} {'实现':<8} {'字节数':>6} {'编码us':>8} {'解码us':>8}")
+    for message_name, message in sample_messages().items():
+        for name, (dumps, dumps_bytes, loads, _) in backends.items():
+            encoded = dumps_bytes(message)
+            print(f"{message_name:<14} {name:<8} {len(encoded):>6} "
+                  f"{per_op_us(dumps_bytes, message, args.iterations):>8.2f} "
+                  f"{per_op_us(loads, encoded, args.iterations):>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
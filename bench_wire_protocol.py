@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+线协议基准测试
+对比JSON文本帧与二进制帧在真实消息形状上的帧大小和编解码耗时
+
+用法: python bench_wire_protocol.py [--iterations 20000]
+"""
+
+import argparse
+import json
+import time
+from datetime import datetime
+
+import sync_binary
+
+
+def sample_messages():
+    now = datetime.now().isoformat()
+    return {
+        'heartbeat': {'type': 'heartbeat', 'device_id': 'device_7f3a9c', 'timestamp': now},
+        'message_sync': {
+            'type': 'message_sync',
+            'seq': 123456,
+            'data': {
+                'id': 'msg_1700000000000_42',
+                'conversation_id': 'group_1024',
+                'sender_id': 'device_7f3a9c',
+                'sender_name': '张三',
+                'content': '今晚七点在老地方集合，记得带上资料。',
+                'created_at': now
+            },
+            'timestamp': now
+        },
+        'user_sync': {
+            'type': 'user_sync',
+            'data': {'id': 'user_42', 'name': '李四', 'avatar': 'https://example.com/a/42.png', 'status': 'online'},
+            'timestamp': now
+        },
+        'group_sync': {
+            'type': 'group_sync',
+            'data': {'id': 'group_1024', 'name': '项目组', 'members': ['user_%d' % i for i in range(50)]},
+            'timestamp': now
+        }
+    }
+
+
+def per_op_us(func, arg, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(arg)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='线协议基准测试')
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'消息类型':<14} {'JSON字节':>8} {'二进制字节':>10} {'压缩比':>6} "
+          f"{'JSON编码us':>10} {'二进制编码us':>12} {'JSON解码us':>10} {'二进制解码us':>12}")
+    for name, message in sample_messages().items():
+        text = json.dumps(message).encode('utf-8')
+        binary = sync_binary.encode(message)
+        print(f"{name:<14} {len(text):>8} {len(binary):>10} {len(binary) / len(text):>6.0%} "
+              f"{per_op_us(lambda m: json.dumps(m).encode('utf-8'), message, args.iterations):>10.2f} "
+              f"{per_op_us(sync_binary.encode, message, args.iterations):>12.2f} "
+              f"{per_op_us(json.loads, text, args.iterations):>10.2f} "
+              f"{per_op_us(sync_binary.decode, binary, args.iterations):>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+WebSocket负载基准测试
+在本地启动同步服务器，模拟大量设备执行 register / heartbeat / message_sync，
+统计建连速率、消息吞吐和端到端投递延迟(p50/p99/p999)，结果保存为JSON便于在不同提交间对比
+（wsgi_app 的 SyncServer 不转发消息，只能测量建连和发送速率）
+
+用法:
+    python bench_ws_load.py --clients 1000 --duration 30
+    python bench_ws_load.py --target wsgi_app --clients 2000
+    python bench_ws_load.py --workers 4 --compare bench_results/上一次.json
+    python bench_ws_load.py --url ws://127.0.0.1:8766/ws   # 测试已在运行的服务器
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import aiohttp
+
+# 在子进程中启动单进程服务器
+SERVER_SNIPPET = (
+    "import importlib, sys\n"
+    "from aiohttp import web\n"
+    "module = importlib.import_module(sys.argv[1])\n"
+    "web.run_app(module.app, host='127.0.0.1', port=int(sys.argv[2]), print=None, access_log=None)\n"
+)
+
+RESULT_KEYS = (
+    'connections_per_sec', 'connect_p50_ms', 'connect_p99_ms',
+    'sent_per_sec', 'delivered_per_sec',
+    'latency_p50_ms', 'latency_p99_ms', 'latency_p999_ms', 'latency_max_ms'
+)
+
+
+class LoadStats:
+    def __init__(self):
+        self.connect_times = []
+        self.connect_failures = 0
+        self.sent = 0
+        self.delivered = 0
+        self.latencies = []
+        self.errors = 0
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def start_server(args):
+    """启动被测服务器子进程"""
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONUNBUFFERED='1')
+    # 压测本身要测量接入能力，默认关闭服务器的连接准入限制（环境变量中显式设置的除外）
+    env.setdefault('SYNC_MAX_CONNECTIONS', '0')
+    env.setdefault('SYNC_ACCEPT_RATE', '0')
+    if args.workers > 1:
+        cmd = [sys.executable, 'sync_workers.py', '--app', f'{args.target}:app',
+               '--host', '127.0.0.1', '--port', str(args.port), '--workers', str(args.workers)]
+    else:
+        cmd = [sys.executable, '-c', SERVER_SNIPPET, args.target, str(args.port)]
+    os.makedirs(args.output, exist_ok=True)
+    log = open(os.path.join(args.output, 'server.log'), 'w')
+    return subprocess.Popen(cmd, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+async def wait_for_server(session, base_url, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(f'{base_url}/health') as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError('服务器启动超时')
+
+
+def record_event(event, stats, now):
+    if event.get('type') == 'message_sync':
+        sent_at = (event.get('data') or {}).get('sent_at')
+        if sent_at is not None:
+            stats.delivered += 1
+            stats.latencies.append((now - sent_at) * 1000)
+    elif event.get('type') == 'error':
+        stats.errors += 1
+
+
+async def device_reader(ws, stats):
+    async for msg in ws:
+        if msg.type != aiohttp.WSMsgType.TEXT:
+            continue
+        now = time.time()
+        message = json.loads(msg.data)
+        if 'events' in message:
+            for event in message['events']:
+                record_event(event, stats, now)
+        else:
+            record_event(message, stats, now)
+
+
+async def run_device(index, session, args, stats, connect_sem, start_event, stop_event):
+    device_id = f'bench_{index}'
+    group = f'bench_group_{index % args.groups}' if args.groups else None
+    register = {'type': 'register', 'device_id': device_id, 'username': device_id}
+    if group is not None:
+        register['groups'] = [group]
+    if args.batch:
+        register['batch'] = True
+
+    async with connect_sem:
+        started = time.perf_counter()
+        try:
+            ws = await session.ws_connect(args.url, heartbeat=None, max_msg_size=0)
+            await ws.send_str(json.dumps(register))
+            while True:
+                msg = await asyncio.wait_for(ws.receive(), timeout=30)
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    raise ConnectionError(f'连接在注册前关闭: {msg.type}')
+                if json.loads(msg.data).get('type') == 'register_success':
+                    break
+        except Exception:
+            stats.connect_failures += 1
+            return
+        stats.connect_times.append(time.perf_counter() - started)
+
+    reader = asyncio.ensure_future(device_reader(ws, stats))
+    try:
+        await start_event.wait()
+        # 错开各设备的发送时刻，避免所有设备同时发送
+        await asyncio.sleep(random.random() / args.rate)
+        counter = 0
+        next_heartbeat = time.monotonic() + args.heartbeat
+        while not stop_event.is_set():
+            counter += 1
+            data = {'id': f'{device_id}_{counter}', 'sent_at': time.time()}
+            if group is not None:
+                data['group_id'] = group
+            await ws.send_str(json.dumps({'type': 'message_sync', 'device_id': device_id, 'data': data}))
+            stats.sent += 1
+            if time.monotonic() >= next_heartbeat:
+                await ws.send_str(json.dumps({'type': 'heartbeat', 'device_id': device_id}))
+                next_heartbeat += args.heartbeat
+            await asyncio.sleep(1 / args.rate)
+        # 留出时间接收最后一批消息
+        await asyncio.sleep(args.drain)
+    finally:
+        reader.cancel()
+        await ws.close()
+
+
+async def run_load(args):
+    stats = LoadStats()
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        base_url = args.url.replace('ws://', 'http://').replace('wss://', 'https://').rsplit('/ws', 1)[0]
+        await wait_for_server(session, base_url)
+
+        start_event = asyncio.Event()
+        stop_event = asyncio.Event()
+        connect_sem = asyncio.Semaphore(args.connect_concurrency)
+
+        connect_started = time.perf_counter()
+        devices = [
+            asyncio.ensure_future(run_device(i, session, args, stats, connect_sem, start_event, stop_event))
+            for i in range(args.clients)
+        ]
+        while len(stats.connect_times) + stats.connect_failures < args.clients:
+            await asyncio.sleep(0.05)
+        connect_elapsed = time.perf_counter() - connect_started
+        print(f"已连接 {len(stats.connect_times)} 个设备，失败 {stats.connect_failures}，耗时 {connect_elapsed:.2f}s")
+
+        load_started = time.perf_counter()
+        start_event.set()
+        await asyncio.sleep(args.duration)
+        stop_event.set()
+        sent_elapsed = time.perf_counter() - load_started
+        await asyncio.gather(*devices, return_exceptions=True)
+        delivered_elapsed = time.perf_counter() - load_started
+
+    latencies = sorted(stats.latencies)
+    connect_ms = sorted(t * 1000 for t in stats.connect_times)
+    return {
+        'connected': len(stats.connect_times),
+        'connect_failures': stats.connect_failures,
+        'connections_per_sec': len(stats.connect_times) / connect_elapsed if connect_elapsed else 0.0,
+        'connect_p50_ms': percentile(connect_ms, 50),
+        'connect_p99_ms': percentile(connect_ms, 99),
+        'sent': stats.sent,
+        'delivered': stats.delivered,
+        'errors': stats.errors,
+        'sent_per_sec': stats.sent / sent_elapsed,
+        'delivered_per_sec': stats.delivered / delivered_elapsed,
+        'latency_p50_ms': percentile(latencies, 50),
+        'latency_p99_ms': percentile(latencies, 99),
+        'latency_p999_ms': percentile(latencies, 99.9),
+        'latency_max_ms': latencies[-1] if latencies else None
+    }
+
+
+def fmt(value):
+    return '-' if value is None else f'{value:.2f}'
+
+
+def print_results(results, baseline=None):
+    print(f"\n{'指标':<22} {'本次':>12}" + (f" {'基线':>12} {'变化':>8}" if baseline else ''))
+    for key in RESULT_KEYS:
+        value = results.get(key)
+        line = f"{key:<22} {fmt(value):>12}"
+        if baseline:
+            old = baseline.get(key)
+            change = f"{(value - old) / old:+.1%}" if value is not None and old else '-'
+            line += f" {fmt(old):>12} {change:>8}"
+        print(line)
+    print(f"\n发送 {results['sent']} 条，投递 {results['delivered']} 条，错误 {results['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='WebSocket负载基准测试')
+    parser.add_argument('--target', default='vercel_sync_server', help='被测服务器模块 (vercel_sync_server / wsgi_app)')
+    parser.add_argument('--url', help='测试已运行的服务器，不在本地启动')
+    parser.add_argument('--port', type=int, default=18766)
+    parser.add_argument('--workers', type=int, default=1, help='大于1时通过sync_workers以多worker方式启动')
+    parser.add_argument('--clients', type=int, default=500, help='模拟设备数')
+    parser.add_argument('--groups', type=int, default=10, help='群组数，0表示全员广播')
+    parser.add_argument('--rate', type=float, default=1.0, help='每个设备每秒发送的message_sync数')
+    parser.add_argument('--heartbeat', type=float, default=30.0, help='心跳间隔（秒）')
+    parser.add_argument('--duration', type=float, default=20.0, help='发送阶段时长（秒）')
+    parser.add_argument('--drain', type=float, default=2.0, help='停止发送后继续接收的时间（秒）')
+    parser.add_argument('--batch', action='store_true', help='设备声明支持batch出站合并')
+    parser.add_argument('--connect-concurrency', type=int, default=200, help='同时进行的建连数')
+    parser.add_argument('--output', default='bench_results', help='结果保存目录')
+    parser.add_argument('--compare', help='与之前保存的结果文件对比')
+    args = parser.parse_args()
+
+    fd_limit = raise_fd_limit()
+    if args.clients + 64 > fd_limit:
+        print(f"警告: 文件描述符上限 {fd_limit} 可能不足以支持 {args.clients} 个连接")
+
+    server = None
+    if args.url is None:
+        args.url = f'ws://127.0.0.1:{args.port}/ws'
+        server = start_server(args)
+    try:
+        results = asyncio.run(run_load(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+    print_results(results, baseline)
+
+    os.makedirs(args.output, exist_ok=True)
+    revision = git_revision()
+    path = os.path.join(args.output, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{revision}.json")
+    params = {k: v for k, v in vars(args).items() if k not in ('output', 'compare')}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'revision': revision, 'params': params, 'results': results}, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存: {path}")
+
+
+if __name__ == "__main__":
+    main()
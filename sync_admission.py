@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+连接准入控制
+在WebSocket升级之前检查总连接数、单IP并发连接数和接入速率（令牌桶），
+超限的请求直接返回503，不做握手，大批客户端同时重连时已连接的会话不受影响
+"""
+
+import math
+import random
+from typing import Dict
+
+from sync_ratelimit import RateLimiter
+
+# 拒绝原因，用作统计和指标标签
+CAPACITY = 'capacity'
+PER_IP = 'per_ip'
+RATE = 'rate'
+REASONS = (CAPACITY, PER_IP, RATE)
+
+
+def client_ip(request, trust_forwarded: bool = False) -> str:
+    """客户端IP；部署在反向代理后面时取X-Forwarded-For中的第一个地址"""
+    if trust_forwarded:
+        forwarded = request.headers.get('X-Forwarded-For')
+        if forwarded:
+            return forwarded.split(',', 1)[0].strip()
+    return request.remote or ''
+
+
+class AdmissionControl:
+    def __init__(self, max_connections: int = 0, per_ip: int = 0, rate: float = 0.0,
+                 burst: float = 0.0, retry_after: float = 5.0):
+        """max_connections / per_ip / rate 为0表示不限制"""
+        self.max_connections = max_connections
+        self.per_ip = per_ip
+        self.retry_after = retry_after
+        self.connections = 0
+        self.by_ip: Dict[str, int] = {}
+        # 接入速率复用连接限流的令牌桶，整个进程共用一个桶
+        self._limiter = RateLimiter({RATE: (rate, max(burst, 1.0))}) if rate > 0 else None
+        self._buckets = self._limiter.new_buckets() if self._limiter is not None else None
+        self.admitted = 0
+        self.rejected = dict.fromkeys(REASONS, 0)
+
+    def admit(self, ip: str):
+        """
+        尝试接入一个连接，成功返回(None, 0)并占用一个名额（之后必须调用release），
+        被拒绝时返回(原因, 建议的Retry-After秒数)
+        """
+        if self.max_connections and self.connections >= self.max_connections:
+            return self._reject(CAPACITY, self._jittered(self.retry_after))
+        if self.per_ip and self.by_ip.get(ip, 0) >= self.per_ip:
+            return self._reject(PER_IP, self._jittered(self.retry_after))
+        if self._limiter is not None and not self._limiter.allow(self._buckets, RATE):
+            wait = self._limiter.retry_after(self._buckets, RATE)
+            return self._reject(RATE, self._jittered(wait))
+        self.connections += 1
+        self.by_ip[ip] = self.by_ip.get(ip, 0) + 1
+        self.admitted += 1
+        return None, 0
+
+    def release(self, ip: str):
+        self.connections -= 1
+        count = self.by_ip.get(ip, 0) - 1
+        if count > 0:
+            self.by_ip[ip] = count
+        else:
+            self.by_ip.pop(ip, None)
+
+    def _reject(self, reason: str, retry_after: int):
+        self.rejected[reason] += 1
+        return reason, retry_after
+
+    @staticmethod
+    def _jittered(seconds: float) -> int:
+        """Retry-After只能是整数秒；在[s, 2s]内随机，被拒绝的客户端不会在同一时刻再次涌入"""
+        seconds = max(seconds, 1.0)
+        return math.ceil(random.uniform(seconds, 2 * seconds))
+
+    def snapshot(self) -> dict:
+        return {
+            'connections': self.connections,
+            'max_connections': self.max_connections or None,
+            'per_ip': self.per_ip or None,
+            'admitted': self.admitted,
+            'rejected': dict(self.rejected)
+        }
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+附件存储
+图片、文件等内容不再内嵌在message_sync里经WebSocket广播，而是先通过HTTP上传，
+消息只携带一个小的引用 {"id": sha256, "size": ..., "content_type": ...}。
+文件按内容的sha256寻址，相同内容只存一份；上传以流的形式分块写盘，
+写盘和摘要计算在线程池中进行，下载由FileResponse用sendfile发送并支持Range
+"""
+
+import asyncio
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+from typing import Dict, Optional
+from urllib.parse import quote
+
+# 累积到这个大小后再交给线程池写一次盘，减少线程切换
+WRITE_BUFFER = 1024 * 1024
+READ_CHUNK = 64 * 1024
+
+_ID_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+# 可以在浏览器中直接显示的类型。附件内容由用户上传、与服务器同源，HTML/SVG/XML等
+# 能执行脚本的类型一律作为下载文件返回，防止存储型XSS
+INLINE_TYPES = frozenset((
+    'image/png', 'image/jpeg', 'image/gif', 'image/webp', 'image/bmp',
+    'audio/mpeg', 'audio/ogg', 'audio/wav', 'video/mp4', 'video/webm', 'text/plain',
+))
+
+
+def download_headers(name: Optional[str] = None) -> Dict[str, str]:
+    """
+    下载响应头。Content-Type按可选的文件名推断，只有INLINE_TYPES中的类型才内联显示，
+    其余一律为application/octet-stream并以attachment方式下载；nosniff和CSP sandbox
+    防止浏览器把内容当作页面执行
+    """
+    content_type = 'application/octet-stream'
+    if name:
+        guessed = mimetypes.guess_type(name)[0]
+        if guessed in INLINE_TYPES:
+            content_type = guessed
+    disposition = 'inline' if content_type in INLINE_TYPES else 'attachment'
+    if name:
+        disposition += f"; filename*=UTF-8''{quote(name)}"
+    return {
+        'Content-Type': content_type,
+        'Content-Disposition': disposition,
+        'X-Content-Type-Options': 'nosniff',
+        'Content-Security-Policy': "default-src 'none'; sandbox",
+        'Cache-Control': 'public, max-age=31536000, immutable'
+    }
+
+
+class AttachmentTooLarge(Exception):
+    pass
+
+
+class AttachmentStore:
+    def __init__(self, directory: str, max_bytes: int = 25 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.tmp_dir = os.path.join(directory, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.stats = {'uploads': 0, 'bytes': 0, 'deduplicated': 0, 'rejected': 0}
+
+    def _path(self, attachment_id: str) -> str:
+        return os.path.join(self.directory, attachment_id[:2], attachment_id)
+
+    def path(self, attachment_id: str) -> Optional[str]:
+        """已存在的附件文件路径；id格式不对（防止路径穿越）或不存在时返回None"""
+        if not _ID_PATTERN.match(attachment_id):
+            return None
+        path = self._path(attachment_id)
+        return path if os.path.isfile(path) else None
+
+    async def save(self, stream):
+        """
+        从aiohttp的StreamReader读取上传内容并保存，返回(附件id, 字节数)。
+        超过max_bytes抛出AttachmentTooLarge，内容为空抛出ValueError，临时文件都会被删除
+        """
+        loop = asyncio.get_event_loop()
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        f = os.fdopen(fd, 'wb')
+        digest = hashlib.sha256()
+        size = 0
+        buffer = bytearray()
+        try:
+            async for chunk in stream.iter_chunked(READ_CHUNK):
+                size += len(chunk)
+                if size > self.max_bytes:
+                    self.stats['rejected'] += 1
+                    raise AttachmentTooLarge(f"Attachment exceeds {self.max_bytes} bytes")
+                buffer += chunk
+                if len(buffer) >= WRITE_BUFFER:
+                    await loop.run_in_executor(None, self._write, f, digest, bytes(buffer))
+                    buffer.clear()
+            if size == 0:
+                raise ValueError("Empty attachment")
+            if buffer:
+                await loop.run_in_executor(None, self._write, f, digest, bytes(buffer))
+            attachment_id = digest.hexdigest()
+            created = await loop.run_in_executor(None, self._commit, f, tmp_path, attachment_id)
+        except BaseException:
+            f.close()
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        self.stats['uploads'] += 1
+        if created:
+            self.stats['bytes'] += size
+        else:
+            self.stats['deduplicated'] += 1
+        return attachment_id, size
+
+    @staticmethod
+    def _write(f, digest, data: bytes):
+        digest.update(data)
+        f.write(data)
+
+    def _commit(self, f, tmp_path: str, attachment_id: str) -> bool:
+        """把临时文件移动到内容地址，内容已存在时丢弃临时文件；返回是否新建了文件"""
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        path = self._path(attachment_id)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        return True
+
+    def snapshot(self):
+        return dict(self.stats, max_bytes=self.max_bytes)
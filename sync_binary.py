@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+紧凑二进制协议
+与JSON文本协议表达相同的消息，通过 WSMsgType.BINARY 帧传输：
+消息类型和常用字段名用小整数表示，timestamp 用毫秒时间戳代替ISO-8601字符串
+
+帧格式:   MAGIC(1字节) + 消息体
+消息体:   类型(varint，0表示后跟字符串类型名) + 字段表
+字段表:   字段数(varint) + [键 + 值]*
+键:       varint，奇数为内置字段id (id << 1 | 1)，偶数为字符串长度 (len << 1) 后跟UTF-8
+值:       1字节标签 + 内容，见下方 T_* 常量
+整数均为zigzag编码的varint
+
+MESSAGE_TYPES 和 FIELDS 只能在末尾追加，不能修改已有顺序
+"""
+
+import struct
+from datetime import datetime
+
+MAGIC = 0xB1
+
+MESSAGE_TYPES = (
+    'register', 'register_success', 'heartbeat', 'message_sync', 'user_sync',
+    'group_sync', 'test_sync', 'user_joined', 'error', 'subscribe',
+    'subscribe_success', 'unsubscribe', 'unsubscribe_success', 'resume',
+    'history_replay', 'batch', 'sync_ack', 'sync_conflict', 'snapshot',
+    'state_snapshot', 'message_ack', 'presence', 'presence_snapshot',
+    'reconnect',
+)
+
+FIELDS = (
+    'device_id', 'timestamp', 'data', 'id', 'username', 'message', 'seq',
+    'last_seq', 'groups', 'group_id', 'conversation_id', 'client_id', 'events',
+    'count', 'truncated', 'ops', 'batch', 'encoding', 'content', 'sender_id',
+    'sender_name', 'created_at', 'name', 'members', 'avatar', 'status', 'text',
+    'version', 'base_version', 'unset', 'add', 'remove', 'kind', 'users',
+    'duplicate', 'retry_after', 'joined', 'left', 'online', 'reset', 'clients',
+    'attachments', 'size', 'content_type', 'url',
+)
+
+# 值为ISO-8601字符串时按毫秒时间戳编码的字段
+TIME_FIELDS = frozenset(('timestamp', 'created_at'))
+
+T_NULL, T_TRUE, T_FALSE, T_INT, T_FLOAT, T_STR, T_LIST, T_MAP, T_TIME, T_MESSAGE = range(10)
+
+_TYPE_IDS = {name: index + 1 for index, name in enumerate(MESSAGE_TYPES)}
+_FIELD_IDS = {name: index for index, name in enumerate(FIELDS)}
+_DOUBLE = struct.Struct('<d')
+
+
+class BinaryDecodeError(ValueError):
+    pass
+
+
+def _write_varint(out: bytearray, value: int):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _write_int(out: bytearray, value: int):
+    # zigzag，负数也能用短varint表示
+    _write_varint(out, (value << 1) if value >= 0 else ((-value << 1) - 1))
+
+
+def _write_str(out: bytearray, value: str):
+    raw = value.encode('utf-8')
+    _write_varint(out, len(raw))
+    out += raw
+
+
+def _epoch_ms(value: str):
+    try:
+        return int(datetime.fromisoformat(value).timestamp() * 1000)
+    except ValueError:
+        return None
+
+
+def _write_key(out: bytearray, key: str):
+    field_id = _FIELD_IDS.get(key)
+    if field_id is not None:
+        _write_varint(out, (field_id << 1) | 1)
+    else:
+        raw = key.encode('utf-8')
+        _write_varint(out, len(raw) << 1)
+        out += raw
+
+
+def _write_fields(out: bytearray, mapping: dict, skip_type: bool):
+    items = [(k, v) for k, v in mapping.items() if not (skip_type and k == 'type')]
+    _write_varint(out, len(items))
+    for key, value in items:
+        key = str(key)
+        _write_key(out, key)
+        if key in TIME_FIELDS and isinstance(value, str):
+            ms = _epoch_ms(value)
+            if ms is not None:
+                out.append(T_TIME)
+                _write_int(out, ms)
+                continue
+        _write_value(out, value)
+
+
+def _write_body(out: bytearray, message: dict):
+    type_id = _TYPE_IDS.get(message.get('type'))
+    if type_id is not None:
+        _write_varint(out, type_id)
+    else:
+        _write_varint(out, 0)
+        _write_str(out, str(message.get('type', '')))
+    _write_fields(out, message, skip_type=True)
+
+
+def _write_value(out: bytearray, value):
+    if value is None:
+        out.append(T_NULL)
+    elif value is True:
+        out.append(T_TRUE)
+    elif value is False:
+        out.append(T_FALSE)
+    elif isinstance(value, int):
+        out.append(T_INT)
+        _write_int(out, value)
+    elif isinstance(value, float):
+        out.append(T_FLOAT)
+        out += _DOUBLE.pack(value)
+    elif isinstance(value, str):
+        out.append(T_STR)
+        _write_str(out, value)
+    elif isinstance(value, dict):
+        if 'type' in value and value.get('type') in _TYPE_IDS:
+            # 嵌套的协议消息（batch/history_replay中的事件）
+            out.append(T_MESSAGE)
+            _write_body(out, value)
+        else:
+            out.append(T_MAP)
+            _write_fields(out, value, skip_type=False)
+    elif isinstance(value, (list, tuple)):
+        out.append(T_LIST)
+        _write_varint(out, len(value))
+        for item in value:
+            _write_value(out, item)
+    else:
+        raise TypeError(f"Unsupported value type: {type(value).__name__}")
+
+
+def encode(message: dict) -> bytes:
+    """把消息dict编码为二进制帧"""
+    out = bytearray((MAGIC,))
+    _write_body(out, message)
+    return bytes(out)
+
+
+def encode_joined(header: dict, events) -> bytes:
+    """
+    把header和多个已编码的消息帧拼成 {...header, events: [...]}，
+    事件直接复用各自的编码结果，不重新编码
+    """
+    out = bytearray((MAGIC,))
+    _write_varint(out, _TYPE_IDS[header['type']])
+    fields = [(k, v) for k, v in header.items() if k != 'type']
+    _write_varint(out, len(fields) + 1)
+    for key, value in fields:
+        _write_key(out, key)
+        _write_value(out, value)
+    _write_key(out, 'events')
+    out.append(T_LIST)
+    _write_varint(out, len(events))
+    for event in events:
+        out.append(T_MESSAGE)
+        out += memoryview(event)[1:]
+    return bytes(out)
+
+
+class _Reader:
+    __slots__ = ('buf', 'pos')
+
+    def __init__(self, buf):
+        self.buf = buf
+        self.pos = 0
+
+    def byte(self) -> int:
+        try:
+            value = self.buf[self.pos]
+        except IndexError:
+            raise BinaryDecodeError("Truncated frame")
+        self.pos += 1
+        return value
+
+    def varint(self) -> int:
+        b = self.byte()
+        if b < 0x80:
+            # 绝大多数长度、字段id都是单字节
+            return b
+        result = b & 0x7F
+        shift = 7
+        while True:
+            b = self.byte()
+            result |= (b & 0x7F) << shift
+            if not b & 0x80:
+                return result
+            shift += 7
+            if shift > 63:
+                raise BinaryDecodeError("Varint too long")
+
+    def int(self) -> int:
+        value = self.varint()
+        return (value >> 1) ^ -(value & 1)
+
+    def raw(self, length: int) -> bytes:
+        end = self.pos + length
+        if end > len(self.buf):
+            raise BinaryDecodeError("Truncated frame")
+        chunk = self.buf[self.pos:end]
+        self.pos = end
+        return chunk
+
+    def str(self) -> str:
+        try:
+            return self.raw(self.varint()).decode('utf-8')
+        except UnicodeDecodeError:
+            raise BinaryDecodeError("Invalid UTF-8")
+
+    def key(self) -> str:
+        key = self.varint()
+        if key & 1:
+            try:
+                return FIELDS[key >> 1]
+            except IndexError:
+                raise BinaryDecodeError(f"Unknown field id: {key >> 1}")
+        try:
+            return self.raw(key >> 1).decode('utf-8')
+        except UnicodeDecodeError:
+            raise BinaryDecodeError("Invalid UTF-8")
+
+    def fields(self, result: dict) -> dict:
+        for _ in range(self.varint()):
+            key = self.key()
+            result[key] = self.value()
+        return result
+
+    def body(self) -> dict:
+        type_id = self.varint()
+        if type_id == 0:
+            message_type = self.str()
+        elif type_id <= len(MESSAGE_TYPES):
+            message_type = MESSAGE_TYPES[type_id - 1]
+        else:
+            raise BinaryDecodeError(f"Unknown message type id: {type_id}")
+        return self.fields({'type': message_type})
+
+    def value(self):
+        tag = self.byte()
+        if tag == T_NULL:
+            return None
+        if tag == T_TRUE:
+            return True
+        if tag == T_FALSE:
+            return False
+        if tag == T_INT or tag == T_TIME:
+            return self.int()
+        if tag == T_FLOAT:
+            return _DOUBLE.unpack(self.raw(8))[0]
+        if tag == T_STR:
+            return self.str()
+        if tag == T_LIST:
+            return [self.value() for _ in range(self.varint())]
+        if tag == T_MAP:
+            return self.fields({})
+        if tag == T_MESSAGE:
+            return self.body()
+        raise BinaryDecodeError(f"Unknown value tag: {tag}")
+
+
+def decode(data) -> dict:
+    """解码二进制帧为消息dict，timestamp等时间字段为毫秒时间戳"""
+    reader = _Reader(bytes(data))
+    if reader.byte() != MAGIC:
+        raise BinaryDecodeError("Bad magic byte")
+    message = reader.body()
+    if reader.pos != len(reader.buf):
+        raise BinaryDecodeError("Trailing bytes")
+    return message
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+跨进程广播总线
+多worker模式下，各worker把广播事件发到总线，由其他worker投递给各自的本地客户端
+
+- BusHub: 运行在主进程，通过Unix域套接字把一个worker的消息转发给其他所有worker
+- UnixSocketBus: worker端连接
+- LocalBus: 进程内替身，多个服务器实例在同一进程内互通，便于本地调试
+
+总线消息格式: 长度(4字节) + 标志(1字节) + 群组id长度(2字节) + 群组id + 帧的JSON字节
+"""
+
+import asyncio
+import logging
+import struct
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('>IBH')
+FLAG_GROUP = 0x01
+
+# 单个worker积压超过这个字节数时，主进程丢弃发给它的消息而不是无限缓冲
+HUB_WRITE_LIMIT = 16 * 1024 * 1024
+
+# 由多worker启动器在worker进程中设置
+_worker_config = {'path': None, 'counter': None}
+
+
+def configure_worker(path: str, counter):
+    """在worker进程中记录总线地址和共享序号计数器（multiprocessing.Value）"""
+    _worker_config['path'] = path
+    _worker_config['counter'] = counter
+
+
+def create_bus():
+    """当前进程是多worker模式下的worker时返回总线连接，否则返回None"""
+    if _worker_config['path'] is None:
+        return None
+    return UnixSocketBus(_worker_config['path'])
+
+
+def shared_sequencer() -> Optional[Callable[[], int]]:
+    """多worker模式下返回跨进程单调递增的序号生成器"""
+    counter = _worker_config['counter']
+    if counter is None:
+        return None
+
+    def next_seq() -> int:
+        with counter.get_lock():
+            counter.value += 1
+            return counter.value
+
+    return next_seq
+
+
+def pack(group_id, data: bytes) -> bytes:
+    group = b'' if group_id is None else str(group_id).encode('utf-8')
+    flags = FLAG_GROUP if group_id is not None else 0
+    return _HEADER.pack(1 + 2 + len(group) + len(data), flags, len(group)) + group + data
+
+
+def unpack(body: bytes):
+    """body不含4字节长度前缀，返回 (group_id, data)"""
+    flags = body[0]
+    group_len = struct.unpack_from('>H', body, 1)[0]
+    group = body[3:3 + group_len].decode('utf-8') if flags & FLAG_GROUP else None
+    return group, body[3 + group_len:]
+
+
+async def _read_message(reader: asyncio.StreamReader) -> bytes:
+    length = struct.unpack('>I', await reader.readexactly(4))[0]
+    return await reader.readexactly(length)
+
+
+class BusHub:
+    def __init__(self, path: str):
+        self.path = path
+        self.writers: List[asyncio.StreamWriter] = []
+        self.relayed = 0
+        self.dropped = 0
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path)
+
+    async def close(self):
+        # 先断开worker连接让各转发任务自然结束，再关闭监听
+        for writer in list(self.writers):
+            writer.close()
+        await asyncio.sleep(0)
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        self.writers.append(writer)
+        try:
+            while True:
+                body = await _read_message(reader)
+                frame = struct.pack('>I', len(body)) + body
+                for other in self.writers:
+                    if other is writer:
+                        continue
+                    if other.transport.get_write_buffer_size() > HUB_WRITE_LIMIT:
+                        self.dropped += 1
+                        continue
+                    other.write(frame)
+                    self.relayed += 1
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.writers.remove(writer)
+            writer.close()
+
+
+class UnixSocketBus:
+    def __init__(self, path: str):
+        self.path = path
+        self.stats = {'published': 0, 'received': 0, 'dropped': 0}
+        self._writer = None
+        self._task = None
+
+    async def start(self, on_message: Callable[[Optional[str], bytes], None]):
+        """连接主进程的BusHub，on_message(group_id, data) 处理其他worker的广播"""
+        for _ in range(50):
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(self.path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                await asyncio.sleep(0.1)
+        else:
+            raise RuntimeError(f"无法连接广播总线: {self.path}")
+        self._task = asyncio.ensure_future(self._read_loop(reader, on_message))
+
+    async def _read_loop(self, reader, on_message):
+        try:
+            while True:
+                group_id, data = unpack(await _read_message(reader))
+                self.stats['received'] += 1
+                try:
+                    on_message(group_id, data)
+                except Exception as e:
+                    logger.error(f"处理总线消息出错: {e!r}")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logger.error("广播总线连接已断开")
+            self._writer = None
+
+    def publish(self, group_id, data: bytes):
+        if self._writer is None or self._writer.is_closing():
+            self.stats['dropped'] += 1
+            return
+        self._writer.write(pack(group_id, data))
+        self.stats['published'] += 1
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+
+
+class LocalBus:
+    """进程内替身：同一个hub上的LocalBus互相转发，行为与UnixSocketBus一致"""
+
+    def __init__(self, peers: Optional[list] = None):
+        self.peers = peers if peers is not None else []
+        self.stats = {'published': 0, 'received': 0, 'dropped': 0}
+        self._on_message = None
+
+    async def start(self, on_message):
+        self._on_message = on_message
+        self.peers.append(self)
+
+    def publish(self, group_id, data: bytes):
+        self.stats['published'] += 1
+        for peer in self.peers:
+            if peer is not self:
+                peer.stats['received'] += 1
+                peer._on_message(group_id, data)
+
+    async def close(self):
+        if self in self.peers:
+            self.peers.remove(self)
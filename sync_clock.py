@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+共享时钟
+热路径上的时间都用monotonic整数毫秒表示；消息里的ISO-8601时间戳
+每个tick最多格式化一次，同一tick内的所有消息复用同一个字符串
+"""
+
+import time
+from datetime import datetime
+
+
+class Clock:
+    def __init__(self, tick: float = 0.001):
+        self.tick = tick
+        self._stamp = 0.0
+        self._iso = ''
+
+    @staticmethod
+    def now_ms() -> int:
+        """monotonic毫秒数，只用于计算间隔"""
+        return time.monotonic_ns() // 1000000
+
+    def iso(self) -> str:
+        """当前本地时间的ISO-8601字符串（毫秒精度）"""
+        now = time.time()
+        if now - self._stamp >= self.tick:
+            self._stamp = now
+            self._iso = datetime.fromtimestamp(now).isoformat(timespec='milliseconds')
+        return self._iso
+
+
+clock = Clock()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JSON编解码层
+三个服务器统一通过这里序列化，安装了orjson/ujson时自动使用更快的实现，
+否则回退到标准库；默认输出紧凑格式（无多余空格，中文不转义）
+
+可用环境变量 SYNC_JSON_BACKEND=orjson|ujson|json 强制指定实现
+"""
+
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('orjson', 'ujson', 'json')
+
+
+def _load_orjson():
+    import orjson
+
+    option = orjson.OPT_NON_STR_KEYS
+
+    def dumps_bytes(obj) -> bytes:
+        return orjson.dumps(obj, option=option)
+
+    def dumps(obj) -> str:
+        return orjson.dumps(obj, option=option).decode('utf-8')
+
+    # orjson.JSONDecodeError 是 json.JSONDecodeError 的子类
+    return dumps, dumps_bytes, orjson.loads, orjson.JSONDecodeError
+
+
+def _load_ujson():
+    import ujson
+
+    def dumps(obj) -> str:
+        return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False)
+
+    def dumps_bytes(obj) -> bytes:
+        return dumps(obj).encode('utf-8')
+
+    return dumps, dumps_bytes, ujson.loads, getattr(ujson, 'JSONDecodeError', ValueError)
+
+
+def _load_json():
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+    def dumps(obj) -> str:
+        return encoder.encode(obj)
+
+    def dumps_bytes(obj) -> bytes:
+        return encoder.encode(obj).encode('utf-8')
+
+    return dumps, dumps_bytes, json.loads, json.JSONDecodeError
+
+
+_LOADERS = {'orjson': _load_orjson, 'ujson': _load_ujson, 'json': _load_json}
+
+
+def load_backend(name: str):
+    """加载指定实现，返回 (dumps, dumps_bytes, loads, DecodeError)；未安装时抛出ImportError"""
+    return _LOADERS[name]()
+
+
+def _select():
+    preferred = os.environ.get('SYNC_JSON_BACKEND')
+    candidates = (preferred,) if preferred else BACKENDS
+    for name in candidates:
+        if name not in _LOADERS:
+            raise ValueError(f"SYNC_JSON_BACKEND must be one of {BACKENDS}")
+        try:
+            return (name,) + load_backend(name)
+        except ImportError:
+            if preferred:
+                logger.warning(f"JSON实现 {name} 未安装，回退到标准库json")
+    return ('json',) + load_backend('json')
+
+
+backend, dumps, dumps_bytes, loads, DecodeError = _select()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+消息去重缓存
+记录最近见过的消息id及其分配的序号，客户端重试同一条消息时直接确认，不再重复广播。
+容量和存活时间都有上限，内存占用不随运行时间增长
+"""
+
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Optional
+
+# 超过这个长度的id只保存摘要，单个条目的大小有上界
+MAX_KEY_LENGTH = 64
+
+
+class DedupCache:
+    def __init__(self, maxsize: int = 100000, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # id -> (过期时间, 序号)；所有条目TTL相同，插入顺序即过期顺序
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _key(message_id):
+        key = str(message_id)
+        if len(key) > MAX_KEY_LENGTH:
+            return hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        return key
+
+    def get(self, message_id) -> Optional[int]:
+        """消息id在有效期内出现过时返回当时分配的序号，否则返回None"""
+        entry = self._entries.get(self._key(message_id))
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def add(self, message_id, seq: int):
+        now = time.monotonic()
+        key = self._key(message_id)
+        # 过期后再次出现的id重新排到队尾
+        self._entries.pop(key, None)
+        self._entries[key] = (now + self.ttl, seq)
+        # 从最旧处淘汰过期条目和超出容量的条目，均摊O(1)
+        entries = self._entries
+        while entries:
+            expires, _ = next(iter(entries.values()))
+            if len(entries) <= self.maxsize and expires >= now:
+                break
+            entries.popitem(last=False)
+            self.evictions += 1
+
+    def snapshot(self):
+        return {'size': len(self._entries), 'max_size': self.maxsize, 'ttl': self.ttl,
+                'hits': self.hits, 'evictions': self.evictions}
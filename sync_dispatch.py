@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+消息分发表
+每种消息类型登记一个处理器和字段规格，分发时按类型查表O(1)找到处理器；
+字段规格在启动时编译成校验函数，处理器只会收到格式正确的消息。
+新增同步类型只需调用register，不需要修改连接处理循环
+
+字段规格: {字段: 类型} 或 {字段: (类型, 错误信息)}
+    类型      'str' / 'int' / 'number' / 'bool' / 'list' / 'dict' / 'any'，多个类型用'|'分隔
+    可选      类型末尾加'?'；必填字段为None、空字符串或空容器时视为缺失
+    嵌套字段  'data.id'
+"""
+
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+_TYPES = {
+    'str': (str,),
+    'int': (int,),
+    'number': (int, float),
+    'bool': (bool,),
+    'list': (list,),
+    'dict': (dict,),
+    'any': (object,),
+}
+
+
+def compile_schema(schema: Dict[str, object]) -> Optional[Callable[[dict], Optional[str]]]:
+    """把字段规格编译成校验函数 validate(data) -> 错误信息或None，规格为空时返回None"""
+    if not schema:
+        return None
+    checks = []
+    for path, spec in schema.items():
+        message = None
+        if isinstance(spec, tuple):
+            spec, message = spec
+        optional = spec.endswith('?')
+        names = spec.rstrip('?').split('|')
+        try:
+            types = tuple(t for name in names for t in _TYPES[name])
+        except KeyError as e:
+            raise ValueError(f"Unknown type {e} in schema for {path}")
+        # bool是int的子类，只有显式声明bool时才接受
+        reject_bool = 'bool' not in names and 'any' not in names
+        keys = tuple(path.split('.'))
+        checks.append((keys, types, optional, reject_bool,
+                       message or f"Missing {path}", message or f"Invalid {path}"))
+    checks = tuple(checks)
+
+    def validate(data: dict) -> Optional[str]:
+        for keys, types, optional, reject_bool, missing, invalid in checks:
+            value = data
+            for key in keys:
+                value = value.get(key) if isinstance(value, dict) else None
+            if value is None or (isinstance(value, (str, list, dict)) and not value):
+                if not optional:
+                    return missing
+                if value is None:
+                    continue
+            if not isinstance(value, types) or (reject_bool and isinstance(value, bool)):
+                return invalid
+        return None
+
+    return validate
+
+
+class Route:
+    __slots__ = ('handler', 'validate', 'registered', 'calls', 'rejected', 'errors', 'seconds', 'max_seconds')
+
+    def __init__(self, handler, validate, registered):
+        self.handler = handler
+        self.validate = validate
+        self.registered = registered
+        self.calls = 0
+        self.rejected = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+
+class Dispatcher:
+    def __init__(self, observe: Callable = None):
+        """observe(seconds, label=类型) 每次处理完成后调用，用于导出处理耗时指标"""
+        self.routes: Dict[str, Route] = {}
+        self._observe = observe
+
+    def __contains__(self, message_type):
+        return message_type in self.routes
+
+    def register(self, message_type: str, handler: Callable[..., Awaitable[None]],
+                 schema: Dict[str, object] = None, registered: bool = False):
+        """
+        登记消息类型。handler(session, data) 为协程；
+        registered=True 的类型只接受已注册的连接
+        """
+        self.routes[message_type] = Route(handler, compile_schema(schema), registered)
+
+    def label(self, message_type) -> str:
+        """指标标签：未登记的类型统一记为unknown，避免标签基数失控"""
+        return message_type if message_type in self.routes else 'unknown'
+
+    async def dispatch(self, session, data: dict) -> Optional[str]:
+        """处理一条消息，请求不合法时返回要回复给客户端的错误信息"""
+        message_type = data.get('type')
+        route = self.routes.get(message_type)
+        if route is None:
+            return f"Unknown message type: {message_type}"
+        if route.registered and session.client_id is None:
+            route.rejected += 1
+            return "Not registered"
+        if route.validate is not None:
+            error = route.validate(data)
+            if error is not None:
+                route.rejected += 1
+                return error
+
+        started = time.perf_counter()
+        try:
+            await route.handler(session, data)
+        except Exception:
+            route.errors += 1
+            raise
+        elapsed = time.perf_counter() - started
+        route.calls += 1
+        route.seconds += elapsed
+        if elapsed > route.max_seconds:
+            route.max_seconds = elapsed
+        if self._observe is not None:
+            self._observe(elapsed, label=message_type)
+        return None
+
+    def snapshot(self) -> Dict[str, dict]:
+        """每种类型的处理次数、拒绝/出错次数和平均/最大耗时（毫秒）"""
+        return {
+            message_type: {
+                'calls': route.calls,
+                'rejected': route.rejected,
+                'errors': route.errors,
+                'avg_ms': round(route.seconds / route.calls * 1000, 3) if route.calls else 0.0,
+                'max_ms': round(route.max_seconds * 1000, 3)
+            }
+            for message_type, route in self.routes.items()
+        }
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+共享事件日志
+HTTP传输（长轮询/SSE）使用的有界事件日志，客户端带着游标读取，
+一次请求可以取回游标之后的多条事件；事件写入时只序列化一次
+
+存储接口（两种实现相同）:
+    append(event, group_id, sender) -> seq   追加事件，分配连续递增的序号
+    read(cursor, groups, exclude, limit)     读取游标之后的事件
+    wait(cursor, timeout) -> bool            阻塞直到有新事件或超时（长轮询）
+    last_seq / first_seq / len()             最新、最早的序号和事件数
+    shared                                   是否为多实例共享的存储
+
+- EventLog: 进程内存，只有同一进程内的请求能互相看到和唤醒
+- RedisEventLog: Redis Stream，多个Serverless实例共用，等待新事件使用XREAD BLOCK，
+  不依赖同一实例上的其他请求唤醒。使用标准库实现的最小RESP客户端，不增加依赖
+
+SYNC_EVENT_STORE设置为 redis://[:密码@]主机:端口/库 或 rediss://（TLS）时使用Redis
+"""
+
+import os
+import threading
+import time
+from typing import List, Optional, Set, Tuple
+from urllib.parse import unquote, urlparse
+
+import sync_codec
+
+
+class EventStoreError(Exception):
+    """共享事件存储返回错误"""
+
+
+def _filter(window, groups: Optional[Set[str]], exclude) -> List[Tuple[int, str]]:
+    """按订阅群组过滤，去掉发送者自己的事件"""
+    events = []
+    for seq, group_id, sender, text in window:
+        if sender is not None and sender == exclude:
+            continue
+        if groups is not None and group_id is not None and group_id not in groups:
+            continue
+        events.append((seq, text))
+    return events
+
+
+def create_event_log(maxlen: int = 10000):
+    """按SYNC_EVENT_STORE选择事件存储，默认进程内存"""
+    url = os.environ.get('SYNC_EVENT_STORE', '')
+    if url.startswith(('redis://', 'rediss://')):
+        return RedisEventLog(url, maxlen=maxlen, key=os.environ.get('SYNC_EVENT_STORE_KEY', 'sync:events'))
+    return EventLog(maxlen=maxlen)
+
+
+class EventLog:
+    shared = False
+
+    def __init__(self, maxlen: int = 10000):
+        self.maxlen = maxlen
+        self.last_seq = 0
+        # (seq, group_id, sender, json文本)，seq连续递增，按下标定位
+        self._events = []
+        self._cond = threading.Condition()
+
+    @property
+    def first_seq(self) -> int:
+        """日志中最早一条事件的序号，日志为空时为 last_seq + 1"""
+        return self._events[0][0] if self._events else self.last_seq + 1
+
+    def __len__(self):
+        return len(self._events)
+
+    def append(self, event: dict, group_id=None, sender=None) -> int:
+        """追加事件并唤醒等待中的读取者，返回分配的序号"""
+        with self._cond:
+            self.last_seq += 1
+            seq = self.last_seq
+            event['seq'] = seq
+            self._events.append((seq, None if group_id is None else str(group_id), sender,
+                                 sync_codec.dumps(event)))
+            # 超出容量一倍时再整体裁剪，均摊O(1)
+            if len(self._events) >= 2 * self.maxlen:
+                del self._events[:len(self._events) - self.maxlen]
+            self._cond.notify_all()
+        return seq
+
+    def wait(self, cursor: int, timeout: float) -> bool:
+        """阻塞直到有序号大于cursor的事件或超时，返回是否有新事件"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.last_seq <= cursor:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def read(self, cursor: int, groups: Optional[Set[str]] = None, exclude=None,
+             limit: int = 500) -> Tuple[List[Tuple[int, str]], int, bool]:
+        """
+        读取序号大于cursor的事件
+
+        groups为None时接收全部事件，否则只接收无群组事件和订阅群组的事件；
+        exclude为发送者自己，不回显自己发出的事件。
+        返回 (事件列表[(seq, json文本)], 新游标, 是否有事件已被淘汰)。
+        被过滤掉的事件同样推进游标，下次读取不会重复扫描。
+        """
+        with self._cond:
+            if cursor > self.last_seq:
+                # 游标来自已重启的实例，日志已不连续，客户端需要全量同步
+                return [], self.last_seq, True
+            first_seq = self.first_seq
+            truncated = cursor + 1 < first_seq
+            start = max(cursor + 1 - first_seq, 0)
+            window = self._events[start:start + limit]
+        events = _filter(window, groups, exclude)
+        next_cursor = window[-1][0] if window else max(cursor, first_seq - 1)
+        return events, next_cursor, truncated
+
+
+class _RedisConnection:
+    """最小的RESP客户端，一个线程一个连接（XREAD BLOCK期间连接被占用）"""
+
+    def __init__(self, url: str, timeout: float):
+        # 启用共享存储时才导入，不拖慢冷启动
+        import socket
+        import ssl
+        parsed = urlparse(url)
+        self.timeout = timeout
+        sock = socket.create_connection((parsed.hostname or 'localhost', parsed.port or 6379), timeout=timeout)
+        if parsed.scheme == 'rediss':
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=parsed.hostname)
+        self.sock = sock
+        self.file = sock.makefile('rb')
+        if parsed.password:
+            user = [unquote(parsed.username)] if parsed.username else []
+            self.command('AUTH', *user, unquote(parsed.password))
+        if parsed.path.strip('/'):
+            self.command('SELECT', parsed.path.strip('/'))
+
+    def command(self, *args, timeout: Optional[float] = None):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        self.sock.settimeout(self.timeout if timeout is None else timeout)
+        self.sock.sendall(b''.join(parts))
+        return self._reply()
+
+    def _reply(self):
+        line = self.file.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError('Redis连接已断开')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest
+        if kind == b'-':
+            raise EventStoreError(rest.decode('utf-8', 'replace'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            return None if length < 0 else self.file.read(length + 2)[:-2]
+        if kind == b'*':
+            length = int(rest)
+            return None if length < 0 else [self._reply() for _ in range(length)]
+        raise EventStoreError(f"无法解析的Redis回复: {line!r}")
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+# 分配序号和写入在一个脚本中完成，多个实例并发写入时序号与Stream中的顺序一致
+_APPEND_SCRIPT = """
+local seq = redis.call('INCR', KEYS[2])
+redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[1], seq .. '-0', 'g', ARGV[2], 's', ARGV[3], 'e', ARGV[4])
+return seq
+"""
+
+# 一次往返取得最新序号、最早事件的id和游标之后的一段事件
+_READ_SCRIPT = """
+local last = tonumber(redis.call('GET', KEYS[2]) or '0')
+local first = redis.call('XRANGE', KEYS[1], '-', '+', 'COUNT', 1)
+local window = redis.call('XRANGE', KEYS[1], ARGV[1], '+', 'COUNT', ARGV[2])
+return {last, first[1] and first[1][1] or '', window}
+"""
+
+
+class RedisEventLog:
+    shared = True
+
+    def __init__(self, url: str, maxlen: int = 10000, key: str = 'sync:events', timeout: float = 5.0):
+        self.url = url
+        self.maxlen = maxlen
+        self.key = key
+        self.seq_key = f"{key}:seq"
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _command(self, *args, timeout: Optional[float] = None):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = _RedisConnection(self.url, self.timeout)
+        try:
+            return conn.command(*args, timeout=timeout)
+        except (OSError, ConnectionError):
+            # 连接状态未知，丢弃后下次重连
+            conn.close()
+            self._local.conn = None
+            raise
+
+    @property
+    def last_seq(self) -> int:
+        return int(self._command('GET', self.seq_key) or 0)
+
+    @property
+    def first_seq(self) -> int:
+        first = self._command('XRANGE', self.key, '-', '+', 'COUNT', 1)
+        return int(first[0][0].split(b'-')[0]) if first else self.last_seq + 1
+
+    def __len__(self):
+        return self._command('XLEN', self.key)
+
+    def append(self, event: dict, group_id=None, sender=None) -> int:
+        """事件不带seq编码，读取时再拼上序号"""
+        seq = self._command(
+            'EVAL', _APPEND_SCRIPT, 2, self.key, self.seq_key, self.maxlen,
+            '' if group_id is None else str(group_id), '' if sender is None else sender,
+            sync_codec.dumps_bytes(event)
+        )
+        event['seq'] = seq
+        return seq
+
+    def wait(self, cursor: int, timeout: float) -> bool:
+        if timeout <= 0:
+            return self.last_seq > cursor
+        block_ms = max(int(timeout * 1000), 1)
+        reply = self._command('XREAD', 'COUNT', 1, 'BLOCK', block_ms, 'STREAMS', self.key, f"{cursor}-0",
+                              timeout=timeout + self.timeout)
+        return bool(reply)
+
+    def read(self, cursor: int, groups: Optional[Set[str]] = None, exclude=None,
+             limit: int = 500) -> Tuple[List[Tuple[int, str]], int, bool]:
+        """返回值与EventLog.read相同"""
+        last_seq, first_id, entries = self._command(
+            'EVAL', _READ_SCRIPT, 2, self.key, self.seq_key, f"{cursor + 1}-0", limit)
+        if cursor > last_seq:
+            return [], last_seq, True
+        first_seq = int(first_id.split(b'-')[0]) if first_id else last_seq + 1
+        window = []
+        for entry_id, values in entries:
+            seq = int(entry_id.split(b'-')[0])
+            fields = dict(zip(values[::2], values[1::2]))
+            text = fields[b'e'].decode('utf-8')
+            window.append((
+                seq, fields[b'g'].decode('utf-8') or None, fields[b's'].decode('utf-8') or None,
+                '{"seq":%d,%s' % (seq, text[1:])
+            ))
+        events = _filter(window, groups, exclude)
+        next_cursor = window[-1][0] if window else max(cursor, first_seq - 1)
+        return events, next_cursor, cursor + 1 < first_seq
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+并发扇出发送器
+把同一条消息投递到多个客户端的出站队列，由各自的写任务并发发送，
+并限制全局同时进行中的发送数量
+"""
+
+import asyncio
+from typing import Iterable, List, Tuple
+
+from sync_frames import Frame
+from sync_outbound import OutboundQueue
+
+
+class FanoutEngine:
+    def __init__(self, max_in_flight: int = 256, send_timeout: float = 5.0):
+        self.max_in_flight = max_in_flight
+        self.send_timeout = send_timeout
+        # 延迟到事件循环中创建，避免Python 3.9下绑定到导入时的事件循环
+        self._semaphore = None
+        self.frames_sent = 0
+        self.bytes_sent = 0
+
+    async def send(self, websocket, frame: Frame, binary: bool = False):
+        """写任务调用的单次发送，占用一个全局发送名额"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        async with self._semaphore:
+            await asyncio.wait_for(frame.send_to(websocket, binary), timeout=self.send_timeout)
+        self.frames_sent += 1
+        self.bytes_sent += len(frame.binary if binary else frame.data)
+
+    def publish(self, targets: Iterable[Tuple[str, OutboundQueue]], message) -> List[str]:
+        """
+        把消息投递到所有目标 (client_id, 出站队列)
+
+        入队不阻塞，慢连接只影响它自己的队列，不会拖慢其他接收者。
+        消息只序列化一次，所有接收者共享同一个Frame。
+        返回需要断开的 client_id 列表，由调用方统一清理。
+        """
+        frame = Frame.of(message)
+        return [client_id for client_id, outbound in targets if not outbound.put(frame)]
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+预序列化帧
+广播时载荷只序列化、编码一次，所有接收者复用同一份字节；
+JSON文本和二进制两种编码各自按需生成并缓存
+"""
+
+from aiohttp import WSMsgType
+
+import sync_binary
+import sync_codec
+
+
+class Frame:
+    __slots__ = ('payload', 'parts', '_text', '_data', '_binary')
+
+    def __init__(self, payload):
+        self.payload = payload
+        # Frame.join生成的帧保留子帧，用于生成二进制编码
+        self.parts = None
+        self._text = None
+        self._data = None
+        self._binary = None
+
+    @classmethod
+    def of(cls, message):
+        """把普通dict包装成Frame，已经是Frame的直接返回"""
+        if isinstance(message, cls):
+            return message
+        return cls(message)
+
+    @classmethod
+    def from_data(cls, payload, data: bytes):
+        """用已拼接好的JSON字节构造帧，payload只保留用于路由/合并判断的字段"""
+        frame = cls(payload)
+        frame._data = data
+        return frame
+
+    @classmethod
+    def join(cls, header: dict, frames):
+        """把多个帧合并成一个 {...header, "events": [...]} 帧，直接拼接已编码的字节"""
+        data = b''.join((
+            sync_codec.dumps_bytes(header)[:-1],
+            b',"events":[',
+            b','.join(f.data for f in frames),
+            b']}'
+        ))
+        frame = cls.from_data(header, data)
+        frame.parts = frames
+        return frame
+
+    @property
+    def data(self) -> bytes:
+        """UTF-8编码的JSON，首次访问时生成并缓存"""
+        if self._data is None:
+            self._data = sync_codec.dumps_bytes(self.payload)
+        return self._data
+
+    @property
+    def text(self) -> str:
+        """JSON文本，仅在aiohttp不支持send_frame时需要"""
+        if self._text is None:
+            self._text = self.data.decode('utf-8')
+        return self._text
+
+    @property
+    def binary(self) -> bytes:
+        """二进制协议编码，首次访问时生成并缓存"""
+        if self._binary is None:
+            if self.parts is not None:
+                self._binary = sync_binary.encode_joined(self.payload, [f.binary for f in self.parts])
+            else:
+                self._binary = sync_binary.encode(self.payload)
+        return self._binary
+
+    async def send_to(self, websocket, binary: bool = False):
+        """发送给单个连接，binary为True时使用二进制协议"""
+        if binary:
+            await websocket.send_bytes(self.binary)
+            return
+        send_frame = getattr(websocket, 'send_frame', None)
+        if send_frame is not None:
+            # aiohttp >= 3.11: 直接发送已编码的字节，跳过send_str里的重复encode
+            await send_frame(self.data, WSMsgType.TEXT)
+        else:
+            await websocket.send_str(self.text)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+消息历史环形缓冲
+按群组保存最近的消息帧，每条带全局单调递增的序号，
+客户端重连时凭最后收到的序号只补发缺失的部分
+"""
+
+import heapq
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# 不属于任何群组的消息（全员广播）存在这个键下
+GLOBAL_STREAM = '*'
+
+
+class MessageHistory:
+    def __init__(self, per_group: int = 500, max_bytes: int = 32 * 1024 * 1024,
+                 sequencer: Optional[Callable[[], int]] = None):
+        """sequencer: 多worker模式下的跨进程序号生成器，默认使用进程内计数"""
+        self.per_group = per_group
+        self.max_bytes = max_bytes
+        self.seq = 0
+        self.total_bytes = 0
+        self.count = 0
+        self.groups: Dict[str, deque] = {}
+        # 每个群组已被淘汰的最大序号，用于判断补发是否完整
+        self.evicted_upto: Dict[str, int] = {}
+        # 全局插入顺序 (群组, 序号)，超出内存上限时从最旧处淘汰
+        self._order = deque()
+        self._sequencer = sequencer
+
+    def next_seq(self) -> int:
+        if self._sequencer is not None:
+            self.seq = max(self.seq, self._sequencer())
+        else:
+            self.seq += 1
+        return self.seq
+
+    def append(self, group_id, seq: int, frame):
+        """追加一条已分配序号的消息帧"""
+        key = GLOBAL_STREAM if group_id is None else str(group_id)
+        if seq <= self.evicted_upto.get(key, 0):
+            return
+        ring = self.groups.get(key)
+        if ring is None:
+            ring = self.groups[key] = deque()
+        if ring and ring[-1][0] > seq:
+            # 其他worker的消息经总线到达时可能略微乱序，从尾部找到插入位置
+            index = len(ring)
+            while index > 0 and ring[index - 1][0] > seq:
+                index -= 1
+            ring.insert(index, (seq, frame))
+        else:
+            ring.append((seq, frame))
+        self.seq = max(self.seq, seq)
+        self._order.append((key, seq))
+        self.total_bytes += len(frame.data)
+        self.count += 1
+
+        if len(ring) > self.per_group:
+            self._evict_head(key)
+        while self.total_bytes > self.max_bytes and self.count > 1:
+            self._evict_oldest()
+
+        # 按群组淘汰会在全局顺序里留下失效项，数量过多时压缩一次
+        if len(self._order) > 2 * self.count + 1024:
+            self._order = deque(item for item in self._order if self._is_live(*item))
+
+    def replay(self, group_ids: Optional[Iterable], last_seq: int) -> Tuple[List, bool]:
+        """
+        返回指定群组中序号大于last_seq的消息帧（按序号排列），
+        以及是否有缺失（所需消息已被淘汰，或游标来自重启前的进程）。
+        group_ids为None表示所有群组，包括消息已全部被淘汰、不在groups中的群组
+        """
+        truncated = last_seq > self.seq
+        if truncated:
+            last_seq = 0
+        if group_ids is None:
+            group_ids = self.groups.keys() | self.evicted_upto.keys()
+
+        tails = []
+        for group_id in group_ids:
+            key = str(group_id)
+            ring = self.groups.get(key)
+            if self.evicted_upto.get(key, 0) > last_seq:
+                truncated = True
+            if not ring:
+                continue
+            tail = []
+            for seq, frame in reversed(ring):
+                if seq <= last_seq:
+                    break
+                tail.append((seq, frame))
+            tail.reverse()
+            tails.append(tail)
+
+        return [frame for _, frame in heapq.merge(*tails, key=lambda item: item[0])], truncated
+
+    def entries(self) -> List[Tuple[int, str, object]]:
+        """所有保存的消息 (序号, 群组键, 帧)，按序号排列，用于写入热启动快照"""
+        return sorted(
+            ((seq, key, frame) for key, ring in self.groups.items() for seq, frame in ring),
+            key=lambda item: item[0]
+        )
+
+    def _is_live(self, key, seq) -> bool:
+        ring = self.groups.get(key)
+        return bool(ring) and ring[0][0] <= seq
+
+    def _evict_head(self, key):
+        ring = self.groups[key]
+        seq, frame = ring.popleft()
+        self.total_bytes -= len(frame.data)
+        self.count -= 1
+        self.evicted_upto[key] = seq
+        if not ring:
+            del self.groups[key]
+
+    def _evict_oldest(self):
+        while self._order:
+            key, seq = self._order.popleft()
+            if self._is_live(key, seq):
+                self._evict_head(key)
+                return
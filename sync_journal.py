@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+持久化消息日志
+把 message_sync / user_sync / group_sync 事件按序号追加写入本地磁盘的分段文件，
+后台任务合并提交（一批记录一次write+fsync）。每个分段带一个内存映射的
+(序号, 偏移) 索引，从任意序号回放只需二分定位后顺序读取，不需要扫描日志。
+
+目录结构:
+    00000000000000000001.log   记录: 头部(seq, crc32, 群组长度, 数据长度) + 群组id + 帧JSON
+    00000000000000000001.idx   定长索引项: (seq, 偏移)，活动分段预分配空间
+    state.checkpoint           用户/群组状态检查点 {"seq": ..., "state": ...}，启动时从它加上
+                               之后的状态增量重建状态，不依赖最早的分段仍然保留
+"""
+
+import asyncio
+import bisect
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from typing import List, Optional, Tuple
+
+import sync_codec
+
+logger = logging.getLogger(__name__)
+
+RECORD_HEADER = struct.Struct('<QIHI')   # seq, crc32(群组id+数据), 群组id长度, 数据长度
+INDEX_ENTRY = struct.Struct('<QQ')       # seq, 记录在分段文件中的偏移
+CHECKPOINT_NAME = 'state.checkpoint'
+
+
+class Segment:
+    """一个日志分段及其内存映射索引"""
+
+    def __init__(self, directory: str, base_seq: int, index_entries: int):
+        self.base_seq = base_seq
+        self.log_path = os.path.join(directory, f'{base_seq:020d}.log')
+        self.index_path = os.path.join(directory, f'{base_seq:020d}.idx')
+        self.index_entries = index_entries
+        self.entries = 0
+        self.size = 0
+        self.last_seq = 0
+        self._log = None
+        self._index_file = None
+        self._index = None
+
+    def open(self, writable: bool):
+        """打开分段；活动分段的索引按容量预分配（稀疏文件）后映射"""
+        self._log = open(self.log_path, 'a+b')
+        self.size = self._log.seek(0, os.SEEK_END)
+        self._index_file = open(self.index_path, 'a+b')
+        if writable:
+            self._index_file.truncate(self.index_entries * INDEX_ENTRY.size)
+        if os.path.getsize(self.index_path) > 0:
+            access = mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+            self._index = mmap.mmap(self._index_file.fileno(), 0, access=access)
+        if writable:
+            self._recover()
+        else:
+            self.entries = len(self._index) // INDEX_ENTRY.size if self._index is not None else 0
+            if self.entries:
+                self.last_seq = self.seq_at(self.entries - 1)
+
+    def _recover(self):
+        """重建活动分段的索引，截掉进程崩溃时写了一半的尾部记录"""
+        self._log.seek(0)
+        offset = 0
+        entries = 0
+        while True:
+            header = self._log.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                break
+            seq, crc, group_len, data_len = RECORD_HEADER.unpack(header)
+            body = self._log.read(group_len + data_len)
+            if len(body) < group_len + data_len or zlib.crc32(body) != crc or entries >= self.index_entries:
+                break
+            INDEX_ENTRY.pack_into(self._index, entries * INDEX_ENTRY.size, seq, offset)
+            entries += 1
+            self.last_seq = seq
+            offset += RECORD_HEADER.size + group_len + data_len
+        if offset < self.size:
+            logger.warning(f"日志分段尾部不完整，截断 {self.size - offset} 字节: {self.log_path}")
+            self._log.truncate(offset)
+            self.size = offset
+        # 清掉截断部分留下的旧索引项，保证索引内容与日志一致
+        self.entries = entries
+        while entries < self.index_entries and self.seq_at(entries):
+            INDEX_ENTRY.pack_into(self._index, entries * INDEX_ENTRY.size, 0, 0)
+            entries += 1
+
+    def seq_at(self, entry: int) -> int:
+        return INDEX_ENTRY.unpack_from(self._index, entry * INDEX_ENTRY.size)[0]
+
+    def write(self, records: List[Tuple[int, bytes]]):
+        """追加一批已编码的记录并写入对应的索引项"""
+        offset = self.size
+        for seq, record in records:
+            INDEX_ENTRY.pack_into(self._index, self.entries * INDEX_ENTRY.size, seq, offset)
+            self.entries += 1
+            offset += len(record)
+        self._log.write(b''.join(record for _, record in records))
+        self._log.flush()
+        self.size = offset
+        self.last_seq = records[-1][0]
+
+    def sync(self):
+        os.fsync(self._log.fileno())
+
+    def seal(self):
+        """分段写满：把预分配的索引截到实际大小"""
+        self._index.close()
+        self._index_file.truncate(self.entries * INDEX_ENTRY.size)
+        self._index = mmap.mmap(self._index_file.fileno(), 0, access=mmap.ACCESS_READ) if self.entries else None
+
+    def find(self, seq: int) -> int:
+        """二分查找第一个序号 >= seq 的索引项"""
+        low, high = 0, self.entries
+        while low < high:
+            mid = (low + high) // 2
+            if self.seq_at(mid) < seq:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def read(self, from_seq: int, limit: int) -> List[Tuple[int, Optional[str], bytes]]:
+        """从第一个序号 >= from_seq 的记录开始顺序读取"""
+        entry = self.find(from_seq)
+        if entry >= self.entries:
+            return []
+        offset = INDEX_ENTRY.unpack_from(self._index, entry * INDEX_ENTRY.size)[1]
+        records = []
+        with open(self.log_path, 'rb') as f:
+            f.seek(offset)
+            for _ in range(min(limit, self.entries - entry)):
+                seq, _, group_len, data_len = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+                group_id = f.read(group_len).decode('utf-8') if group_len else None
+                records.append((seq, group_id, f.read(data_len)))
+        return records
+
+    def close(self):
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+        if self._index_file is not None:
+            self._index_file.close()
+        if self._log is not None:
+            self._log.close()
+
+    def delete(self):
+        self.close()
+        for path in (self.log_path, self.index_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class Journal:
+    def __init__(self, directory: str, segment_bytes: int = 64 * 1024 * 1024,
+                 index_entries: int = 1 << 20, flush_interval: float = 0.01,
+                 fsync: bool = True, max_segments: int = 16):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.index_entries = index_entries
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.max_segments = max_segments
+        self.segments: List[Segment] = []
+        self.stats = {'appended': 0, 'flushes': 0, 'bytes': 0}
+        self._pending = []
+        # 已从_pending取出、正在写盘的一批记录，写完前读取方仍需从这里读到
+        self._flushing = []
+        self._lock = threading.Lock()
+        self._wakeup = None
+        self._task = None
+        # 正在线程池中执行的写盘，关闭时要等它写完，不能重复写同一批记录
+        self._inflight = None
+
+    @property
+    def last_seq(self) -> int:
+        if self._pending:
+            return self._pending[-1][0]
+        if self._flushing:
+            return self._flushing[-1][0]
+        return self.segments[-1].last_seq if self.segments else 0
+
+    @property
+    def first_seq(self) -> int:
+        for segment in self.segments:
+            if segment.entries:
+                return segment.seq_at(0)
+        return self.last_seq + 1
+
+    def open(self):
+        """打开目录中已有的分段，最后一个作为活动分段并做崩溃恢复"""
+        os.makedirs(self.directory, exist_ok=True)
+        bases = sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith('.log'))
+        for base in bases:
+            segment = Segment(self.directory, base, self.index_entries)
+            segment.open(writable=base == bases[-1])
+            self.segments.append(segment)
+        if not self.segments:
+            self._roll(1)
+        while len(self.segments) > self.max_segments:
+            self.segments.pop(0).delete()
+        logger.info(f"持久化日志已打开: {self.directory}，{len(self.segments)} 个分段，最新序号 {self.last_seq}")
+
+    def append(self, seq: int, group_id, data: bytes):
+        """登记一条记录，由后台任务合并写盘"""
+        group = b'' if group_id is None else str(group_id).encode('utf-8')
+        body = group + data
+        self._pending.append((seq, RECORD_HEADER.pack(seq, zlib.crc32(body), len(group), len(data)) + body))
+        self.stats['appended'] += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            await self._wakeup.wait()
+            # 等待一个提交窗口，让同一批记录只做一次write+fsync
+            await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+            # 先交给_flushing再清空_pending，任何时刻记录都至少在其中一处
+            batch = self._flushing = self._pending
+            self._pending = []
+            if batch:
+                self._inflight = loop.run_in_executor(None, self._write, batch)
+                try:
+                    # 取消后台任务不会中断线程池里的写盘，shield让close()仍能等待它完成
+                    await asyncio.shield(self._inflight)
+                except Exception as e:
+                    logger.error(f"持久化日志写入失败: {e!r}")
+
+    def _write(self, batch):
+        with self._lock:
+            segment = self.segments[-1]
+            chunk = []
+            size = segment.size
+            entries = segment.entries
+            for seq, record in batch:
+                if entries >= segment.index_entries or (size > 0 and size + len(record) > self.segment_bytes):
+                    if chunk:
+                        segment.write(chunk)
+                    if self.fsync:
+                        segment.sync()
+                    segment = self._roll(seq)
+                    chunk = []
+                    size = entries = 0
+                chunk.append((seq, record))
+                size += len(record)
+                entries += 1
+            if chunk:
+                segment.write(chunk)
+            if self.fsync:
+                segment.sync()
+            self._flushing = []
+        self.stats['flushes'] += 1
+        self.stats['bytes'] += sum(len(record) for _, record in batch)
+
+    def _roll(self, base_seq: int) -> Segment:
+        """封存当前分段并新建活动分段，超出保留数量时删除最旧的分段"""
+        if self.segments:
+            self.segments[-1].seal()
+        segment = Segment(self.directory, base_seq, self.index_entries)
+        segment.open(writable=True)
+        self.segments.append(segment)
+        while len(self.segments) > self.max_segments:
+            self.segments.pop(0).delete()
+        return segment
+
+    def read(self, from_seq: int, limit: int = 10000) -> List[Tuple[int, Optional[str], bytes]]:
+        """
+        读取序号 >= from_seq 的记录 (seq, 群组id, 帧JSON)，最多limit条，
+        包括尚未写盘的记录。可以在线程池中调用。
+        """
+        with self._lock:
+            bases = [segment.base_seq for segment in self.segments]
+            index = max(bisect.bisect_right(bases, from_seq) - 1, 0)
+            records = []
+            for segment in self.segments[index:]:
+                if len(records) >= limit:
+                    break
+                records.extend(segment.read(from_seq, limit - len(records)))
+            # 先取_pending再取_flushing，与后台任务交接的顺序相反，不会漏掉记录
+            pending = list(self._pending)
+            pending = list(self._flushing) + pending
+        last = records[-1][0] if records else from_seq - 1
+        for seq, record in pending:
+            if len(records) >= limit:
+                break
+            if seq > last:
+                _, _, group_len, _ = RECORD_HEADER.unpack_from(record)
+                body = record[RECORD_HEADER.size:]
+                group_id = body[:group_len].decode('utf-8') if group_len else None
+                records.append((seq, group_id, body[group_len:]))
+        return records
+
+    async def save_checkpoint(self, seq: int, state: dict):
+        """
+        写入状态检查点（seq及之前的增量都已包含在state中）。在调用方线程中编码，
+        之后state可以继续修改；写盘在线程池中原子进行（临时文件+fsync+替换）
+        """
+        data = sync_codec.dumps_bytes({'seq': seq, 'state': state})
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self._write_checkpoint, data)
+
+    def _write_checkpoint(self, data: bytes):
+        path = os.path.join(self.directory, CHECKPOINT_NAME)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def load_checkpoint(self) -> Tuple[int, Optional[dict]]:
+        """读取状态检查点，返回 (seq, state)；不存在或无法解析时返回 (0, None)"""
+        try:
+            with open(os.path.join(self.directory, CHECKPOINT_NAME), 'rb') as f:
+                checkpoint = sync_codec.loads(f.read())
+        except FileNotFoundError:
+            return 0, None
+        except sync_codec.DecodeError as e:
+            logger.warning(f"状态检查点无法解析，忽略: {e}")
+            return 0, None
+        return checkpoint.get('seq', 0), checkpoint.get('state')
+
+    def snapshot(self):
+        return dict(self.stats, segments=len(self.segments), first_seq=self.first_seq,
+                    last_seq=self.last_seq, pending=len(self._pending))
+
+    async def close(self):
+        """停止后台任务，把剩余记录写盘并关闭所有分段"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._inflight is not None:
+            try:
+                await self._inflight
+            except Exception as e:
+                logger.error(f"持久化日志写入失败: {e!r}")
+            self._inflight = None
+        # 正在写的一批写完后_flushing已清空，这里只剩写盘失败的那一批和尚未交接的记录
+        batch = self._flushing + self._pending
+        self._flushing = []
+        self._pending = []
+        if batch:
+            self._write(batch)
+        with self._lock:
+            for segment in self.segments:
+                segment.close()
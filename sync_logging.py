@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+非阻塞日志
+日志记录只进入内存队列，由后台线程负责格式化和写出，事件循环不会被慢的stdout/文件阻塞；
+每条消息都会触发的日志按消息类型采样，其余只计数，定期汇总输出一行
+
+每种消息类型的详细程度 (SYNC_LOG_TYPES，如 "message_sync=sample,user_sync=all,heartbeat=off"):
+    all      每条都记录
+    sample   每个汇总周期内每SYNC_LOG_SAMPLE条记录一条（默认）
+    summary  只计入周期汇总
+    off      不记录也不计数
+"""
+
+import asyncio
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+from typing import Dict
+
+MODES = ('all', 'sample', 'summary', 'off')
+DEFAULT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+_listener = None
+
+
+def setup_logging(level=None, fmt: str = DEFAULT_FORMAT):
+    """
+    配置根日志器：QueueHandler + 后台QueueListener线程。
+    与logging.basicConfig一样，根日志器已有处理器时不做任何修改
+    """
+    global _listener
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    level = level or os.environ.get('SYNC_LOG_LEVEL', 'INFO').upper()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(fmt))
+    records = queue.SimpleQueue()
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(level)
+    _listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+    _listener.start()
+    # 进程退出前把队列中剩余的日志写完
+    atexit.register(_listener.stop)
+
+
+def parse_modes(spec: str) -> Dict[str, str]:
+    modes = {}
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, mode = item.partition('=')
+        mode = mode.strip()
+        if mode not in MODES:
+            raise ValueError(f"Invalid log mode for {name}: {mode!r}, must be one of {MODES}")
+        modes[name.strip()] = mode
+    return modes
+
+
+class MessageLog:
+    """热路径日志：按消息类型采样，并定期汇总各类型的条数"""
+
+    def __init__(self, logger: logging.Logger, modes: Dict[str, str] = None, default: str = 'sample',
+                 sample_every: int = 100, interval: float = 60.0):
+        self.logger = logger
+        self.modes = modes or {}
+        self.default = default
+        self.sample_every = max(1, sample_every)
+        self.interval = interval
+        self.counts: Dict[str, int] = {}
+        self._task = None
+
+    def log(self, message_type: str, msg: str, *args):
+        """记录一条热路径日志，参数只在真正输出时才格式化"""
+        mode = self.modes.get(message_type, self.default)
+        if mode == 'off':
+            return
+        count = self.counts.get(message_type, 0) + 1
+        self.counts[message_type] = count
+        if mode == 'all' or (mode == 'sample' and (count - 1) % self.sample_every == 0):
+            if self.logger.isEnabledFor(logging.INFO):
+                self.logger.info(msg, *args)
+
+    def summary(self):
+        """输出并清零本周期的计数"""
+        if not self.counts:
+            return
+        counts, self.counts = self.counts, {}
+        self.logger.info("最近%d秒: %s", self.interval,
+                         ', '.join(f"{name} {count}条" for name, count in sorted(counts.items())))
+
+    def start(self):
+        if self.interval > 0:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.summary()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.summary()
+
+
+def message_log(logger: logging.Logger) -> MessageLog:
+    """按环境变量创建MessageLog，心跳默认只计入汇总"""
+    modes = {'heartbeat': 'summary'}
+    modes.update(parse_modes(os.environ.get('SYNC_LOG_TYPES', '')))
+    return MessageLog(
+        logger, modes,
+        sample_every=int(os.environ.get('SYNC_LOG_SAMPLE', 100)),
+        interval=float(os.environ.get('SYNC_LOG_SUMMARY_INTERVAL', 60))
+    )
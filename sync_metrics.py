@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prometheus指标
+轻量的计数器/直方图实现，热路径上每次记录只是一次字典查找和列表自增，
+可以在生产环境常开；/metrics 输出Prometheus文本格式
+"""
+
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+# 默认直方图分桶（秒），覆盖10微秒到1秒
+DEFAULT_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0
+)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_labels(labelname: Optional[str], label, extra: str = '') -> str:
+    parts = []
+    if labelname is not None:
+        value = str(label).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{labelname}="{value}"')
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    __slots__ = ('name', 'help', 'labelname', 'values')
+
+    def __init__(self, name: str, help: str, labelname: Optional[str] = None):
+        self.name = name
+        self.help = help
+        self.labelname = labelname
+        self.values: Dict[object, float] = {}
+
+    def inc(self, amount=1, label=None):
+        self.values[label] = self.values.get(label, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        for label, value in sorted(self.values.items(), key=lambda item: str(item[0])):
+            lines.append(f'{self.name}{_format_labels(self.labelname, label)} {_format_value(value)}')
+        return lines
+
+
+class Gauge:
+    """抓取时调用函数取值，热路径上没有任何开销；kind为counter时用于已有的累计计数"""
+    __slots__ = ('name', 'help', 'func', 'kind')
+
+    def __init__(self, name: str, help: str, func: Callable[[], float], kind: str = 'gauge'):
+        self.name = name
+        self.help = help
+        self.func = func
+        self.kind = kind
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}',
+                f'{self.name} {_format_value(self.func())}']
+
+
+class Histogram:
+    __slots__ = ('name', 'help', 'labelname', 'buckets', 'series')
+
+    def __init__(self, name: str, help: str, labelname: Optional[str] = None,
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelname = labelname
+        self.buckets = tuple(buckets)
+        # label -> [各桶计数(非累计，最后一个为+Inf), 总和]
+        self.series: Dict[object, list] = {}
+
+    def observe(self, value: float, label=None):
+        series = self.series.get(label)
+        if series is None:
+            series = self.series[label] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for label, (counts, total) in sorted(self.series.items(), key=lambda item: str(item[0])):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelname, label, le)} {cumulative}')
+            labels = _format_labels(self.labelname, label)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, labelname=None) -> Counter:
+        metric = Counter(name, help, labelname)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, func) -> Gauge:
+        metric = Gauge(name, help, func)
+        self.metrics.append(metric)
+        return metric
+
+    def counter_func(self, name, help, func) -> Gauge:
+        """抓取时从已有统计读取的计数器"""
+        metric = Gauge(name, help, func, kind='counter')
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelname=None, buckets=DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labelname, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+客户端出站队列
+每个已注册客户端一个有界发送队列，由独立的写任务负责发送，
+不读数据的慢客户端不会让服务器内存无限增长
+"""
+
+import asyncio
+import logging
+from collections import deque
+
+from sync_frames import Frame
+from sync_state import merge_deltas
+
+logger = logging.getLogger(__name__)
+
+# 队列满时的处理策略
+DROP_OLDEST = 'drop_oldest'  # 丢弃最旧的一帧
+COALESCE = 'coalesce'        # 合并同一对象的状态更新（版本化增量合并成一个连续增量），无可合并时丢弃最旧的一帧
+DISCONNECT = 'disconnect'    # 直接断开慢客户端
+POLICIES = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+# 只有"最新状态覆盖旧状态"的消息类型可以合并，消息本身不能合并
+COALESCE_TYPES = ('user_sync', 'group_sync')
+
+
+def coalesce_key(payload):
+    """返回可合并消息的键 (type, id)，不可合并返回None"""
+    message_type = payload.get('type')
+    if message_type not in COALESCE_TYPES:
+        return None
+    data = payload.get('data')
+    if not isinstance(data, dict) or data.get('id') is None:
+        return None
+    return (message_type, data['id'])
+
+
+class OutboundQueue:
+    def __init__(self, client_id, websocket, sender, maxsize: int = 256, policy: str = DROP_OLDEST,
+                 flush_window: float = 0.0, flush_max: int = 1, binary: bool = False):
+        """
+        flush_window > 0 且 flush_max > 1 时开启出站合并：写任务等待最多flush_window秒
+        或攒够flush_max帧，把多帧合并成一个batch帧发送（仅用于声明支持batch的客户端）
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown outbound policy: {policy}")
+        self.client_id = client_id
+        self.websocket = websocket
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.binary = binary
+        self.closed = False
+        self.flush_window = flush_window
+        self.flush_max = flush_max if flush_window > 0 else 1
+        self._sender = sender
+        self._sending = False
+        self._frames = deque()
+        self._wakeup = None
+        self._filled = None
+        self._task = None
+
+    def __len__(self):
+        return len(self._frames)
+
+    @property
+    def idle(self) -> bool:
+        """队列已空且没有正在发送的帧"""
+        return not self._frames and not self._sending
+
+    def start(self):
+        """启动写任务，必须在事件循环中调用"""
+        self._wakeup = asyncio.Event()
+        self._filled = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    def put(self, frame) -> bool:
+        """非阻塞入队，返回False表示客户端应被断开"""
+        if self.closed:
+            return False
+
+        if len(self._frames) >= self.maxsize:
+            if self.policy == DISCONNECT:
+                logger.warning(f"慢客户端出站队列已满，断开连接: {self.client_id}")
+                self.abort()
+                return False
+            if self.policy == COALESCE and self._coalesce(frame):
+                return True
+            self._frames.popleft()
+            self.dropped += 1
+
+        self._frames.append(frame)
+        self._wakeup.set()
+        if len(self._frames) >= self.flush_max:
+            self._filled.set()
+        return True
+
+    def _coalesce(self, frame) -> bool:
+        """
+        用新帧替换队列中同一对象的旧状态。版本化增量只包含变化的字段，不能直接覆盖，
+        而是与队列中该对象最新的一个增量合并；版本不连续或无法合并时返回False
+        """
+        payload = frame.payload
+        key = coalesce_key(payload)
+        if key is None:
+            return False
+        for index in range(len(self._frames) - 1, -1, -1):
+            queued = self._frames[index].payload
+            if coalesce_key(queued) != key:
+                continue
+            if 'base_version' in payload or 'base_version' in queued:
+                merged = merge_deltas(queued, payload)
+                if merged is None:
+                    return False
+                frame = Frame(merged)
+            self._frames[index] = frame
+            self.coalesced += 1
+            return True
+        return False
+
+    async def _run(self):
+        try:
+            while True:
+                while not self._frames:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                if self.flush_max > 1:
+                    frame = await self._collect_batch()
+                    if frame is None:
+                        continue
+                else:
+                    frame = self._frames.popleft()
+                self._sending = True
+                try:
+                    await self._sender(self.websocket, frame, self.binary)
+                finally:
+                    self._sending = False
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"发送失败，关闭连接 {self.client_id}: {e!r}")
+            self.abort()
+
+    async def _collect_batch(self):
+        """等待合并窗口结束或攒够flush_max帧，第一帧的额外延迟不超过flush_window"""
+        if len(self._frames) < self.flush_max:
+            self._filled.clear()
+            try:
+                await asyncio.wait_for(self._filled.wait(), timeout=self.flush_window)
+            except asyncio.TimeoutError:
+                pass
+        count = min(len(self._frames), self.flush_max)
+        frames = [self._frames.popleft() for _ in range(count)]
+        if len(frames) <= 1:
+            return frames[0] if frames else None
+        self.batches += 1
+        return Frame.join({'type': 'batch', 'count': len(frames)}, frames)
+
+    def abort(self):
+        """标记关闭并异步关闭底层连接，连接处理器随后负责清理"""
+        if self.closed:
+            return
+        self.closed = True
+        self._frames.clear()
+        if not self.websocket.closed:
+            asyncio.ensure_future(self.websocket.close())
+
+    async def close(self):
+        """停止写任务并丢弃未发送的帧"""
+        self.closed = True
+        self._frames.clear()
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
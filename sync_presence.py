@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量在线状态
+记录客户端的上线和离线，按固定间隔把这段时间内的净变化合并成一个presence帧广播，
+大量客户端同时重连时每个间隔仍只发送一帧；同一间隔内先离线又上线的客户端不会被通知
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional
+
+from sync_clock import clock
+
+logger = logging.getLogger(__name__)
+
+_ABSENT = object()
+
+
+class PresenceTracker:
+    def __init__(self, interval: float, on_flush: Callable[[dict], Awaitable[None]], max_diff: int = 500):
+        """
+        await on_flush(payload) 广播一个presence帧；
+        一个间隔内的变化超过max_diff条时只发送reset标记，客户端按需查询在线列表
+        """
+        self.interval = interval
+        self.max_diff = max_diff
+        self.online: Dict[str, str] = {}
+        # 本间隔内有变化的客户端 -> 上次广播时的状态（用户名，或_ABSENT表示当时不在线）
+        self._changed: Dict[str, object] = {}
+        self._on_flush = on_flush
+        # 在线列表每次变化都会递增，用于缓存完整快照
+        self.revision = 0
+        self._task = None
+        self.stats = {'flushes': 0, 'joined': 0, 'left': 0, 'resets': 0}
+
+    def __len__(self):
+        return len(self.online)
+
+    def join(self, client_id, username):
+        self._changed.setdefault(client_id, self.online.get(client_id, _ABSENT))
+        self.online[client_id] = username
+        self.revision += 1
+
+    def preload(self, clients: Dict[str, str]):
+        """热启动时载入上一个进程的在线列表，不产生变化通知；重连回来的客户端也不会再通知上线"""
+        self.online.update(clients)
+        self.revision += 1
+
+    def leave(self, client_id):
+        if client_id not in self.online:
+            return
+        self._changed.setdefault(client_id, self.online[client_id])
+        del self.online[client_id]
+        self.revision += 1
+
+    def diff(self) -> Optional[dict]:
+        """取出本间隔的净变化，没有变化时返回None"""
+        changed, self._changed = self._changed, {}
+        joined = []
+        left = []
+        for client_id, before in changed.items():
+            after = self.online.get(client_id, _ABSENT)
+            if after == before:
+                continue
+            if after is _ABSENT:
+                left.append(client_id)
+            else:
+                joined.append({'client_id': client_id, 'username': after})
+        if not joined and not left:
+            return None
+
+        self.stats['joined'] += len(joined)
+        self.stats['left'] += len(left)
+        payload = {'type': 'presence', 'online': len(self.online), 'timestamp': clock.iso()}
+        if len(joined) + len(left) > self.max_diff:
+            self.stats['resets'] += 1
+            payload['reset'] = True
+        else:
+            payload['joined'] = joined
+            payload['left'] = left
+        return payload
+
+    async def flush(self):
+        payload = self.diff()
+        if payload is not None:
+            self.stats['flushes'] += 1
+            await self._on_flush(payload)
+
+    def snapshot(self, client_ids=None) -> list:
+        """[{"client_id", "username"}]，client_ids为None时返回全部在线客户端"""
+        online = self.online
+        if client_ids is None:
+            selected = online.items()
+        else:
+            selected = ((client_id, online[client_id]) for client_id in client_ids if client_id in online)
+        return [{'client_id': client_id, 'username': username} for client_id, username in selected]
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"在线状态广播出错: {e!r}")
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+心跳超时清理
+用哈希时间轮按截止时间分桶，每次只检查到期的桶，
+连接数很大时也不需要每轮扫描全部客户端
+"""
+
+import asyncio
+import logging
+import math
+import time
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TimerWheel:
+    def __init__(self, tick: float, horizon: float, now: Optional[float] = None):
+        self.tick = tick
+        self.size = int(math.ceil(horizon / tick)) + 2
+        self.slots = [set() for _ in range(self.size)]
+        self.slot_of = {}
+        self.current = self._tick_of(time.monotonic() if now is None else now)
+
+    def __len__(self):
+        return len(self.slot_of)
+
+    def _tick_of(self, t: float) -> int:
+        return int(t // self.tick)
+
+    def schedule(self, key, deadline: float):
+        """在截止时间所在的桶登记key，已登记的key会被移动"""
+        tick = min(max(self._tick_of(deadline), self.current + 1), self.current + self.size - 1)
+        slot = tick % self.size
+        old = self.slot_of.get(key)
+        if old is not None:
+            self.slots[old].discard(key)
+        self.slots[slot].add(key)
+        self.slot_of[key] = slot
+
+    def cancel(self, key):
+        slot = self.slot_of.pop(key, None)
+        if slot is not None:
+            self.slots[slot].discard(key)
+
+    def advance(self, now: float) -> List:
+        """推进到now，返回经过的桶里的所有key（由调用方确认是否真正到期）"""
+        target = self._tick_of(now)
+        due = []
+        # 事件循环卡顿超过一整圈时，最多处理一圈的桶
+        for tick in range(max(self.current + 1, target - self.size + 1), target + 1):
+            slot = tick % self.size
+            bucket = self.slots[slot]
+            if bucket:
+                self.slots[slot] = set()
+                for key in bucket:
+                    del self.slot_of[key]
+                due.extend(bucket)
+        self.current = max(self.current, target)
+        return due
+
+
+class HeartbeatReaper:
+    def __init__(self, timeout: float, tick: float,
+                 last_seen: Callable[[str], Optional[float]],
+                 on_expire: Callable[[List[str]], None]):
+        """
+        last_seen(client_id) 返回客户端最后活跃的monotonic时间，已断开返回None
+        on_expire(client_ids) 批量处理超时的客户端
+        """
+        self.timeout = timeout
+        self.tick = tick
+        self.wheel = TimerWheel(tick, timeout)
+        self._last_seen = last_seen
+        self._on_expire = on_expire
+        self._task = None
+        self.stats = {
+            'reaped': 0,
+            'sweeps': 0,
+            'last_sweep_ms': 0.0,
+            'max_sweep_ms': 0.0
+        }
+
+    def track(self, client_id, now: Optional[float] = None):
+        """开始跟踪客户端；收到心跳时无需调用，到期检查时会按最新活跃时间重新登记"""
+        now = time.monotonic() if now is None else now
+        self.wheel.schedule(client_id, now + self.timeout)
+
+    def forget(self, client_id):
+        self.wheel.cancel(client_id)
+
+    def sweep(self, now: Optional[float] = None) -> List[str]:
+        """处理到期的桶，返回被清理的客户端"""
+        now = time.monotonic() if now is None else now
+        started = time.perf_counter()
+        expired = []
+        for client_id in self.wheel.advance(now):
+            last_seen = self._last_seen(client_id)
+            if last_seen is None:
+                continue
+            deadline = last_seen + self.timeout
+            if deadline <= now:
+                expired.append(client_id)
+            else:
+                self.wheel.schedule(client_id, deadline)
+        if expired:
+            self._on_expire(expired)
+            self.stats['reaped'] += len(expired)
+
+        elapsed = (time.perf_counter() - started) * 1000
+        self.stats['sweeps'] += 1
+        self.stats['last_sweep_ms'] = round(elapsed, 3)
+        self.stats['max_sweep_ms'] = max(self.stats['max_sweep_ms'], round(elapsed, 3))
+        return expired
+
+    def snapshot(self):
+        return dict(self.stats, tracked=len(self.wheel), timeout=self.timeout)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"心跳清理出错: {e!r}")
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+优雅重启
+关闭前先排空：不再接受新连接，等待出站队列发完，再给每个客户端一个带随机退避的重连提示，
+避免所有设备在同一时刻重连；同时把客户端登记、消息历史、序号和状态写入本地快照，
+下一个进程启动时直接加载，不必从空状态开始
+"""
+
+import logging
+import os
+import random
+import time
+from typing import Optional
+
+import sync_codec
+from sync_clock import clock
+
+logger = logging.getLogger(__name__)
+
+# 快照格式版本，不兼容的旧快照直接忽略
+SNAPSHOT_VERSION = 1
+
+
+def reconnect_hint(backoff_min: float, backoff_max: float, last_seq: Optional[int] = None) -> dict:
+    """重连提示，retry_after在[backoff_min, backoff_max]秒内随机，把重连分散开"""
+    hint = {
+        'type': 'reconnect',
+        'retry_after': round(random.uniform(backoff_min, backoff_max), 3),
+        'timestamp': clock.iso()
+    }
+    if last_seq is not None:
+        hint['last_seq'] = last_seq
+    return hint
+
+
+def save_snapshot(path: str, snapshot: dict):
+    """原子写入快照：先写临时文件并fsync，再替换，进程中途被杀也不会留下半个文件"""
+    snapshot = dict(snapshot, version=SNAPSHOT_VERSION, saved_at=time.time())
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(sync_codec.dumps_bytes(snapshot))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path: str) -> Optional[dict]:
+    """读取快照，不存在或无法解析时返回None；快照只使用一次，读取后即删除"""
+    try:
+        with open(path, 'rb') as f:
+            raw = f.read()
+    except FileNotFoundError:
+        return None
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    try:
+        snapshot = sync_codec.loads(raw)
+    except sync_codec.DecodeError as e:
+        logger.warning(f"热启动快照无法解析，忽略: {e}")
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION:
+        logger.warning("热启动快照版本不匹配，忽略")
+        return None
+    return snapshot
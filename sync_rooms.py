@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+群组订阅索引
+维护 群组id -> 客户端集合 的倒排索引，群组事件只投递给订阅了该群组的客户端
+"""
+
+from typing import Dict, Iterable, Set
+
+
+class SubscriptionIndex:
+    def __init__(self):
+        self.members: Dict[str, Set[str]] = {}
+        self.subscriptions: Dict[str, Set[str]] = {}
+        # 未声明订阅的旧客户端，接收所有群组事件
+        self.wildcard: Set[str] = set()
+
+    def set_wildcard(self, client_id):
+        """把客户端标记为接收全部事件（兼容不发送订阅信息的旧客户端）"""
+        self.remove_client(client_id)
+        self.wildcard.add(client_id)
+
+    def subscribe(self, client_id, group_ids: Iterable) -> Set[str]:
+        """订阅群组，返回该客户端当前订阅的全部群组"""
+        self.wildcard.discard(client_id)
+        groups = self.subscriptions.setdefault(client_id, set())
+        for group_id in group_ids:
+            group_id = str(group_id)
+            groups.add(group_id)
+            self.members.setdefault(group_id, set()).add(client_id)
+        return groups
+
+    def unsubscribe(self, client_id, group_ids: Iterable) -> Set[str]:
+        """取消订阅群组，返回该客户端剩余的订阅"""
+        groups = self.subscriptions.get(client_id, set())
+        for group_id in group_ids:
+            group_id = str(group_id)
+            groups.discard(group_id)
+            self._discard_member(group_id, client_id)
+        return groups
+
+    def remove_client(self, client_id):
+        """客户端断开时清理所有订阅"""
+        self.wildcard.discard(client_id)
+        for group_id in self.subscriptions.pop(client_id, ()):
+            self._discard_member(group_id, client_id)
+
+    def is_wildcard(self, client_id) -> bool:
+        return client_id in self.wildcard
+
+    def groups_of(self, client_id) -> Set[str]:
+        return self.subscriptions.get(client_id, set())
+
+    def recipients(self, group_id) -> Set[str]:
+        """群组事件的接收者：群组成员加上通配订阅者"""
+        members = self.members.get(str(group_id))
+        if not members:
+            return self.wildcard
+        if not self.wildcard:
+            return members
+        return members | self.wildcard
+
+    def _discard_member(self, group_id, client_id):
+        members = self.members.get(group_id)
+        if members is not None:
+            members.discard(client_id)
+            if not members:
+                del self.members[group_id]
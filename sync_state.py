@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+版本化的用户/群组状态
+服务器保存每个用户和群组记录的最新版本，客户端发送带版本号的字段级补丁，
+其他客户端只收到变化的字段；列表字段（如群成员）用增删元素代替整表重发
+
+增量格式（客户端上行与服务器广播相同，服务器广播额外带version）:
+    data:          {"id": ..., 字段: 新值}
+    unset:         [删除的字段]
+    add / remove:  {列表字段: [追加/移除的元素]}
+    base_version:  增量基于的版本；上行缺省时data视为完整对象，由服务器计算差异
+
+多worker模式下版本号取自跨进程共享计数器，全局唯一；各worker经总线交换变更字段的
+当前值和字段版本，按字段保留版本较大的值（merge），合并结果与到达顺序无关
+"""
+
+from typing import Callable, Dict, Optional
+
+_MISSING = object()
+
+
+class StateConflict(Exception):
+    """补丁修改的字段在base_version之后已被其他客户端修改"""
+
+    def __init__(self, record):
+        super().__init__('Version conflict')
+        self.record = record
+
+
+class StateRecord:
+    __slots__ = ('version', 'data', 'field_versions')
+
+    def __init__(self, record_id):
+        self.version = 0
+        self.data = {'id': record_id}
+        # 每个字段最后一次修改时的版本，用于字段级冲突检测
+        self.field_versions: Dict[str, int] = {}
+
+
+def _is_scalar_list(value) -> bool:
+    return isinstance(value, list) and all(isinstance(item, (str, int)) for item in value)
+
+
+def _list_delta(old: list, new: list):
+    """
+    把整表替换转换成 (追加, 移除)，仅当按顺序应用增删后恰好得到新列表时成立；
+    否则返回None，仍整表发送
+    """
+    if not (_is_scalar_list(old) and _is_scalar_list(new)):
+        return None
+    new_items = set(new)
+    removed = [item for item in old if item not in new_items]
+    removed_items = set(removed)
+    kept = [item for item in old if item not in removed_items]
+    if new[:len(kept)] != kept:
+        return None
+    added = new[len(kept):]
+    if len(added) + len(removed) >= len(new):
+        return None
+    return added, removed
+
+
+def _fold_list_ops(delta: dict):
+    """
+    增量拆成 (data, unset, add, remove) 的可修改副本；同一字段既被设置/删除又有列表操作时，
+    把列表操作合并进设置的值，保证每个字段只有一种操作
+    """
+    data = dict(delta.get('data') or {})
+    unset = list(delta.get('unset') or ())
+    add = {field: list(items) for field, items in (delta.get('add') or {}).items()}
+    remove = {field: list(items) for field, items in (delta.get('remove') or {}).items()}
+    for field in set(add) | set(remove):
+        if field in data or field in unset:
+            if field in unset:
+                unset.remove(field)
+                current = []
+            else:
+                current = data[field]
+                if not isinstance(current, list):
+                    return None
+            items = remove.pop(field, [])
+            data[field] = [item for item in current + add.pop(field, []) if item not in items]
+    return data, unset, add, remove
+
+
+def merge_deltas(older: dict, newer: dict) -> Optional[dict]:
+    """
+    把同一记录的两个连续增量（newer的base_version等于older的version）合并成一个
+    从older的base_version到newer的version的增量，其余字段（type、seq、timestamp）取newer的。
+    出站队列积压时用它合并状态更新，客户端收到的版本仍然连续；无法合并时返回None
+    """
+    if older.get('version') is None or newer.get('base_version') != older['version']:
+        return None
+    folded = _fold_list_ops(older)
+    if folded is None:
+        return None
+    data, unset, add, remove = folded
+    newer_add = newer.get('add') or {}
+    newer_remove = newer.get('remove') or {}
+
+    for field, value in (newer.get('data') or {}).items():
+        data[field] = value
+        if field in unset:
+            unset.remove(field)
+        add.pop(field, None)
+        remove.pop(field, None)
+    for field in newer.get('unset') or ():
+        data.pop(field, None)
+        add.pop(field, None)
+        remove.pop(field, None)
+        if field not in unset:
+            unset.append(field)
+    for field in set(newer_add) | set(newer_remove):
+        added = list(newer_add.get(field, ()))
+        removed = newer_remove.get(field, ())
+        if field in data or field in unset:
+            # 新增量的列表操作作用在旧增量设置/删除后的值上，直接算出结果
+            current = [] if field in unset else data[field]
+            if not isinstance(current, list):
+                return None
+            if field in unset:
+                unset.remove(field)
+            data[field] = [item for item in current + added if item not in removed]
+            continue
+        old_added = add.get(field, [])
+        old_removed = remove.get(field, [])
+        if any(item in old_removed for item in added):
+            # 先移除再追加会改变元素位置，合并后的增删无法表达
+            return None
+        # 旧增量追加、新增量又移除的元素两边都保留：追加会在字段不存在时创建列表
+        merged_add = old_added + added
+        merged_remove = old_removed + list(removed)
+        add.pop(field, None)
+        remove.pop(field, None)
+        if merged_add:
+            add[field] = merged_add
+        if merged_remove:
+            remove[field] = merged_remove
+
+    merged = dict(newer, data=data, base_version=older['base_version'])
+    for key, value in (('unset', unset), ('add', add), ('remove', remove)):
+        if value:
+            merged[key] = value
+        else:
+            merged.pop(key, None)
+    return merged
+
+
+class StateStore:
+    KINDS = ('user_sync', 'group_sync')
+
+    def __init__(self, versioner: Optional[Callable[[], int]] = None):
+        """versioner: 多worker模式下的跨进程版本号生成器，默认每条记录各自递增"""
+        self.records: Dict[str, Dict[str, StateRecord]] = {kind: {} for kind in self.KINDS}
+        # 任何记录变化都会递增，用于缓存完整快照
+        self.revision = 0
+        self._versioner = versioner
+
+    def get(self, kind: str, record_id) -> Optional[StateRecord]:
+        return self.records[kind].get(str(record_id))
+
+    def apply(self, kind: str, data: dict, unset=None, add=None, remove=None,
+              base_version=None, version=None) -> Optional[dict]:
+        """
+        应用一次更新，返回要广播的增量 {data, unset, add, remove, base_version, version}，
+        没有任何变化时返回None。字段冲突抛出StateConflict，格式错误抛出ValueError。
+        version由持久化日志中的增量指定（重启时重放），此时只在版本连续时应用。
+        """
+        record_id = str(data['id'])
+        records = self.records[kind]
+        record = records.get(record_id)
+        if record is None:
+            record = StateRecord(data['id'])
+        if version is not None and record.version != base_version:
+            return None
+
+        sets = {}
+        unset = [field for field in (unset or ()) if field != 'id']
+        add = dict(add or {})
+        remove = dict(remove or {})
+
+        if base_version is None:
+            # 完整对象：与当前状态比较得出差异，缺少的字段视为删除
+            add, remove = {}, {}
+            unset = [field for field in record.data if field != 'id' and field not in data]
+            for field, value in data.items():
+                if field == 'id':
+                    continue
+                old = record.data.get(field, _MISSING)
+                if old == value:
+                    continue
+                delta = _list_delta(old, value) if old is not _MISSING else None
+                if delta is not None:
+                    if delta[0]:
+                        add[field] = delta[0]
+                    if delta[1]:
+                        remove[field] = delta[1]
+                else:
+                    sets[field] = value
+        else:
+            if version is None:
+                touched = set(data) | set(unset) | set(add) | set(remove)
+                touched.discard('id')
+                if base_version > record.version or any(
+                        record.field_versions.get(field, 0) > base_version for field in touched):
+                    raise StateConflict(record)
+            for field, value in data.items():
+                if field != 'id' and record.data.get(field, _MISSING) != value:
+                    sets[field] = value
+            unset = [field for field in unset if field in record.data]
+            for ops in (add, remove):
+                for field, items in ops.items():
+                    if not isinstance(items, list):
+                        raise ValueError(f"add/remove of {field} must be a list")
+                    current = sets.get(field, record.data.get(field, []))
+                    if not isinstance(current, list):
+                        raise ValueError(f"Field {field} is not a list")
+
+        # 去掉不会改变状态的列表操作
+        for field in list(add):
+            current = sets.get(field, record.data.get(field, []))
+            items = [item for item in add[field] if item not in current]
+            if items:
+                add[field] = items
+            else:
+                del add[field]
+        for field in list(remove):
+            current = sets.get(field, record.data.get(field, []))
+            items = [item for item in remove[field] if item in current]
+            if items:
+                remove[field] = items
+            else:
+                del remove[field]
+
+        if not (sets or unset or add or remove):
+            return None
+
+        if version is not None:
+            new_version = version
+        elif self._versioner is not None:
+            new_version = max(self._versioner(), record.version + 1)
+        else:
+            new_version = record.version + 1
+        record.data.update(sets)
+        for field in unset:
+            record.data.pop(field, None)
+        for field, items in add.items():
+            record.data[field] = list(record.data.get(field, [])) + items
+        for field, items in remove.items():
+            record.data[field] = [item for item in record.data[field] if item not in items]
+        for field in list(sets) + unset + list(add) + list(remove):
+            record.field_versions[field] = new_version
+
+        delta = {
+            'data': dict(sets, id=record.data['id']),
+            'base_version': record.version,
+            'version': new_version
+        }
+        record.version = new_version
+        records[record_id] = record
+        self.revision += 1
+        if unset:
+            delta['unset'] = unset
+        if add:
+            delta['add'] = add
+        if remove:
+            delta['remove'] = remove
+        return delta
+
+    def field_state(self, kind: str, record_id, fields=None) -> Dict[str, list]:
+        """
+        {字段: [字段版本, 当前值]}，已删除的字段为 [字段版本]；fields为None时返回所有修改过的字段。
+        发给其他worker用merge合并
+        """
+        record = self.get(kind, record_id)
+        if record is None:
+            return {}
+        state = {}
+        for field in (record.field_versions if fields is None else fields):
+            version = record.field_versions.get(field, 0)
+            value = record.data.get(field, _MISSING)
+            state[field] = [version] if value is _MISSING else [version, value]
+        return state
+
+    def merge(self, kind: str, record_id, fields: Dict[str, list]) -> Optional[dict]:
+        """
+        合并其他worker的field_state：每个字段保留字段版本较大的值，记录版本取最大的字段版本。
+        返回本进程客户端要应用的增量（格式同apply），没有变化时返回None
+        """
+        records = self.records[kind]
+        record = records.get(str(record_id))
+        if record is None:
+            record = StateRecord(record_id)
+        sets, unset, add, remove = {}, [], {}, {}
+        new_version = record.version
+        for field, entry in fields.items():
+            version = entry[0]
+            if field == 'id' or version <= record.field_versions.get(field, 0):
+                continue
+            record.field_versions[field] = version
+            new_version = max(new_version, version)
+            old = record.data.get(field, _MISSING)
+            if len(entry) == 1:
+                if old is not _MISSING:
+                    del record.data[field]
+                    unset.append(field)
+                continue
+            value = entry[1]
+            if old == value:
+                continue
+            record.data[field] = value
+            delta = _list_delta(old, value) if old is not _MISSING else None
+            if delta is None:
+                sets[field] = value
+            else:
+                if delta[0]:
+                    add[field] = delta[0]
+                if delta[1]:
+                    remove[field] = delta[1]
+
+        if new_version == record.version and not (sets or unset or add or remove):
+            return None
+        delta = {
+            'data': dict(sets, id=record.data['id']),
+            'base_version': record.version,
+            'version': new_version
+        }
+        record.version = new_version
+        records[str(record_id)] = record
+        self.revision += 1
+        if unset:
+            delta['unset'] = unset
+        if add:
+            delta['add'] = add
+        if remove:
+            delta['remove'] = remove
+        return delta
+
+    def export(self) -> Dict[str, dict]:
+        """{kind: {id: [version, data, field_versions]}}，用于写入热启动快照"""
+        return {
+            kind: {rid: [record.version, record.data, record.field_versions] for rid, record in records.items()}
+            for kind, records in self.records.items()
+        }
+
+    def restore(self, exported: Dict[str, dict]):
+        """从export()的结果恢复全部记录"""
+        for kind in self.KINDS:
+            records = self.records[kind] = {}
+            for rid, (version, data, field_versions) in (exported.get(kind) or {}).items():
+                record = StateRecord(data['id'])
+                record.version = version
+                record.data = data
+                record.field_versions = field_versions
+                records[rid] = record
+        self.revision += 1
+
+    def snapshot(self, kind: str, record_ids=None) -> Dict[str, dict]:
+        """{id: {"version": ..., "data": {...}}}，record_ids为None时返回全部"""
+        records = self.records[kind]
+        if record_ids is None:
+            selected = records.items()
+        else:
+            selected = ((str(rid), records[str(rid)]) for rid in record_ids if str(rid) in records)
+        return {rid: {'version': record.version, 'data': record.data} for rid, record in selected}
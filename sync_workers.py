@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多worker启动器
+启动多个worker进程共享同一端口（SO_REUSEPORT），主进程运行广播总线并在worker退出时重启它
+
+用法: python sync_workers.py [--app vercel_sync_server:app] [--workers 4] [--port 8766]
+"""
+
+import argparse
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import tempfile
+
+from aiohttp import web
+
+import sync_bus
+
+logger = logging.getLogger(__name__)
+
+# 主进程运行着事件循环，fork出的子进程会继承它的运行状态，因此用spawn启动worker
+_mp = multiprocessing.get_context('spawn')
+
+
+def _bind_socket(host: str, port: int, reuse_port: bool) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    sock.setblocking(False)
+    return sock
+
+
+def _load_app(spec: str):
+    module_name, _, attr = spec.partition(':')
+    module = importlib.import_module(module_name)
+    return getattr(module, attr or 'app')
+
+
+def _worker_main(app_spec, host, port, bus_path, counter, shared_sock):
+    # 必须在取得应用之前设置，服务器实例在第一次访问app时创建
+    sync_bus.configure_worker(bus_path, counter)
+    app = _load_app(app_spec)
+    sock = shared_sock if shared_sock is not None else _bind_socket(host, port, reuse_port=True)
+    web.run_app(app, sock=sock, print=None)
+
+
+class WorkerSupervisor:
+    def __init__(self, app_spec: str, host: str, port: int, workers: int):
+        self.app_spec = app_spec
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.bus_path = os.path.join(tempfile.mkdtemp(prefix='sync-bus-'), 'bus.sock')
+        self.counter = _mp.Value('q', 0)
+        # 不支持SO_REUSEPORT的平台上由主进程绑定一个套接字，所有worker共享
+        self.shared_sock = None if hasattr(socket, 'SO_REUSEPORT') else _bind_socket(host, port, reuse_port=False)
+        self.processes = []
+        self._stopping = False
+
+    def _spawn(self):
+        process = _mp.Process(
+            target=_worker_main,
+            args=(self.app_spec, self.host, self.port, self.bus_path, self.counter, self.shared_sock),
+            daemon=True
+        )
+        process.start()
+        return process
+
+    async def run(self):
+        hub = sync_bus.BusHub(self.bus_path)
+        await hub.start()
+        self.processes = [self._spawn() for _ in range(self.workers)]
+        logger.info(f"已启动 {self.workers} 个worker，监听 {self.host}:{self.port}")
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop)
+
+        try:
+            while not self._stopping:
+                await asyncio.sleep(1)
+                for index, process in enumerate(self.processes):
+                    if not process.is_alive() and not self._stopping:
+                        logger.warning(f"worker {process.pid} 退出 (code={process.exitcode})，正在重启")
+                        self.processes[index] = self._spawn()
+        finally:
+            for process in self.processes:
+                if process.is_alive():
+                    process.terminate()
+            for process in self.processes:
+                process.join(timeout=10)
+            await hub.close()
+
+    def stop(self):
+        self._stopping = True
+
+
+def run_workers(app_spec: str, host: str = '0.0.0.0', port: int = 8766, workers: int = 0):
+    """以多worker模式运行应用，workers为0时使用CPU核数"""
+    workers = workers or os.cpu_count() or 1
+    asyncio.run(WorkerSupervisor(app_spec, host, port, workers).run())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    parser = argparse.ArgumentParser(description='多worker启动器')
+    parser.add_argument('--app', default='vercel_sync_server:app', help='应用，格式 模块:变量')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 8766)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('SYNC_WORKERS', 0)),
+                        help='worker数量，默认为CPU核数')
+    args = parser.parse_args()
+    run_workers(args.app, args.host, args.port, args.workers)
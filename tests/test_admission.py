@@ -0,0 +1,49 @@
+from types import SimpleNamespace
+
+import sync_ratelimit
+from sync_admission import CAPACITY, PER_IP, RATE, AdmissionControl, client_ip
+
+
+def test_unlimited_by_default():
+    control = AdmissionControl()
+    assert all(control.admit('1.2.3.4') == (None, 0) for _ in range(1000))
+    assert control.snapshot()['max_connections'] is None
+
+
+def test_capacity_and_release():
+    control = AdmissionControl(max_connections=2, retry_after=5)
+    assert control.admit('a') == (None, 0)
+    assert control.admit('b') == (None, 0)
+    reason, retry_after = control.admit('c')
+    assert reason == CAPACITY and 5 <= retry_after <= 10
+    control.release('a')
+    assert control.admit('c') == (None, 0)
+    assert control.rejected[CAPACITY] == 1 and control.admitted == 3
+
+
+def test_per_ip_limit():
+    control = AdmissionControl(per_ip=1)
+    assert control.admit('a') == (None, 0)
+    assert control.admit('a')[0] == PER_IP
+    assert control.admit('b') == (None, 0)
+    control.release('a')
+    assert 'a' not in control.by_ip
+    assert control.admit('a') == (None, 0)
+
+
+def test_accept_rate(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(sync_ratelimit.time, 'monotonic', lambda: now[0])
+    control = AdmissionControl(rate=2, burst=2)
+    assert control.admit('a') == (None, 0) and control.admit('b') == (None, 0)
+    reason, retry_after = control.admit('c')
+    # 令牌不足0.5秒就能补上，Retry-After至少1秒
+    assert reason == RATE and 1 <= retry_after <= 2
+    now[0] += 0.5
+    assert control.admit('c') == (None, 0)
+
+
+def test_client_ip_trusts_forwarded_only_when_enabled():
+    request = SimpleNamespace(remote='10.0.0.1', headers={'X-Forwarded-For': '203.0.113.5, 10.0.0.2'})
+    assert client_ip(request) == '10.0.0.1'
+    assert client_ip(request, trust_forwarded=True) == '203.0.113.5'
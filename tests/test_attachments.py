@@ -0,0 +1,51 @@
+import asyncio
+import hashlib
+
+import pytest
+
+from sync_attachments import AttachmentStore, AttachmentTooLarge, download_headers
+
+
+class Stream:
+    def __init__(self, data, chunk=1000):
+        self.data = data
+        self.chunk = chunk
+
+    async def iter_chunked(self, size):
+        for start in range(0, len(self.data), self.chunk):
+            yield self.data[start:start + self.chunk]
+
+
+@pytest.mark.parametrize('name', ['page.html', 'logo.svg', 'feed.xml', 'run.js', None])
+def test_scriptable_types_are_downloaded(name):
+    headers = download_headers(name)
+    assert headers['Content-Type'] == 'application/octet-stream'
+    assert headers['Content-Disposition'].startswith('attachment')
+    assert headers['X-Content-Type-Options'] == 'nosniff'
+
+
+def test_safe_types_render_inline():
+    headers = download_headers('图.jpg')
+    assert headers['Content-Type'] == 'image/jpeg'
+    assert headers['Content-Disposition'] == "inline; filename*=UTF-8''%E5%9B%BE.jpg"
+
+
+def test_save_dedupes_and_enforces_limit(tmp_path):
+    store = AttachmentStore(str(tmp_path), max_bytes=5000)
+    data = b'x' * 3000
+
+    async def run():
+        first = await store.save(Stream(data))
+        second = await store.save(Stream(data))
+        with pytest.raises(AttachmentTooLarge):
+            await store.save(Stream(b'y' * 6000))
+        with pytest.raises(ValueError):
+            await store.save(Stream(b''))
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == second == (hashlib.sha256(data).hexdigest(), 3000)
+    assert store.stats['deduplicated'] == 1 and store.stats['rejected'] == 1
+    assert store.path(first[0]) is not None
+    assert store.path('../' + first[0]) is None
+    assert list((tmp_path / 'tmp').iterdir()) == []
@@ -0,0 +1,67 @@
+import pytest
+
+import sync_binary
+from sync_binary import BinaryDecodeError
+
+
+def roundtrip(message):
+    return sync_binary.decode(sync_binary.encode(message))
+
+
+def test_roundtrip_builtin_and_custom_fields():
+    message = {
+        'type': 'message_sync',
+        'device_id': 'dev-1',
+        'seq': 42,
+        'data': {
+            'id': 'm1', 'text': '你好', 'custom_field': [1, -2, 3.5, None, True, False],
+            'nested': {'a': {'b': 'c'}}, 'big': 2 ** 62, 'negative': -(2 ** 40)
+        }
+    }
+    assert roundtrip(message) == message
+
+
+def test_roundtrip_unknown_message_type():
+    message = {'type': 'future_sync', 'payload': {'x': 1}}
+    assert roundtrip(message) == message
+
+
+def test_timestamp_encoded_as_epoch_ms():
+    decoded = roundtrip({'type': 'heartbeat', 'timestamp': '2024-01-01T12:00:00.250'})
+    assert isinstance(decoded['timestamp'], int)
+    assert decoded['timestamp'] % 1000 == 250
+    # 不是ISO格式的字符串原样保留
+    assert roundtrip({'type': 'heartbeat', 'timestamp': 'soon'})['timestamp'] == 'soon'
+
+
+def test_nested_protocol_messages():
+    message = {'type': 'batch', 'events': [
+        {'type': 'message_sync', 'seq': 1, 'data': {'id': 'a'}},
+        {'type': 'user_sync', 'data': {'id': 'u'}},
+    ]}
+    assert roundtrip(message) == message
+
+
+def test_encode_joined_matches_encode():
+    events = [{'type': 'message_sync', 'seq': i, 'data': {'id': str(i)}} for i in range(3)]
+    header = {'type': 'history_replay', 'last_seq': 2, 'truncated': False, 'count': 3}
+    joined = sync_binary.encode_joined(header, [sync_binary.encode(event) for event in events])
+    assert joined == sync_binary.encode(dict(header, events=events))
+    assert sync_binary.decode(joined)['events'] == events
+
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'\x00\x04',
+    bytes((sync_binary.MAGIC, 0x7F, 0)),
+    sync_binary.encode({'type': 'heartbeat', 'seq': 1})[:-1],
+    sync_binary.encode({'type': 'heartbeat'}) + b'\x00',
+])
+def test_decode_rejects_malformed_frames(data):
+    with pytest.raises(BinaryDecodeError):
+        sync_binary.decode(data)
+
+
+def test_unsupported_value_type():
+    with pytest.raises(TypeError):
+        sync_binary.encode({'type': 'heartbeat', 'data': object()})
@@ -0,0 +1,55 @@
+import sync_dedup
+from sync_dedup import DedupCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_expiry(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(sync_dedup.time, 'monotonic', clock)
+    cache = DedupCache(maxsize=10, ttl=5)
+    cache.add('m1', 1)
+    clock.now += 4
+    assert cache.get('m1') == 1
+    clock.now += 2
+    assert cache.get('m1') is None
+    # 下一次写入时清掉过期条目
+    cache.add('m2', 2)
+    assert len(cache) == 1 and cache.evictions == 1
+
+
+def test_size_eviction_drops_oldest(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(sync_dedup.time, 'monotonic', clock)
+    cache = DedupCache(maxsize=2, ttl=60)
+    for seq, message_id in enumerate(('a', 'b', 'c'), 1):
+        cache.add(message_id, seq)
+    assert cache.get('a') is None
+    assert cache.get('b') == 2 and cache.get('c') == 3
+    assert cache.snapshot()['evictions'] == 1 and cache.hits == 2
+
+
+def test_readding_moves_entry_to_newest(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(sync_dedup.time, 'monotonic', clock)
+    cache = DedupCache(maxsize=2, ttl=60)
+    cache.add('a', 1)
+    cache.add('b', 2)
+    cache.add('a', 3)
+    cache.add('c', 4)
+    assert cache.get('a') == 3 and cache.get('b') is None
+
+
+def test_long_ids_stored_as_digest():
+    cache = DedupCache()
+    long_id = 'x' * 1000
+    cache.add(long_id, 7)
+    assert cache.get(long_id) == 7
+    key = next(iter(cache._entries))
+    assert isinstance(key, bytes) and len(key) == 16
@@ -0,0 +1,74 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from sync_dispatch import Dispatcher, compile_schema
+
+
+def test_empty_schema_compiles_to_none():
+    assert compile_schema({}) is None
+    assert compile_schema(None) is None
+
+
+def test_required_optional_and_nested_fields():
+    validate = compile_schema({
+        'data': 'dict',
+        'data.id': ('str|int', "Missing message id"),
+        'groups': 'list?',
+    })
+    assert validate({'data': {'id': 'm1'}}) is None
+    assert validate({'data': {'id': 5}, 'groups': ['g']}) is None
+    assert validate({}) == "Missing data"
+    assert validate({'data': {}}) == "Missing data"
+    assert validate({'data': {'x': 1}}) == "Missing message id"
+    assert validate({'data': {'id': 1.5}}) == "Missing message id"
+    assert validate({'data': {'id': 'm'}, 'groups': 'g'}) == "Invalid groups"
+    # 可选字段为空容器时视为缺失
+    assert validate({'data': {'id': 'm'}, 'groups': []}) is None
+
+
+def test_bool_is_not_an_int_unless_declared():
+    assert compile_schema({'n': 'int'})({'n': True}) == "Invalid n"
+    assert compile_schema({'n': 'int|bool'})({'n': True}) is None
+    assert compile_schema({'n': 'number'})({'n': 1.5}) is None
+
+
+def test_unknown_type_rejected_at_compile_time():
+    with pytest.raises(ValueError):
+        compile_schema({'n': 'float'})
+
+
+def test_dispatch_routes_validates_and_records_stats():
+    observed = []
+    dispatcher = Dispatcher(observe=lambda seconds, label: observed.append(label))
+    handled = []
+
+    async def handler(session, data):
+        handled.append(data['type'])
+
+    async def broken(session, data):
+        raise RuntimeError('boom')
+
+    dispatcher.register('ping', handler)
+    dispatcher.register('sync', handler, schema={'data': 'dict'}, registered=True)
+    dispatcher.register('broken', broken)
+    anonymous = SimpleNamespace(client_id=None)
+    registered = SimpleNamespace(client_id='c')
+
+    async def run():
+        assert await dispatcher.dispatch(anonymous, {'type': 'ping'}) is None
+        assert await dispatcher.dispatch(anonymous, {'type': 'nope'}) == "Unknown message type: nope"
+        assert await dispatcher.dispatch(anonymous, {'type': 'sync', 'data': {'a': 1}}) == "Not registered"
+        assert await dispatcher.dispatch(registered, {'type': 'sync'}) == "Missing data"
+        assert await dispatcher.dispatch(registered, {'type': 'sync', 'data': {'a': 1}}) is None
+        with pytest.raises(RuntimeError):
+            await dispatcher.dispatch(anonymous, {'type': 'broken'})
+
+    asyncio.run(run())
+    assert handled == ['ping', 'sync']
+    assert observed == ['ping', 'sync']
+    snapshot = dispatcher.snapshot()
+    assert snapshot['sync']['calls'] == 1 and snapshot['sync']['rejected'] == 2
+    assert snapshot['broken']['errors'] == 1
+    assert dispatcher.label('nope') == 'unknown' and 'ping' in dispatcher
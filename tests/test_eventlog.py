@@ -0,0 +1,67 @@
+import socket
+import threading
+
+import pytest
+
+from sync_eventlog import EventLog, EventStoreError, RedisEventLog, _RedisConnection
+
+
+def test_read_filters_groups_and_sender_but_advances_cursor():
+    log = EventLog(maxlen=10)
+    log.append({'type': 'a'}, group_id='g1', sender='d1')
+    log.append({'type': 'b'}, group_id='g2', sender='d2')
+    log.append({'type': 'c'}, sender='d2')
+    events, cursor, truncated = log.read(0, groups={'g1'}, exclude='d1')
+    assert [seq for seq, _ in events] == [3]
+    assert cursor == 3 and not truncated
+
+
+def test_wait_wakes_on_append_from_another_thread():
+    log = EventLog()
+    timer = threading.Timer(0.05, log.append, args=({'type': 'x'},))
+    timer.start()
+    assert log.wait(0, 5)
+    assert not log.wait(1, 0.01)
+
+
+def connection_with_replies(replies: bytes):
+    """用socketpair代替Redis，服务端预先写好回复"""
+    client, server = socket.socketpair()
+    server.sendall(replies)
+    conn = _RedisConnection.__new__(_RedisConnection)
+    conn.timeout = 1
+    conn.sock = client
+    conn.file = client.makefile('rb')
+    return conn, server
+
+
+def test_resp_replies_are_parsed():
+    conn, server = connection_with_replies(
+        b'+OK\r\n:42\r\n$5\r\nhello\r\n$-1\r\n*2\r\n$1\r\na\r\n*1\r\n:1\r\n-ERR boom\r\n')
+    assert conn.command('PING') == b'OK'
+    assert conn.command('INCR', 'k') == 42
+    assert conn.command('GET', 'k') == b'hello'
+    assert conn.command('GET', 'missing') is None
+    assert conn.command('XRANGE') == [b'a', [1]]
+    with pytest.raises(EventStoreError):
+        conn.command('BAD')
+    assert server.recv(1024).startswith(b'*1\r\n$4\r\nPING\r\n')
+    server.close()
+    with pytest.raises(ConnectionError):
+        conn.command('PING')
+
+
+def test_redis_read_decodes_stream_entries(monkeypatch):
+    log = RedisEventLog('redis://localhost')
+    entries = [
+        [b'4-0', [b'g', b'', b's', b'd1', b'e', b'{"type":"a"}']],
+        [b'5-0', [b'g', b'g2', b's', b'd2', b'e', b'{"type":"b"}']],
+        [b'6-0', [b'g', b'g1', b's', b'd2', b'e', b'{"type":"c"}']],
+    ]
+    monkeypatch.setattr(log, '_command', lambda *args, **kwargs: [6, b'2-0', entries])
+    events, cursor, truncated = log.read(3, groups={'g1'}, exclude='d1')
+    assert events == [(6, '{"seq":6,"type":"c"}')]
+    assert cursor == 6 and not truncated
+    _, _, truncated = log.read(0)
+    assert truncated
+    assert log.read(9) == ([], 6, True)
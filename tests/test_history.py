@@ -0,0 +1,99 @@
+from sync_frames import Frame
+from sync_history import GLOBAL_STREAM, MessageHistory
+
+
+def message(history, group_id):
+    seq = history.next_seq()
+    history.append(group_id, seq, Frame({'type': 'message_sync', 'seq': seq}))
+    return seq
+
+
+def seqs(frames):
+    return [frame.payload['seq'] for frame in frames]
+
+
+def test_replay_merges_groups_in_seq_order():
+    history = MessageHistory()
+    for group_id in ('a', 'b', None, 'a', 'b'):
+        message(history, group_id)
+    frames, truncated = history.replay(['a', 'b', GLOBAL_STREAM], 1)
+    assert seqs(frames) == [2, 3, 4, 5]
+    assert not truncated
+    frames, truncated = history.replay(['b'], 0)
+    assert seqs(frames) == [2, 5]
+
+
+def test_replay_reports_per_group_eviction():
+    history = MessageHistory(per_group=2)
+    for _ in range(3):
+        message(history, 'a')
+    frames, truncated = history.replay(['a'], 0)
+    assert seqs(frames) == [2, 3]
+    assert truncated
+    frames, truncated = history.replay(['a'], 1)
+    assert seqs(frames) == [2, 3]
+    assert not truncated
+
+
+def test_wildcard_replay_sees_fully_evicted_group():
+    """群组的消息全部被淘汰后不再出现在groups中，全量补发仍要报告缺失"""
+    size = len(Frame({'type': 'message_sync', 'seq': 1}).data)
+    history = MessageHistory(max_bytes=3 * size)
+    message(history, 'a')
+    for _ in range(3):
+        message(history, 'b')
+    assert 'a' not in history.groups
+    assert history.evicted_upto == {'a': 1}
+    frames, truncated = history.replay(None, 0)
+    assert seqs(frames) == [2, 3, 4]
+    assert truncated
+    frames, truncated = history.replay(None, 1)
+    assert seqs(frames) == [2, 3, 4]
+    assert not truncated
+
+
+def test_replay_cursor_from_previous_process_is_truncated():
+    history = MessageHistory()
+    message(history, 'a')
+    frames, truncated = history.replay(['a'], 100)
+    assert seqs(frames) == [1]
+    assert truncated
+
+
+def test_out_of_order_append_keeps_ring_sorted():
+    history = MessageHistory()
+    for seq in (1, 3, 2):
+        history.append('a', seq, Frame({'seq': seq}))
+    frames, _ = history.replay(['a'], 0)
+    assert seqs(frames) == [1, 2, 3]
+    assert [seq for seq, _, _ in history.entries()] == [1, 2, 3]
+
+
+def test_resume_pages_large_replays():
+    """补发超过SYNC_REPLAY_MAX_BYTES时分页，用返回的last_seq取下一页直到more为false"""
+    import asyncio
+    from types import SimpleNamespace
+    from vercel_sync_server import VercelSyncServer
+
+    server = VercelSyncServer()
+    server.replay_max_bytes = 1000
+    for _ in range(30):
+        seq = server.message_history.next_seq()
+        server.message_history.append(None, seq, Frame({'type': 'message_sync', 'seq': seq, 'data': {'text': 'x' * 100}}))
+    sent = []
+    session = SimpleNamespace(client_id='c', websocket=None, client_info=SimpleNamespace(
+        outbound=SimpleNamespace(put=sent.append)))
+
+    received = []
+    cursor = 0
+    while True:
+        asyncio.run(server.handle_resume(session, {'last_seq': cursor}))
+        frame = sent.pop()
+        assert len(frame.data) <= 1000 + 200
+        header = frame.payload
+        received += [part.payload['seq'] for part in frame.parts]
+        cursor = header['last_seq']
+        if not header['more']:
+            break
+    assert received == list(range(1, 31))
+    assert cursor == 30
@@ -0,0 +1,131 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from sync_journal import Journal, Segment
+
+
+def read_seqs(directory):
+    journal = Journal(directory, fsync=False)
+    journal.open()
+    try:
+        return [seq for seq, _, _ in journal.read(1)]
+    finally:
+        for segment in journal.segments:
+            segment.close()
+
+
+def test_close_writes_pending_records(tmp_path):
+    async def run():
+        journal = Journal(str(tmp_path), fsync=False)
+        journal.open()
+        await journal.start()
+        for seq in range(1, 4):
+            journal.append(seq, 'g', b'{"seq":%d}' % seq)
+        await journal.close()
+
+    asyncio.run(run())
+    assert read_seqs(str(tmp_path)) == [1, 2, 3]
+
+
+def test_close_waits_for_inflight_write(tmp_path, monkeypatch):
+    """关闭时正在线程池中写盘的一批记录只能落盘一次"""
+    original_sync = Segment.sync
+
+    def slow_sync(segment):
+        time.sleep(0.2)
+        original_sync(segment)
+
+    monkeypatch.setattr(Segment, 'sync', slow_sync)
+
+    async def run():
+        journal = Journal(str(tmp_path), flush_interval=0.001)
+        journal.open()
+        await journal.start()
+        for seq in range(1, 6):
+            journal.append(seq, None, b'{}')
+        # 等后台任务把这一批交给线程池，再在写盘进行中关闭
+        await asyncio.sleep(0.05)
+        journal.append(6, None, b'{}')
+        await journal.close()
+
+    asyncio.run(run())
+    assert read_seqs(str(tmp_path)) == [1, 2, 3, 4, 5, 6]
+
+
+def test_reopen_continues_sequence_and_reads_groups(tmp_path):
+    async def write(seqs):
+        journal = Journal(str(tmp_path), fsync=False)
+        journal.open()
+        await journal.start()
+        for seq in seqs:
+            journal.append(seq, 'g%d' % (seq % 2), b'x')
+        await journal.close()
+        return journal.last_seq
+
+    assert asyncio.run(write(range(1, 4))) == 3
+    journal = Journal(str(tmp_path), fsync=False)
+    journal.open()
+    assert journal.last_seq == 3
+    assert journal.read(2) == [(2, 'g0', b'x'), (3, 'g1', b'x')]
+    for segment in journal.segments:
+        segment.close()
+    asyncio.run(write(range(4, 6)))
+    assert read_seqs(str(tmp_path)) == [1, 2, 3, 4, 5]
+
+
+def test_recover_truncates_torn_tail(tmp_path):
+    async def write():
+        journal = Journal(str(tmp_path), fsync=False)
+        journal.open()
+        await journal.start()
+        for seq in range(1, 4):
+            journal.append(seq, None, b'payload')
+        await journal.close()
+        return journal.segments[-1].log_path
+
+    log_path = asyncio.run(write())
+    with open(log_path, 'ab') as f:
+        f.write(b'\x04\x00\x00')
+    assert read_seqs(str(tmp_path)) == [1, 2, 3]
+
+
+def test_state_rebuilt_from_checkpoint_and_journaled_deltas(tmp_path, monkeypatch):
+    """重启后状态从检查点和之后日志中的增量重建，版本号接着上次继续"""
+    monkeypatch.setenv('SYNC_JOURNAL_DIR', str(tmp_path))
+    monkeypatch.setenv('SYNC_JOURNAL_FSYNC', '0')
+    from vercel_sync_server import VercelSyncServer
+
+    async def noop(*args, **kwargs):
+        pass
+
+    def make_server():
+        server = VercelSyncServer()
+        server.send_reply = server.send_error = server.broadcast_to_others = noop
+        server.journal.open()
+        server.load_journal()
+        return server
+
+    def sync(server, data, **fields):
+        session = SimpleNamespace(websocket=None)
+        return server.handle_state_sync(session, dict(fields, type='group_sync', data=data))
+
+    async def first_run():
+        server = make_server()
+        await server.journal.start()
+        await sync(server, {'id': 'g', 'name': 'a', 'members': ['u1']})
+        await server.checkpoint_state()
+        await sync(server, {'id': 'g', 'name': 'b'}, base_version=1, add={'members': ['u2']})
+        await sync(server, {'id': 'h', 'name': 'x'})
+        # 模拟异常退出：日志已落盘，但之后的检查点没有写
+        await server.journal.close()
+
+    asyncio.run(first_run())
+    server = make_server()
+    record = server.state.get('group_sync', 'g')
+    assert record.version == 2 and record.data == {'id': 'g', 'name': 'b', 'members': ['u1', 'u2']}
+    assert server.state.get('group_sync', 'h').data == {'id': 'h', 'name': 'x'}
+    delta = server.state.apply('group_sync', {'id': 'g', 'name': 'c'}, base_version=2)
+    assert delta['version'] == 3
+    for segment in server.journal.segments:
+        segment.close()
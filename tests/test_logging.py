@@ -0,0 +1,48 @@
+import logging
+
+import pytest
+
+from sync_logging import MessageLog
+
+
+class Recorder(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(record.getMessage())
+
+
+@pytest.fixture
+def recorder():
+    logger = logging.getLogger('test_sync_logging')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    handler = Recorder()
+    logger.addHandler(handler)
+    yield logger, handler
+    logger.removeHandler(handler)
+
+
+@pytest.mark.parametrize('sample_every, expected', [(1, [1, 2, 3, 4, 5]), (2, [1, 3, 5]), (100, [1])])
+def test_sampling_logs_first_of_every_n(recorder, sample_every, expected):
+    logger, handler = recorder
+    log = MessageLog(logger, sample_every=sample_every)
+    for i in range(1, 6):
+        log.log('message_sync', "msg %d", i)
+    assert handler.lines == [f"msg {i}" for i in expected]
+    assert log.counts == {'message_sync': 5}
+
+
+def test_modes_and_summary(recorder):
+    logger, handler = recorder
+    log = MessageLog(logger, modes={'heartbeat': 'off', 'register': 'all'}, sample_every=100, interval=60)
+    for _ in range(3):
+        log.log('heartbeat', "hb")
+        log.log('register', "reg")
+    assert handler.lines == ["reg"] * 3
+    log.summary()
+    # off的类型既不输出也不计数
+    assert handler.lines[-1] == "最近60秒: register 3条"
+    assert log.counts == {}
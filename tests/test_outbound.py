@@ -0,0 +1,144 @@
+import asyncio
+
+import pytest
+
+from sync_frames import Frame
+from sync_outbound import COALESCE, DISCONNECT, DROP_OLDEST, OutboundQueue
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+class Recorder:
+    """记录发送的帧，gate未放行时阻塞，模拟不读数据的慢客户端"""
+
+    def __init__(self, blocked=False):
+        self.sent = []
+        self.gate = asyncio.Event()
+        if not blocked:
+            self.gate.set()
+
+    async def __call__(self, websocket, frame, binary):
+        await self.gate.wait()
+        self.sent.append(frame.payload)
+
+
+async def until(predicate):
+    while not predicate():
+        await asyncio.sleep(0.001)
+
+
+def message(seq):
+    return Frame({'type': 'message_sync', 'seq': seq})
+
+
+def test_unknown_policy_rejected():
+    with pytest.raises(ValueError):
+        OutboundQueue('c', FakeWebSocket(), Recorder(), policy='block')
+
+
+def test_drop_oldest_keeps_newest_frames():
+    async def run():
+        sender = Recorder(blocked=True)
+        queue = OutboundQueue('c', FakeWebSocket(), sender, maxsize=2, policy=DROP_OLDEST)
+        queue.start()
+        for seq in range(1, 5):
+            assert queue.put(message(seq))
+        assert queue.dropped == 2
+        sender.gate.set()
+        await asyncio.sleep(0.01)
+        await queue.close()
+        return sender.sent
+
+    assert [frame['seq'] for frame in asyncio.run(run())] == [3, 4]
+
+
+def test_coalesce_replaces_queued_state_and_drops_messages_otherwise():
+    async def run():
+        sender = Recorder(blocked=True)
+        queue = OutboundQueue('c', FakeWebSocket(), sender, maxsize=2, policy=COALESCE)
+        queue.start()
+        queue.put(Frame({'type': 'user_sync', 'data': {'id': 'u', 'name': 'a'}}))
+        queue.put(message(1))
+        queue.put(Frame({'type': 'user_sync', 'data': {'id': 'u', 'name': 'b'}}))
+        assert queue.coalesced == 1 and queue.dropped == 0
+        queue.put(message(2))
+        assert queue.dropped == 1
+        sender.gate.set()
+        await asyncio.sleep(0.01)
+        await queue.close()
+        return sender.sent
+
+    assert asyncio.run(run()) == [message(1).payload, message(2).payload]
+
+
+def test_disconnect_policy_aborts_slow_client():
+    async def run():
+        websocket = FakeWebSocket()
+        queue = OutboundQueue('c', websocket, Recorder(blocked=True), maxsize=1, policy=DISCONNECT)
+        queue.start()
+        assert queue.put(message(1))
+        assert not queue.put(message(2))
+        await asyncio.sleep(0)
+        assert queue.closed and websocket.closed and len(queue) == 0
+        assert not queue.put(message(3))
+        await queue.close()
+
+    asyncio.run(run())
+
+
+def test_flush_max_sends_full_batch_without_waiting():
+    async def run():
+        sender = Recorder()
+        queue = OutboundQueue('c', FakeWebSocket(), sender, flush_window=10, flush_max=3)
+        queue.start()
+        for seq in range(1, 4):
+            queue.put(message(seq))
+        await asyncio.wait_for(until(lambda: sender.sent), 1)
+        await queue.close()
+        return sender.sent, queue.batches
+
+    sent, batches = asyncio.run(run())
+    assert batches == 1
+    assert sent == [{'type': 'batch', 'count': 3}]
+
+
+def test_flush_window_sends_partial_batch_and_single_frames():
+    async def run():
+        sender = Recorder()
+        queue = OutboundQueue('c', FakeWebSocket(), sender, flush_window=0.02, flush_max=10)
+        queue.start()
+        queue.put(message(1))
+        queue.put(message(2))
+        await asyncio.sleep(0.05)
+        queue.put(message(3))
+        await asyncio.sleep(0.05)
+        await queue.close()
+        return sender.sent
+
+    # 窗口内攒到的两帧合并成batch，只有一帧时原样发送
+    assert asyncio.run(run()) == [{'type': 'batch', 'count': 2}, message(3).payload]
+
+
+def test_close_stops_writer_and_discards_pending():
+    async def run():
+        sender = Recorder(blocked=True)
+        queue = OutboundQueue('c', FakeWebSocket(), sender)
+        queue.start()
+        queue.put(message(1))
+        queue.put(message(2))
+        await asyncio.sleep(0)
+        assert not queue.idle
+        await queue.close()
+        sender.gate.set()
+        await asyncio.sleep(0.01)
+        return queue, sender.sent
+
+    queue, sent = asyncio.run(run())
+    assert queue.closed and len(queue) == 0 and sent == []
+    assert not queue.put(message(3))
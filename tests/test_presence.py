@@ -0,0 +1,68 @@
+import asyncio
+
+from sync_presence import PresenceTracker
+
+
+async def noop(payload):
+    pass
+
+
+def test_diff_reports_net_changes_only():
+    tracker = PresenceTracker(1, noop)
+    tracker.join('a', 'Alice')
+    tracker.join('b', 'Bob')
+    payload = tracker.diff()
+    assert payload['joined'] == [{'client_id': 'a', 'username': 'Alice'}, {'client_id': 'b', 'username': 'Bob'}]
+    assert payload['left'] == [] and payload['online'] == 2
+    assert tracker.diff() is None
+
+    # 间隔内先离线又上线不通知；离线的和改名的分别出现
+    tracker.leave('a')
+    tracker.join('a', 'Alice')
+    tracker.leave('b')
+    tracker.join('b', 'Bobby')
+    tracker.join('c', 'Carol')
+    tracker.leave('c')
+    tracker.leave('missing')
+    payload = tracker.diff()
+    assert payload['joined'] == [{'client_id': 'b', 'username': 'Bobby'}]
+    assert payload['left'] == []
+
+
+def test_large_diff_sends_reset():
+    tracker = PresenceTracker(1, noop, max_diff=2)
+    for i in range(3):
+        tracker.join(f'c{i}', 'x')
+    payload = tracker.diff()
+    assert payload['reset'] and 'joined' not in payload and payload['online'] == 3
+    assert tracker.stats['resets'] == 1
+
+
+def test_preload_is_silent_and_snapshot_filters():
+    tracker = PresenceTracker(1, noop)
+    tracker.preload({'a': 'Alice', 'b': 'Bob'})
+    assert tracker.diff() is None
+    tracker.join('a', 'Alice')
+    assert tracker.diff() is None
+    assert tracker.snapshot(['b', 'zzz']) == [{'client_id': 'b', 'username': 'Bob'}]
+    assert len(tracker.snapshot()) == 2
+
+
+def test_periodic_flush_broadcasts_once_per_interval():
+    sent = []
+
+    async def on_flush(payload):
+        sent.append(payload)
+
+    async def run():
+        tracker = PresenceTracker(0.01, on_flush)
+        tracker.start()
+        for i in range(50):
+            tracker.join(f'c{i}', 'x')
+        await asyncio.sleep(0.05)
+        await tracker.stop()
+        return tracker
+
+    tracker = asyncio.run(run())
+    assert len(sent) == 1 and len(sent[0]['joined']) == 50
+    assert tracker.stats['flushes'] == 1
@@ -0,0 +1,49 @@
+import pytest
+
+import sync_ratelimit
+from sync_ratelimit import FRAME, RateLimiter, parse_rules
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(sync_ratelimit.time, 'monotonic', clock)
+    return clock
+
+
+def test_parse_rules():
+    assert parse_rules(' *=100/200, message_sync=0.5/3,') == {'*': (100.0, 200.0), 'message_sync': (0.5, 3.0)}
+    with pytest.raises(ValueError):
+        parse_rules('message_sync=30')
+
+
+def test_burst_then_refill(clock):
+    limiter = RateLimiter({'message_sync': (2, 3)})
+    buckets = limiter.new_buckets()
+    assert [limiter.allow(buckets, 'message_sync') for _ in range(4)] == [True, True, True, False]
+    assert limiter.retry_after(buckets, 'message_sync') == pytest.approx(0.5)
+    clock.now += 0.5
+    assert limiter.allow(buckets, 'message_sync')
+    assert not limiter.allow(buckets, 'message_sync')
+    # 长时间空闲后令牌不超过桶容量
+    clock.now += 60
+    assert sum(limiter.allow(buckets, 'message_sync') for _ in range(10)) == 3
+
+
+def test_buckets_are_independent_per_type_and_connection(clock):
+    limiter = RateLimiter({FRAME: (1, 2), 'test_sync': (1, 1)})
+    first, second = limiter.new_buckets(), limiter.new_buckets()
+    assert limiter.allow(first, 'test_sync')
+    assert not limiter.allow(first, 'test_sync')
+    assert limiter.allow(first, FRAME) and limiter.allow(first, FRAME)
+    assert limiter.allow(second, 'test_sync')
+    # 没有规则的类型总是放行
+    assert all(limiter.allow(first, 'heartbeat') for _ in range(100))
@@ -0,0 +1,50 @@
+from sync_reaper import HeartbeatReaper, TimerWheel
+
+
+def test_wheel_returns_keys_of_passed_slots_only():
+    wheel = TimerWheel(tick=1, horizon=10, now=0)
+    wheel.schedule('a', 3.5)
+    wheel.schedule('b', 7)
+    assert wheel.advance(2) == []
+    assert wheel.advance(4) == ['a']
+    assert len(wheel) == 1
+    assert wheel.advance(8) == ['b']
+    assert len(wheel) == 0
+
+
+def test_wheel_reschedule_and_cancel():
+    wheel = TimerWheel(tick=1, horizon=10, now=0)
+    wheel.schedule('a', 2)
+    wheel.schedule('a', 6)
+    wheel.schedule('b', 2)
+    wheel.cancel('b')
+    assert wheel.advance(3) == []
+    assert wheel.advance(6) == ['a']
+
+
+def test_wheel_clamps_deadlines_and_survives_long_stalls():
+    wheel = TimerWheel(tick=1, horizon=5, now=0)
+    # 过去的截止时间落在下一格，超出范围的落在最后一格
+    wheel.schedule('past', -10)
+    wheel.schedule('far', 1000)
+    assert wheel.advance(1) == ['past']
+    # 事件循环卡顿远超一圈，只扫描一圈也不会漏掉
+    assert wheel.advance(100) == ['far']
+
+
+def test_reaper_expires_idle_and_reschedules_active_clients():
+    last_seen = {'idle': 0.0, 'active': 0.0, 'gone': 0.0}
+    expired = []
+    reaper = HeartbeatReaper(timeout=10, tick=1, last_seen=last_seen.get, on_expire=expired.extend)
+    reaper.wheel = TimerWheel(1, 10, now=0)
+    for client_id in list(last_seen):
+        reaper.track(client_id, now=0)
+    last_seen['active'] = 8.0
+    del last_seen['gone']
+
+    assert reaper.sweep(now=11) == ['idle']
+    assert expired == ['idle']
+    assert reaper.snapshot()['tracked'] == 1
+    assert reaper.sweep(now=15) == []
+    assert reaper.sweep(now=19) == ['active']
+    assert reaper.stats['reaped'] == 2
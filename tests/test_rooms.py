@@ -0,0 +1,34 @@
+from sync_rooms import SubscriptionIndex
+
+
+def test_recipients_include_members_and_wildcard():
+    index = SubscriptionIndex()
+    index.subscribe('a', ['g1', 2])
+    index.subscribe('b', ['g1'])
+    index.set_wildcard('w')
+    assert index.recipients('g1') == {'a', 'b', 'w'}
+    # 群组id统一按字符串处理
+    assert index.recipients(2) == {'a', 'w'}
+    assert index.recipients('nobody') == {'w'}
+    assert index.is_wildcard('w') and not index.is_wildcard('a')
+
+
+def test_unsubscribe_and_remove_clean_up_empty_groups():
+    index = SubscriptionIndex()
+    index.subscribe('a', ['g1', 'g2'])
+    index.subscribe('b', ['g2'])
+    assert index.unsubscribe('a', ['g1', 'missing']) == {'g2'}
+    assert 'g1' not in index.members
+    index.remove_client('a')
+    assert index.members == {'g2': {'b'}}
+    assert index.groups_of('a') == set()
+
+
+def test_switching_between_wildcard_and_subscriptions():
+    index = SubscriptionIndex()
+    index.subscribe('a', ['g1'])
+    index.set_wildcard('a')
+    assert index.members == {} and index.is_wildcard('a')
+    index.subscribe('a', ['g2'])
+    assert not index.is_wildcard('a')
+    assert index.recipients('g2') == {'a'}
@@ -0,0 +1,41 @@
+import sync_codec
+import vercel_simple_server as server
+
+
+def sync(body):
+    response = server.handler({'method': 'POST', 'url': '/sync', 'body': sync_codec.dumps(body)}, None)
+    return response['statusCode'], sync_codec.loads(response['body'])
+
+
+def test_invalid_op_in_batch_only_fails_that_op():
+    before = server.event_log.last_seq
+    status, result = sync({'type': 'batch', 'device_id': 'dev-batch', 'ops': [
+        {'type': 'message_sync', 'data': {'id': 'm1', 'conversation_id': 'g'}},
+        {'type': 'message_sync', 'data': 'not a dict'},
+        {'type': 'register', 'device_id': 12345},
+        {'type': 'group_sync', 'data': {'id': 'g'}},
+    ]})
+    assert status == 200
+    assert [r['type'] for r in result['results']] == ['ack', 'error', 'error', 'ack']
+    assert result['results'][1]['message'] == 'Invalid data'
+    assert result['results'][2]['message'] == 'Invalid device_id'
+    assert server.event_log.last_seq == before + 2
+
+
+def test_events_returns_immediately_by_default():
+    status, result = sync({'type': 'register', 'device_id': 'dev-poll'})
+    assert status == 200
+    cursor = result['cursor']
+    response = server.handler({
+        'method': 'GET', 'url': f'/events?device_id=dev-poll&cursor={cursor}&timeout=30'
+    }, None)
+    body = sync_codec.loads(response['body'])
+    assert body['events'] == [] and body['cursor'] == cursor
+
+
+def test_lazy_entry_points_are_listed_by_dir():
+    """只导入模块不构建应用，但入口变量仍出现在dir()中，部署平台据此查找"""
+    import vercel_sync_server
+    import wsgi_app
+    assert {'server', 'app', 'handler'} <= set(dir(vercel_sync_server))
+    assert {'sync_server', 'app', 'handler'} <= set(dir(wsgi_app))
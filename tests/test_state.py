@@ -0,0 +1,236 @@
+import asyncio
+import copy
+import random
+
+import pytest
+
+from sync_outbound import COALESCE, OutboundQueue
+from sync_frames import Frame
+from sync_state import StateConflict, StateStore, merge_deltas
+
+
+def apply_delta(record, delta):
+    """客户端应用广播增量的方式：设置、删除、追加、移除依次进行"""
+    record = copy.deepcopy(record)
+    record.update(delta['data'])
+    for field in delta.get('unset', ()):
+        record.pop(field, None)
+    for field, items in delta.get('add', {}).items():
+        record[field] = record.get(field, []) + items
+    for field, items in delta.get('remove', {}).items():
+        record[field] = [item for item in record[field] if item not in items]
+    return record
+
+
+def test_full_object_becomes_field_delta():
+    store = StateStore()
+    first = store.apply('group_sync', {'id': 'g', 'name': 'a', 'members': ['u1', 'u2', 'u3']})
+    assert first['base_version'] == 0 and first['version'] == 1
+    delta = store.apply('group_sync', {'id': 'g', 'name': 'a', 'members': ['u1', 'u3', 'u4']})
+    assert delta == {'data': {'id': 'g'}, 'base_version': 1, 'version': 2,
+                     'add': {'members': ['u4']}, 'remove': {'members': ['u2']}}
+    assert store.apply('group_sync', {'id': 'g', 'name': 'a', 'members': ['u1', 'u3', 'u4']}) is None
+
+
+def test_patch_conflicts_only_on_fields_changed_since_base():
+    store = StateStore()
+    store.apply('user_sync', {'id': 'u', 'name': 'a', 'status': 'x'})
+    store.apply('user_sync', {'id': 'u', 'status': 'y'}, base_version=1)
+    # name在版本1之后没有变化，基于版本1的补丁仍然可以应用
+    delta = store.apply('user_sync', {'id': 'u', 'name': 'b'}, base_version=1)
+    assert delta['base_version'] == 2 and delta['version'] == 3
+    with pytest.raises(StateConflict) as conflict:
+        store.apply('user_sync', {'id': 'u', 'status': 'z'}, base_version=1)
+    assert conflict.value.record.version == 3
+    with pytest.raises(StateConflict):
+        store.apply('user_sync', {'id': 'u', 'name': 'c'}, base_version=9)
+
+
+def test_forwarded_delta_applies_only_when_versions_are_contiguous():
+    store = StateStore()
+    assert store.apply('user_sync', {'id': 'u', 'name': 'b'}, base_version=1, version=2) is None
+    assert store.get('user_sync', 'u') is None
+    delta = store.apply('user_sync', {'id': 'u', 'name': 'a'}, base_version=0, version=1)
+    assert delta['version'] == 1
+    assert store.apply('user_sync', {'id': 'u', 'name': 'b'}, base_version=1, version=2)['version'] == 2
+    assert store.get('user_sync', 'u').data == {'id': 'u', 'name': 'b'}
+
+
+def test_merge_requires_consecutive_versions():
+    older = {'type': 'user_sync', 'data': {'id': 'u', 'a': 1}, 'base_version': 1, 'version': 2}
+    newer = {'type': 'user_sync', 'data': {'id': 'u', 'b': 2}, 'base_version': 3, 'version': 4}
+    assert merge_deltas(older, newer) is None
+    newer['base_version'] = 2
+    assert merge_deltas(older, newer) == {
+        'type': 'user_sync', 'data': {'id': 'u', 'a': 1, 'b': 2}, 'base_version': 1, 'version': 4}
+
+
+def random_patch(rng, record):
+    fields = ['name', 'status', 'members', 'tags']
+    data, unset, add, remove = {'id': 'r'}, [], {}, {}
+    for field in rng.sample(fields, rng.randint(1, 3)):
+        action = rng.choice(['set', 'unset', 'list'])
+        if action == 'set':
+            data[field] = rng.choice([rng.choice('xyz'), [rng.choice('abcdef') for _ in range(rng.randint(0, 3))]])
+        elif action == 'unset':
+            unset.append(field)
+        elif isinstance(record.get(field, []), list):
+            add[field] = rng.sample('abcdef', rng.randint(0, 2))
+            remove[field] = rng.sample('abcdef', rng.randint(0, 2))
+    return data, unset, add, remove
+
+
+def test_merged_delta_equals_sequential_application():
+    rng = random.Random(7)
+    merged_count = 0
+    for _ in range(2000):
+        store = StateStore()
+        store.apply('group_sync', {'id': 'r', 'name': 'n', 'members': list('abc'), 'tags': ['a']})
+        before = copy.deepcopy(store.get('group_sync', 'r').data)
+        deltas = []
+        while len(deltas) < 2:
+            data, unset, add, remove = random_patch(rng, store.get('group_sync', 'r').data)
+            record = store.get('group_sync', 'r')
+            try:
+                delta = store.apply('group_sync', data, unset=unset, add=add, remove=remove,
+                                    base_version=record.version)
+            except ValueError:
+                continue
+            if delta is not None:
+                deltas.append(delta)
+        after = store.get('group_sync', 'r').data
+        assert apply_delta(apply_delta(before, deltas[0]), deltas[1]) == after
+        merged = merge_deltas(deltas[0], deltas[1])
+        if merged is None:
+            continue
+        merged_count += 1
+        assert merged['base_version'] == deltas[0]['base_version']
+        assert merged['version'] == deltas[1]['version']
+        assert apply_delta(before, merged) == after
+    assert merged_count > 1900
+
+
+class FakeSocket:
+    closed = False
+
+
+def test_coalesce_policy_merges_versioned_deltas():
+    async def run():
+        queue = OutboundQueue('c', FakeSocket(), None, maxsize=2, policy=COALESCE)
+        # 写任务在第一次await之前不会运行，帧都留在队列里
+        queue.start()
+        store = StateStore()
+        frames = [
+            Frame(dict(store.apply('user_sync', {'id': 'u', 'name': 'a'}), type='user_sync')),
+            Frame({'type': 'message_sync', 'seq': 1, 'data': {'id': 'm'}}),
+            Frame(dict(store.apply('user_sync', {'id': 'u', 'status': 's'}, base_version=1), type='user_sync')),
+        ]
+        for frame in frames:
+            assert queue.put(frame)
+        assert queue.dropped == 0 and queue.coalesced == 1
+        merged = queue._frames[0].payload
+        assert (merged['base_version'], merged['version']) == (0, 2)
+        assert apply_delta({}, merged) == store.get('user_sync', 'u').data
+        # 版本不连续时不能合并，退回丢弃最旧的一帧
+        queue.put(Frame({'type': 'user_sync', 'data': {'id': 'u', 'x': 1}, 'base_version': 5, 'version': 6}))
+        assert queue.dropped == 1
+        await queue.close()
+
+    asyncio.run(run())
+
+
+def test_state_deltas_are_replayed_on_resume():
+    """状态增量和消息一样记入历史，凭游标补发时不会漏掉"""
+    from types import SimpleNamespace
+    from vercel_sync_server import VercelSyncServer
+
+    async def noop(*args, **kwargs):
+        pass
+
+    server = VercelSyncServer()
+    server.send_reply = server.broadcast_to_others = noop
+    session = SimpleNamespace(websocket=None)
+    asyncio.run(server.handle_state_sync(session, {'type': 'user_sync', 'data': {'id': 'u', 'name': 'a'}}))
+    asyncio.run(server.handle_state_sync(session, {'type': 'group_sync', 'data': {'id': 'g', 'name': 'x'}}))
+    frames, truncated = server.message_history.replay(None, 0)
+    assert [(frame.payload['type'], frame.payload['seq']) for frame in frames] == [('user_sync', 1), ('group_sync', 2)]
+    assert not truncated
+    frames, _ = server.message_history.replay(['g'], 1)
+    assert [frame.payload['data'] for frame in frames] == [{'id': 'g', 'name': 'x'}]
+
+
+def test_concurrent_edits_converge_in_any_order():
+    """多worker共用版本计数器，按字段合并的结果与到达顺序无关"""
+    import itertools
+    counter = itertools.count(1)
+    workers = [StateStore(versioner=lambda: next(counter)) for _ in range(3)]
+    kind = 'group_sync'
+    updates = []
+
+    def edit(store, **kwargs):
+        delta = store.apply(kind, **kwargs)
+        touched = set(delta['data']) | set(delta.get('unset', ())) | set(delta.get('add', ())) | set(delta.get('remove', ()))
+        touched.discard('id')
+        updates.append(store.field_state(kind, 'g', touched))
+
+    edit(workers[0], data={'id': 'g', 'name': 'a', 'members': ['u1'], 'topic': 't'})
+    for store in workers[1:]:
+        store.merge(kind, 'g', updates[0])
+    # 两个worker基于同一版本并发修改
+    edit(workers[0], data={'id': 'g', 'name': 'b'}, add={'members': ['u2']}, base_version=1)
+    edit(workers[1], data={'id': 'g', 'name': 'c'}, unset=['topic'], base_version=1)
+    workers[0].merge(kind, 'g', updates[2])
+    workers[1].merge(kind, 'g', updates[1])
+    workers[2].merge(kind, 'g', updates[2])
+    workers[2].merge(kind, 'g', updates[1])
+
+    records = [store.get(kind, 'g') for store in workers]
+    assert all(record.data == {'id': 'g', 'name': 'c', 'members': ['u1', 'u2']} for record in records)
+    assert {record.version for record in records} == {3}
+
+
+def test_merge_returns_client_delta_against_local_version():
+    store = StateStore()
+    store.apply('user_sync', {'id': 'u', 'name': 'a', 'tags': ['x', 'y', 'z']})
+    delta = store.merge('user_sync', 'u', {'name': [5, 'b'], 'tags': [5, ['x', 'y', 'z', 'w']], 'old': [4]})
+    assert delta == {'data': {'id': 'u', 'name': 'b'}, 'base_version': 1, 'version': 5, 'add': {'tags': ['w']}}
+    # 较旧的字段版本被忽略
+    assert store.merge('user_sync', 'u', {'name': [3, 'stale']}) is None
+
+
+def test_bus_drop_triggers_record_resync():
+    """总线丢弃的变更在下一次变更到达时被发现，整条记录从其他worker重发"""
+    import itertools
+    from types import SimpleNamespace
+    from sync_bus import LocalBus
+    from vercel_sync_server import VercelSyncServer
+
+    async def noop(*args, **kwargs):
+        pass
+
+    async def run():
+        counter = itertools.count(1)
+        peers = []
+        servers = []
+        for _ in range(2):
+            server = VercelSyncServer()
+            server.send_reply = noop
+            server.state = StateStore(versioner=lambda: next(counter))
+            server.bus = LocalBus(peers)
+            await server.bus.start(server.on_bus_message)
+            servers.append(server)
+        sender, receiver = servers
+        session = SimpleNamespace(websocket=None)
+
+        await sender.handle_state_sync(session, {'type': 'group_sync', 'data': {'id': 'g', 'name': 'a', 'topic': 't'}})
+        # 模拟主进程丢弃发给receiver的一条变更
+        peers.remove(receiver.bus)
+        await sender.handle_state_sync(session, {'type': 'group_sync', 'data': {'id': 'g', 'topic': 'new'}, 'base_version': 1})
+        peers.append(receiver.bus)
+        await sender.handle_state_sync(session, {'type': 'group_sync', 'data': {'id': 'g', 'name': 'b'}, 'base_version': 2})
+        return sender, receiver
+
+    sender, receiver = asyncio.run(run())
+    assert receiver.state.get('group_sync', 'g').data == sender.state.get('group_sync', 'g').data == \
+        {'id': 'g', 'name': 'b', 'topic': 'new'}
+    assert receiver.state.get('group_sync', 'g').version == 3
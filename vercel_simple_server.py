@@ -5,19 +5,34 @@ Vercel简化版同步服务器
 使用标准HTTP处理函数，避免aiohttp兼容性问题
 """
 
-import json
 import logging
+import os
+import sys
+import time
 from datetime import datetime
-from http.server import BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 
-# 配置日志
-logging.basicConfig(level=logging.INFO)
+import sync_codec
+from sync_eventlog import create_event_log
+
+# 日志在第一次处理请求时才配置，冷启动只做必要的导入
 logger = logging.getLogger(__name__)
+_logging_configured = False
 
 # 全局状态存储
 clients = {}
-message_history = {}
+# 事件日志，长轮询和SSE都按游标从这里读取。设置SYNC_EVENT_STORE后使用多实例共享的Redis，
+# 否则只在本实例内存中
+event_log = create_event_log(maxlen=int(os.environ.get('SYNC_EVENT_LOG_SIZE', 10000)))
+# 长轮询最长挂起时间。共享存储上等待新事件不依赖其他请求唤醒，默认8秒（低于Vercel函数
+# 默认的10秒执行上限）；内存日志中挂起的请求只能被同一实例上的其他请求唤醒，单并发的
+# Serverless实例上没有请求能唤醒它，默认0即立即返回
+POLL_TIMEOUT = float(os.environ.get('SYNC_POLL_TIMEOUT', 8 if event_log.shared else 0))
+POLL_LIMIT = 500
+# 每个SSE响应结束后浏览器重连前的等待时间。挂起的响应结束后立即重连；立即返回时
+# 这就是轮询间隔，默认3秒
+SSE_RETRY_MS = int(os.environ.get('SYNC_SSE_RETRY_MS', 500 if POLL_TIMEOUT > 0 else 3000))
+HEARTBEAT_TIMEOUT = float(os.environ.get('SYNC_HEARTBEAT_TIMEOUT', 90))
 stats = {
     'total_connections': 0,
     'active_connections': 0,
@@ -25,10 +40,30 @@ stats = {
     'start_time': datetime.now()
 }
 
+# 健康检查中不随请求变化的字段，导入时编码一次，每次请求只拼接动态字段
+HEALTH_STATIC = sync_codec.dumps({
+    'status': 'healthy',
+    'platform': 'vercel',
+    'python_version': sys.version,
+    'python_version_info': {
+        'major': sys.version_info.major,
+        'minor': sys.version_info.minor,
+        'micro': sys.version_info.micro
+    },
+    'message': 'Vercel同步服务器运行正常'
+})[:-1]
+
+def setup_logging():
+    global _logging_configured
+    if not _logging_configured:
+        logging.basicConfig(level=logging.INFO)
+        _logging_configured = True
+
 def handler(request, response):
     """
     Vercel HTTP处理函数
     """
+    setup_logging()
     try:
         # 解析URL
         parsed_url = urlparse(request['url'])
@@ -39,7 +74,7 @@ def handler(request, response):
             'Content-Type': 'application/json',
             'Access-Control-Allow-Origin': '*',
             'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type, Authorization'
+            'Access-Control-Allow-Headers': 'Content-Type, Authorization, Last-Event-ID'
         }
         
         # 处理OPTIONS请求（CORS预检）
@@ -55,13 +90,17 @@ def handler(request, response):
             return handle_health_check(request, response, headers)
         elif path == '/ws':
             return handle_websocket(request, response, headers)
+        elif path == '/sync' and request['method'] == 'POST':
+            return handle_sync(request, response, headers)
+        elif path == '/events':
+            return handle_events(request, response, headers, parse_qs(parsed_url.query))
         elif path == '/test':
             return handle_test(request, response, headers)
         else:
             return {
                 'statusCode': 404,
                 'headers': headers,
-                'body': json.dumps({'error': 'Not Found'})
+                'body': sync_codec.dumps({'error': 'Not Found'})
             }
             
     except Exception as e:
@@ -69,33 +108,26 @@ def handler(request, response):
         return {
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json'},
-            'body': json.dumps({'error': str(e)})
+            'body': sync_codec.dumps({'error': str(e)})
         }
 
 def handle_health_check(request, response, headers):
     """处理健康检查"""
-    import sys
-    
+    expire_clients()
+    now = datetime.now()
     health_data = {
-        'status': 'healthy',
-        'platform': 'vercel',
-        'python_version': sys.version,
-        'python_version_info': {
-            'major': sys.version_info.major,
-            'minor': sys.version_info.minor,
-            'micro': sys.version_info.micro
-        },
-        'timestamp': datetime.now().isoformat(),
-        'uptime': str(datetime.now() - stats['start_time']).split('.')[0],
+        'timestamp': now.isoformat(),
+        'uptime': str(now - stats['start_time']).split('.')[0],
         'active_connections': stats['active_connections'],
         'total_connections': stats['total_connections'],
-        'message': 'Vercel同步服务器运行正常'
+        'messages_processed': stats['messages_processed'],
+        'event_log': {'last_seq': event_log.last_seq, 'events': len(event_log)}
     }
     
     return {
         'statusCode': 200,
         'headers': headers,
-        'body': json.dumps(health_data, ensure_ascii=False, indent=2)
+        'body': HEALTH_STATIC + ',' + sync_codec.dumps(health_data)[1:]
     }
 
 def handle_websocket(request, response, headers):
@@ -105,7 +137,12 @@ def handle_websocket(request, response, headers):
     
     ws_info = {
         'message': 'Vercel Serverless函数不支持WebSocket连接',
-        'suggestion': '请使用支持WebSocket的平台，如Railway、Fly.io或Render',
+        'suggestion': '请使用HTTP传输，或使用支持WebSocket的平台，如Railway、Fly.io或Render',
+        'http_transport': {
+            'send': 'POST /sync',
+            'receive': 'GET /events?device_id=...&cursor=...',
+            'sse': 'GET /events (Accept: text/event-stream)'
+        },
         'alternatives': [
             'Railway - 支持WebSocket',
             'Fly.io - 支持长时间连接',
@@ -119,9 +156,222 @@ def handle_websocket(request, response, headers):
     return {
         'statusCode': 200,
         'headers': headers,
-        'body': json.dumps(ws_info, ensure_ascii=False, indent=2)
+        'body': sync_codec.dumps(ws_info)
+    }
+
+def get_header(request, name):
+    """不区分大小写读取请求头"""
+    name = name.lower()
+    for key, value in (request.get('headers') or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+def expire_clients():
+    """移除心跳超时的设备"""
+    deadline = time.monotonic() - HEARTBEAT_TIMEOUT
+    for device_id in [d for d, info in clients.items() if info['last_seen'] < deadline]:
+        clients.pop(device_id, None)
+    stats['active_connections'] = len(clients)
+
+def handle_sync(request, response, headers):
+    """
+    HTTP同步入口：POST一个操作或 {"type": "batch", "ops": [...]} 批量操作，
+    按顺序处理并一次性返回所有结果和当前事件游标
+    """
+    try:
+        body = sync_codec.loads(request.get('body') or b'')
+    except sync_codec.DecodeError:
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': sync_codec.dumps({'error': 'Invalid JSON format'})
+        }
+    if not isinstance(body, dict):
+        body = {}
+
+    if body.get('type') == 'batch':
+        ops = body.get('ops') if isinstance(body.get('ops'), list) else []
+    else:
+        ops = [body]
+
+    results = []
+    for op in ops:
+        if not isinstance(op, dict):
+            results.append({'type': 'error', 'message': 'Invalid op'})
+            continue
+        device_id = op.get('device_id') or body.get('device_id')
+        if not device_id:
+            results.append({'type': 'error', 'message': 'Missing device_id'})
+            continue
+        # 先校验再处理，批量中某条格式不对只影响这一条，前面已写入事件日志的操作不会因整个请求失败而被客户端重发
+        error = validate_sync_op(device_id, op)
+        if error is not None:
+            results.append({'type': 'error', 'message': error})
+            continue
+        results.append(handle_sync_op(device_id, op))
+        stats['messages_processed'] += 1
+
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': sync_codec.dumps({
+            'type': 'sync_result',
+            'cursor': event_log.last_seq,
+            'results': results
+        })
     }
 
+# 需要data字段的操作类型及缺失时的错误信息
+DATA_REQUIRED = {
+    'message_sync': 'Missing message data',
+    'user_sync': 'Missing user data',
+    'group_sync': 'Missing group data'
+}
+
+def validate_sync_op(device_id, op):
+    """检查操作的字段类型，返回错误信息或None"""
+    if not isinstance(device_id, str):
+        return 'Invalid device_id'
+    message_type = op.get('type')
+    if message_type == 'register':
+        if not isinstance(op.get('username', ''), str):
+            return 'Invalid username'
+        if op.get('groups') is not None and not isinstance(op.get('groups'), list):
+            return 'Invalid groups'
+    elif message_type in DATA_REQUIRED:
+        data = op.get('data')
+        if not data:
+            return DATA_REQUIRED[message_type]
+        if not isinstance(data, dict):
+            return 'Invalid data'
+    return None
+
+def handle_sync_op(device_id, op):
+    """处理单个同步操作，返回该操作的结果"""
+    message_type = op.get('type')
+    now = datetime.now().isoformat()
+
+    if message_type == 'register':
+        username = op.get('username', f'User_{device_id[:8]}')
+        groups = op.get('groups')
+        expire_clients()
+        if device_id not in clients:
+            stats['total_connections'] += 1
+        clients[device_id] = {
+            'username': username,
+            # 未声明群组的设备接收所有事件
+            'groups': set(str(g) for g in groups) if isinstance(groups, list) else None,
+            'connected_at': now,
+            'last_seen': time.monotonic()
+        }
+        stats['active_connections'] = len(clients)
+        event_log.append({
+            'type': 'user_joined',
+            'client_id': device_id,
+            'username': username,
+            'timestamp': now
+        }, sender=device_id)
+        logger.info(f"HTTP客户端注册: {device_id} ({username})")
+        return {
+            'type': 'register_success',
+            'client_id': device_id,
+            'cursor': event_log.last_seq,
+            'timestamp': now
+        }
+
+    client = clients.get(device_id)
+    if client is not None:
+        client['last_seen'] = time.monotonic()
+
+    if message_type == 'heartbeat':
+        return {'type': 'heartbeat_response', 'timestamp': now}
+
+    data = op.get('data')
+    if message_type == 'message_sync':
+        group_id = data.get('group_id') or data.get('conversation_id')
+    elif message_type == 'user_sync':
+        group_id = None
+    elif message_type == 'group_sync':
+        group_id = data.get('id')
+    elif message_type == 'test_sync':
+        data = None
+        group_id = None
+    else:
+        return {'type': 'error', 'message': f'Unknown message type: {message_type}'}
+
+    event = {'type': message_type, 'timestamp': now}
+    if message_type == 'test_sync':
+        event['message'] = op.get('message', '测试消息')
+    else:
+        event['data'] = data
+    seq = event_log.append(event, group_id=group_id, sender=device_id)
+    return {'type': 'ack', 'seq': seq}
+
+def handle_events(request, response, headers, query):
+    """
+    按游标读取事件：没有新事件时最多挂起SYNC_POLL_TIMEOUT秒（长轮询），
+    一次返回游标之后的多条事件。Accept为text/event-stream时以SSE格式返回，
+    EventSource断开重连时通过Last-Event-ID继续读取
+    """
+    device_id = (query.get('device_id') or [None])[0]
+    sse = 'text/event-stream' in (get_header(request, 'Accept') or '')
+    cursor = (query.get('cursor') or [None])[0]
+    if cursor is None and sse:
+        cursor = get_header(request, 'Last-Event-ID')
+    try:
+        cursor = int(cursor) if cursor is not None else event_log.last_seq
+        timeout = min(float((query.get('timeout') or [POLL_TIMEOUT])[0]), POLL_TIMEOUT)
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': sync_codec.dumps({'error': 'Invalid cursor or timeout'})
+        }
+
+    client = clients.get(device_id)
+    groups = None
+    if client is not None:
+        client['last_seen'] = time.monotonic()
+        groups = client['groups']
+    elif query.get('groups'):
+        # 使用共享存储时轮询可能落到没有处理过注册的实例，由客户端带上订阅的群组
+        groups = set(','.join(query['groups']).split(','))
+
+    # 被过滤掉的事件也推进游标，持续等待直到有本设备可见的事件或超时
+    deadline = time.monotonic() + timeout
+    while True:
+        events, cursor, truncated = event_log.read(cursor, groups=groups, exclude=device_id, limit=POLL_LIMIT)
+        remaining = deadline - time.monotonic()
+        if events or truncated or remaining <= 0 or not event_log.wait(cursor, remaining):
+            break
+
+    if sse:
+        return {
+            'statusCode': 200,
+            'headers': dict(headers, **{'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'}),
+            'body': format_sse(events, cursor, truncated)
+        }
+
+    # 事件已预先序列化，直接拼接，不再逐条编码
+    body = sync_codec.dumps({'type': 'events', 'cursor': cursor, 'truncated': truncated})[:-1]
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': body + ',"events":[' + ','.join(text for _, text in events) + ']}'
+    }
+
+def format_sse(events, cursor, truncated):
+    """把事件格式化为SSE文本，最后一行只带id用于推进客户端的Last-Event-ID"""
+    lines = [f'retry: {SSE_RETRY_MS}\n']
+    if truncated:
+        lines.append('event: resync_required\ndata: {}\n')
+    for seq, text in events:
+        lines.append(f'id: {seq}\ndata: {text}\n')
+    if not events or events[-1][0] != cursor:
+        lines.append(f'id: {cursor}\n')
+    return '\n'.join(lines) + '\n'
+
 def handle_test(request, response, headers):
     """处理测试请求"""
     test_data = {
@@ -136,7 +386,7 @@ def handle_test(request, response, headers):
     return {
         'statusCode': 200,
         'headers': headers,
-        'body': json.dumps(test_data, ensure_ascii=False, indent=2)
+        'body': sync_codec.dumps(test_data)
     }
 
 # Vercel需要这个变量
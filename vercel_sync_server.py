@@ -6,119 +6,472 @@ Vercel兼容的同步服务器
 """
 
 import asyncio
-import json
 import logging
 import os
+import time
 from datetime import datetime
-from typing import Dict
-from aiohttp import web, WSMsgType
+from typing import Dict, Optional, Set
+from aiohttp import web, WSMsgType, WSCloseCode
+
+import sync_binary
+import sync_bus
+import sync_codec
+import sync_logging
+from sync_admission import AdmissionControl, client_ip
+from sync_clients import ClientRecord, Session
+from sync_clock import clock
+from sync_dedup import DedupCache
+from sync_dispatch import Dispatcher
+from sync_fanout import FanoutEngine
+from sync_frames import Frame
+from sync_history import MessageHistory, GLOBAL_STREAM
+from sync_metrics import MetricsRegistry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from sync_outbound import OutboundQueue, POLICIES
+from sync_presence import PresenceTracker
+from sync_ratelimit import RateLimiter, parse_rules, DEFAULT_RULES, FRAME
+from sync_reaper import HeartbeatReaper
+from sync_restart import reconnect_hint, save_snapshot, load_snapshot
+from sync_rooms import SubscriptionIndex
+from sync_state import StateStore, StateConflict
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
+# 记入消息历史、断线重连时按游标补发的消息类型
+HISTORY_TYPES = ('message_sync', 'user_sync', 'group_sync')
+
 class VercelSyncServer:
     def __init__(self):
-        self.clients: Dict[str, Dict] = {}
-        self.message_history: Dict[str, list] = {}
+        self.clients: Dict[str, ClientRecord] = {}
+        # 按群组保存的消息历史，用于断线重连后补发
+        self.message_history = MessageHistory(
+            per_group=int(os.environ.get('SYNC_HISTORY_PER_GROUP', 500)),
+            max_bytes=int(os.environ.get('SYNC_HISTORY_MAX_BYTES', 32 * 1024 * 1024)),
+            sequencer=sync_bus.shared_sequencer()
+        )
+        
+        # 多worker模式下的跨进程广播总线，单进程运行时为None
+        self.bus = sync_bus.create_bus()
+        
+        # 可选的本地持久化日志，设置SYNC_JOURNAL_DIR后启用，重启后从日志恢复历史
+        self.journal = self.create_journal()
+        self.journal_replay_limit = int(os.environ.get('SYNC_JOURNAL_REPLAY_LIMIT', 10000))
+        # 单个history_replay帧的大小上限，超出的部分分页补发（aiohttp客户端默认拒收超过4MB的帧）
+        self.replay_max_bytes = int(os.environ.get('SYNC_REPLAY_MAX_BYTES', 1024 * 1024))
+        # 状态检查点间隔（秒），重启时从检查点和之后的状态增量重建用户/群组状态
+        self.checkpoint_interval = float(os.environ.get('SYNC_JOURNAL_CHECKPOINT_SECS', 60))
+        self._checkpoint_revision = None
+        self._checkpoint_task = None
+        
+        # 广播扇出：并发发送，限制同时进行中的发送数量
+        self.fanout = FanoutEngine(
+            max_in_flight=int(os.environ.get('SYNC_FANOUT_MAX_IN_FLIGHT', 256)),
+            send_timeout=float(os.environ.get('SYNC_SEND_TIMEOUT', 5.0))
+        )
+        
+        # 所有已握手的连接（包括尚未注册的），排空时逐个关闭
+        self.websockets: Set[web.WebSocketResponse] = set()
+        # 协商使用二进制协议的连接
+        self.binary_sockets: Set[web.WebSocketResponse] = set()
+        
+        # 群组订阅倒排索引
+        self.subscriptions = SubscriptionIndex()
+        
+        # 按data.id去重，客户端重试的消息只确认不再广播；SYNC_DEDUP_SIZE=0时关闭
+        dedup_size = int(os.environ.get('SYNC_DEDUP_SIZE', 100000))
+        self.dedup = DedupCache(
+            maxsize=dedup_size,
+            ttl=float(os.environ.get('SYNC_DEDUP_TTL', 300))
+        ) if dedup_size > 0 else None
+        
+        # 用户/群组记录的最新版本，广播只发送字段级增量
+        self.state = StateStore(versioner=sync_bus.shared_sequencer())
+        # (revision, 完整快照帧)，状态未变化时复用
+        self._snapshot_cache = None
+        
+        # 心跳超时清理：半开连接超过timeout没有任何消息即被断开
+        self.reaper = HeartbeatReaper(
+            timeout=float(os.environ.get('SYNC_HEARTBEAT_TIMEOUT', 90)),
+            tick=float(os.environ.get('SYNC_REAPER_TICK', 1.0)),
+            last_seen=self.client_last_seen,
+            on_expire=self.expire_clients
+        )
+        
+        # 上线/离线按间隔合并成一个presence帧广播，大量客户端同时重连时帧数有上界
+        self.presence = PresenceTracker(
+            interval=float(os.environ.get('SYNC_PRESENCE_INTERVAL_MS', 1000)) / 1000,
+            on_flush=lambda payload: self.broadcast_to_others(None, payload),
+            max_diff=int(os.environ.get('SYNC_PRESENCE_MAX_DIFF', 500))
+        )
+        # (revision, 完整在线列表帧)，在线列表未变化时复用
+        self._presence_cache = None
+        
+        # 每个客户端的有界出站队列
+        self.outbound_maxsize = int(os.environ.get('SYNC_OUTBOUND_QUEUE_SIZE', 256))
+        self.outbound_policy = os.environ.get('SYNC_OUTBOUND_POLICY', 'drop_oldest')
+        if self.outbound_policy not in POLICIES:
+            raise ValueError(f"SYNC_OUTBOUND_POLICY must be one of {POLICIES}")
+        
+        # 每个连接的令牌桶限流，SYNC_RATE_LIMITS为空（默认）时关闭；
+        # 连续被拒绝SYNC_RATE_LIMIT_DISCONNECT次后断开（0为不断开）
+        rules = parse_rules(os.environ.get('SYNC_RATE_LIMITS', DEFAULT_RULES))
+        self.rate_limiter = RateLimiter(rules) if rules else None
+        self.rate_limit_disconnect = int(os.environ.get('SYNC_RATE_LIMIT_DISCONNECT', 0))
+        
+        # 连接准入：总连接数、单IP并发连接数和每秒接入数，超限的升级请求直接返回503（0为不限制）
+        self.admission = AdmissionControl(
+            max_connections=int(os.environ.get('SYNC_MAX_CONNECTIONS', 0)),
+            per_ip=int(os.environ.get('SYNC_MAX_CONNECTIONS_PER_IP', 0)),
+            rate=float(os.environ.get('SYNC_ACCEPT_RATE', 0)),
+            burst=float(os.environ.get('SYNC_ACCEPT_BURST', 400)),
+            retry_after=float(os.environ.get('SYNC_ADMISSION_RETRY_AFTER', 5))
+        )
+        # 部署在反向代理后面时按X-Forwarded-For识别客户端IP
+        self.trust_forwarded = os.environ.get('SYNC_TRUST_FORWARDED', '0') != '0'
+        
+        # 附件走HTTP上传/下载，消息只携带引用；设置SYNC_ATTACHMENT_DIR后启用
+        attachment_dir = os.environ.get('SYNC_ATTACHMENT_DIR')
+        self.attachments = None
+        if attachment_dir:
+            from sync_attachments import AttachmentStore
+            self.attachments = AttachmentStore(
+                attachment_dir,
+                max_bytes=int(os.environ.get('SYNC_ATTACHMENT_MAX_MB', 25)) * 1024 * 1024
+            )
+        # 入站WebSocket帧的大小上限，附件改为引用后可以调低
+        self.max_frame_bytes = int(os.environ.get('SYNC_MAX_FRAME_BYTES', 4 * 1024 * 1024))
+        
+        # 出站合并：最多等待flush_window秒或攒够flush_max帧后合并发送
+        self.flush_window = float(os.environ.get('SYNC_FLUSH_WINDOW_MS', 5)) / 1000
+        self.flush_max = int(os.environ.get('SYNC_FLUSH_MAX_FRAMES', 64))
+        
+        # 优雅关闭：拒绝新连接，最多等待SYNC_DRAIN_TIMEOUT秒发完出站队列，
+        # 重连提示的退避时间在[min, max]内随机，把客户端重连分散开
+        self.draining = False
+        self.drain_timeout = float(os.environ.get('SYNC_DRAIN_TIMEOUT', 10))
+        self.reconnect_backoff = (
+            float(os.environ.get('SYNC_RECONNECT_BACKOFF_MIN_MS', 500)) / 1000,
+            float(os.environ.get('SYNC_RECONNECT_BACKOFF_MAX_MS', 15000)) / 1000
+        )
+        
+        # 热启动快照，设置SYNC_WARM_SNAPSHOT（文件路径）后启用，仅单进程模式
+        self.warm_path = os.environ.get('SYNC_WARM_SNAPSHOT') if self.bus is None else None
+        self.warm_grace = float(os.environ.get('SYNC_WARM_GRACE', 60))
+        # 上一个进程登记过、尚未重连回来的客户端 -> 关闭前已完整投递到的序号
+        self.warm_clients: Dict[str, Optional[int]] = {}
+        # 排空时记录的客户端登记 {client_id: [username, 序号]}，写入快照
+        self._drained_clients = {}
+        
+        # 每条消息都会触发的日志按类型采样，并定期汇总
+        self.msglog = sync_logging.message_log(logger)
         
         # 统计信息
         self.stats = {
             'total_connections': 0,
             'active_connections': 0,
             'messages_processed': 0,
+            'outbound_dropped': 0,
+            'outbound_coalesced': 0,
+            'outbound_batches': 0,
+            'slow_consumer_evictions': 0,
+            'rate_limited': 0,
+            'rate_limit_disconnects': 0,
             'start_time': datetime.now()
         }
+        
+        self.init_metrics()
+        self.init_handlers()
+    
+    def create_journal(self):
+        directory = os.environ.get('SYNC_JOURNAL_DIR')
+        if not directory:
+            return None
+        if self.bus is not None:
+            logger.warning("多worker模式暂不支持持久化日志，忽略SYNC_JOURNAL_DIR")
+            return None
+        # 可选组件在启用时才导入，不拖慢冷启动
+        from sync_journal import Journal
+        return Journal(
+            directory,
+            segment_bytes=int(os.environ.get('SYNC_JOURNAL_SEGMENT_MB', 64)) * 1024 * 1024,
+            flush_interval=float(os.environ.get('SYNC_JOURNAL_FLUSH_MS', 10)) / 1000,
+            fsync=os.environ.get('SYNC_JOURNAL_FSYNC', '1') != '0',
+            max_segments=int(os.environ.get('SYNC_JOURNAL_MAX_SEGMENTS', 16))
+        )
+    
+    def outbound_stats(self):
+        """出站队列统计：当前积压深度与累计丢弃/合并/驱逐次数"""
+        depths = [len(info.outbound) for info in self.clients.values()]
+        dropped = self.stats['outbound_dropped'] + sum(info.outbound.dropped for info in self.clients.values())
+        coalesced = self.stats['outbound_coalesced'] + sum(info.outbound.coalesced for info in self.clients.values())
+        batches = self.stats['outbound_batches'] + sum(info.outbound.batches for info in self.clients.values())
+        return {
+            'policy': self.outbound_policy,
+            'max_size': self.outbound_maxsize,
+            'queued_frames': sum(depths),
+            'max_queue_depth': max(depths, default=0),
+            'dropped': dropped,
+            'coalesced': coalesced,
+            'batches': batches,
+            'flush_window_ms': self.flush_window * 1000,
+            'flush_max_frames': self.flush_max,
+            'evictions': self.stats['slow_consumer_evictions']
+        }
+    
+    def init_metrics(self):
+        """注册Prometheus指标"""
+        self.metrics = MetricsRegistry()
+        self.metric_messages = self.metrics.counter(
+            'sync_messages_total', '按类型统计的入站消息数', 'type')
+        self.metric_bytes_in = self.metrics.counter(
+            'sync_bytes_in_total', '入站WebSocket帧字节数')
+        self.metrics.counter_func(
+            'sync_bytes_out_total', '出站WebSocket帧字节数', lambda: self.fanout.bytes_sent)
+        self.metrics.counter_func(
+            'sync_frames_out_total', '出站WebSocket帧数', lambda: self.fanout.frames_sent)
+        self.metric_rate_limited = self.metrics.counter(
+            'sync_rate_limited_total', '被限流拒绝的帧/操作数', 'type')
+        self.metric_admission_rejected = self.metrics.counter(
+            'sync_admission_rejected_total', '准入控制拒绝的连接数', 'reason')
+        self.metric_parse_seconds = self.metrics.histogram(
+            'sync_inbound_parse_seconds', '入站帧解码耗时')
+        self.metric_handler_seconds = self.metrics.histogram(
+            'sync_handler_seconds', '按类型统计的消息处理耗时', 'type')
+        self.metric_fanout_seconds = self.metrics.histogram(
+            'sync_broadcast_fanout_seconds', '广播投递到各出站队列的耗时')
+        self.metrics.gauge(
+            'sync_active_connections', '当前WebSocket连接数', lambda: self.stats['active_connections'])
+        self.metrics.gauge(
+            'sync_registered_clients', '当前已注册客户端数', lambda: len(self.clients))
+        self.metrics.counter_func(
+            'sync_connections_total', '累计WebSocket连接数', lambda: self.stats['total_connections'])
+        self.metrics.gauge(
+            'sync_outbound_queue_depth', '所有出站队列积压的帧数',
+            lambda: sum(len(info.outbound) for info in self.clients.values()))
+        self.metrics.counter_func(
+            'sync_outbound_dropped_total', '出站队列满时丢弃的帧数', lambda: self.outbound_stats()['dropped'])
+        self.metrics.counter_func(
+            'sync_slow_consumer_evictions_total', '因出站队列满被断开的客户端数',
+            lambda: self.stats['slow_consumer_evictions'])
+        self.metrics.counter_func(
+            'sync_reaped_total', '心跳超时被断开的客户端数', lambda: self.reaper.stats['reaped'])
+        self.metrics.counter_func(
+            'sync_duplicate_messages_total', '被去重、未重复广播的消息数',
+            lambda: self.dedup.hits if self.dedup is not None else 0)
+        self.metrics.gauge(
+            'sync_history_bytes', '消息历史占用的字节数', lambda: self.message_history.total_bytes)
+        if self.journal is not None:
+            self.metrics.counter_func(
+                'sync_journal_records_total', '写入持久化日志的记录数', lambda: self.journal.stats['appended'])
+            self.metrics.counter_func(
+                'sync_journal_flushes_total', '持久化日志的合并提交次数', lambda: self.journal.stats['flushes'])
+    
+    def init_handlers(self):
+        """登记各消息类型的处理器和字段规格，规格在这里编译成校验函数"""
+        self.dispatcher = Dispatcher(observe=self.metric_handler_seconds.observe)
+        self.dispatcher.register('register', self.handle_register)
+        self.dispatcher.register('heartbeat', self.handle_heartbeat)
+        self.dispatcher.register('resume', self.handle_resume, {
+            'last_seq': ('int|str?', "Invalid last_seq")
+        }, registered=True)
+        for message_type in ('subscribe', 'unsubscribe'):
+            self.dispatcher.register(message_type, self.handle_subscription, {
+                'groups': ('list', "Missing groups")
+            }, registered=True)
+        self.dispatcher.register('message_sync', self.handle_message_sync, {
+            'data': ('dict', "Missing message data"),
+            'data.attachments': 'list?'
+        })
+        for message_type, kind in (('user_sync', 'user'), ('group_sync', 'group')):
+            self.dispatcher.register(message_type, self.handle_state_sync, {
+                'data': ('dict', f"Missing {kind} data"),
+                'data.id': ('any', f"Missing {kind} data"),
+                'base_version': 'int?',
+                'unset': 'list?',
+                'add': 'dict?',
+                'remove': 'dict?'
+            })
+        self.dispatcher.register('snapshot', self.handle_snapshot, {
+            'users': 'list?',
+            'groups': 'list?'
+        }, registered=True)
+        self.dispatcher.register('presence', self.handle_presence, {
+            'clients': ('list?', "clients must be a list")
+        }, registered=True)
+        self.dispatcher.register('test_sync', self.handle_test_sync)
+    
+    async def metrics_handler(self, request):
+        """Prometheus指标端点"""
+        return web.Response(text=self.metrics.render(), headers={'Content-Type': METRICS_CONTENT_TYPE})
     
     async def health_check(self, request):
         """健康检查端点"""
         return web.json_response({
-            'status': 'healthy',
+            'status': 'draining' if self.draining else 'healthy',
             'platform': 'vercel',
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': clock.iso(),
             'uptime': str(datetime.now() - self.stats['start_time']).split('.')[0],
             'active_connections': self.stats['active_connections'],
-            'total_connections': self.stats['total_connections']
-        })
+            'total_connections': self.stats['total_connections'],
+            'messages_processed': self.stats['messages_processed'],
+            'outbound': self.outbound_stats(),
+            'reaper': self.reaper.snapshot(),
+            'presence': dict(self.presence.stats, online=len(self.presence)),
+            'admission': self.admission.snapshot(),
+            'handlers': self.dispatcher.snapshot(),
+            'rate_limit': {
+                'rejected': self.stats['rate_limited'],
+                'disconnects': self.stats['rate_limit_disconnects']
+            },
+            'bus': dict(self.bus.stats, pid=os.getpid()) if self.bus is not None else None,
+            'history': {
+                'last_seq': self.message_history.seq,
+                'messages': self.message_history.count,
+                'bytes': self.message_history.total_bytes
+            },
+            'journal': self.journal.snapshot() if self.journal is not None else None,
+            'attachments': self.attachments.snapshot() if self.attachments is not None else None,
+            'dedup': self.dedup.snapshot() if self.dedup is not None else None
+        }, status=503 if self.draining else 200, dumps=sync_codec.dumps)
+    
+    async def upload_attachment(self, request):
+        """上传附件：请求体即文件内容（可以用chunked传输），返回消息中引用该附件所需的信息"""
+        from sync_attachments import AttachmentTooLarge
+        
+        if request.content_length is not None and request.content_length > self.attachments.max_bytes:
+            self.attachments.stats['rejected'] += 1
+            return web.json_response({'type': 'error', 'message': 'Attachment too large'},
+                                     status=413, dumps=sync_codec.dumps)
+        try:
+            attachment_id, size = await self.attachments.save(request.content)
+        except AttachmentTooLarge as e:
+            return web.json_response({'type': 'error', 'message': str(e)}, status=413, dumps=sync_codec.dumps)
+        except ValueError as e:
+            return web.json_response({'type': 'error', 'message': str(e)}, status=400, dumps=sync_codec.dumps)
+        
+        self.msglog.log('attachment', "附件上传: %s (%d字节)", attachment_id, size)
+        return web.json_response({
+            'type': 'attachment',
+            'id': attachment_id,
+            'size': size,
+            'content_type': request.content_type,
+            'url': f'/attachments/{attachment_id}',
+            'timestamp': clock.iso()
+        }, dumps=sync_codec.dumps)
+    
+    async def download_attachment(self, request):
+        """下载附件：FileResponse用sendfile发送并处理Range；内容按摘要寻址，可以永久缓存"""
+        from sync_attachments import download_headers
+        
+        path = self.attachments.path(request.match_info['attachment_id'])
+        if path is None:
+            raise web.HTTPNotFound()
+        # 可选的name参数用于文件名，只有安全的类型才内联显示
+        return web.FileResponse(path, headers=download_headers(request.query.get('name')))
     
     async def websocket_handler(self, request):
         """WebSocket处理器"""
-        ws = web.WebSocketResponse()
-        await ws.prepare(request)
+        if self.draining:
+            # 正在关闭，让客户端稍后连接到新进程
+            return web.Response(status=503, text='Server restarting',
+                                headers={'Retry-After': str(int(self.reconnect_backoff[1]) or 1)})
+        
+        # 准入检查在握手之前，被拒绝的请求不占用任何连接资源
+        ip = client_ip(request, self.trust_forwarded)
+        reason, retry_after = self.admission.admit(ip)
+        if reason is not None:
+            self.metric_admission_rejected.inc(label=reason)
+            self.msglog.log('admission_rejected', "拒绝连接 (%s): %s", reason, ip)
+            return web.Response(status=503, text='Server busy', headers={'Retry-After': str(retry_after)})
+        
+        ws = web.WebSocketResponse(max_msg_size=self.max_frame_bytes)
+        try:
+            await ws.prepare(request)
+        except Exception:
+            self.admission.release(ip)
+            raise
         
-        client_id = None
-        client_info = None
+        buckets = self.rate_limiter.new_buckets() if self.rate_limiter is not None else None
+        session = Session(ws, buckets)
+        self.websockets.add(ws)
         
         try:
             self.stats['total_connections'] += 1
             self.stats['active_connections'] += 1
             
-            logger.info(f"新WebSocket连接: {request.remote}")
+            self.msglog.log('connect', "新WebSocket连接: %s", request.remote)
             
             async for msg in ws:
-                if msg.type == WSMsgType.TEXT:
+                if msg.type in (WSMsgType.TEXT, WSMsgType.BINARY):
+                    if session.client_info is not None:
+                        # 任何入站消息都说明连接仍然存活
+                        session.client_info.last_seen = clock.now_ms()
+                    # 解码前先按帧总速率限流，洪泛的帧不做任何解析
+                    if buckets is not None and not self.rate_limiter.allow(buckets, FRAME):
+                        if await self.reject_rate_limited(ws, buckets, FRAME):
+                            break
+                        continue
+                    started = time.perf_counter()
                     try:
-                        data = json.loads(msg.data)
-                        message_type = data.get('type')
-                        device_id = data.get('device_id')
-                        
-                        if not device_id:
-                            await self.send_error(ws, "Missing device_id")
+                        if msg.type == WSMsgType.TEXT:
+                            # 纯ASCII文本字符数即字节数（isascii()只检查标志位）；含中文等字符的帧编码一次，
+                            # 编码结果直接交给解析器，不再单独为计数编码
+                            text = msg.data
+                            if not text.isascii():
+                                text = text.encode('utf-8')
+                            self.metric_bytes_in.inc(len(text))
+                            data = sync_codec.loads(text)
+                        else:
+                            self.metric_bytes_in.inc(len(msg.data))
+                            data = sync_binary.decode(msg.data)
+                            # 客户端发送了二进制帧，之后发给它的消息（包括出站队列中的广播）也使用二进制协议
+                            self.binary_sockets.add(ws)
+                            if session.client_info is not None:
+                                session.client_info.outbound.binary = True
+                    except sync_binary.BinaryDecodeError as e:
+                        await self.send_error(ws, f"Invalid binary frame: {e}")
+                        continue
+                    except sync_codec.DecodeError:
+                        await self.send_error(ws, "Invalid JSON format")
+                        continue
+                    self.metric_parse_seconds.observe(time.perf_counter() - started)
+                    
+                    # batch信封：一个帧携带多条操作，逐条按单帧处理
+                    if isinstance(data, dict) and data.get('type') == 'batch':
+                        ops = data.get('ops')
+                        if not isinstance(ops, list):
+                            await self.send_error(ws, "Missing ops")
                             continue
-                        
-                        if message_type == 'register':
-                            client_id = device_id
-                            client_info = {
-                                'websocket': ws,
-                                'username': data.get('username', 'Unknown'),
-                                'connected_at': datetime.now(),
-                                'last_heartbeat': datetime.now()
-                            }
-                            self.clients[client_id] = client_info
-                            
-                            # 发送注册成功响应
-                            response = {
-                                'type': 'register_success',
-                                'device_id': device_id,
-                                'message': '注册成功',
-                                'timestamp': datetime.now().isoformat()
-                            }
-                            await ws.send_str(json.dumps(response))
-                            logger.info(f"客户端注册成功: {client_id} ({client_info['username']})")
-                            
-                            # 通知其他客户端
-                            await self.broadcast_user_joined(client_id, client_info['username'])
-                            
-                        elif message_type == 'heartbeat':
-                            if client_id and client_id in self.clients:
-                                self.clients[client_id]['last_heartbeat'] = datetime.now()
-                                logger.debug(f"收到心跳: {client_id}")
-                            
-                        elif message_type == 'message_sync':
-                            await self.handle_message_sync(ws, data)
+                        for op in ops:
+                            if isinstance(op, dict):
+                                op.setdefault('device_id', data.get('device_id'))
+                    else:
+                        ops = [data]
+                    
+                    for data in ops:
+                        try:
+                            if not isinstance(data, dict) or not data.get('device_id'):
+                                await self.send_error(ws, "Missing device_id")
+                                continue
+                            message_type = data.get('type')
                             
-                        elif message_type == 'user_sync':
-                            await self.handle_user_sync(ws, data)
+                            if buckets is not None:
+                                if not self.rate_limiter.allow(buckets, message_type):
+                                    if await self.reject_rate_limited(ws, buckets, message_type):
+                                        break
+                                    continue
+                                buckets.rejected = 0
                             
-                        elif message_type == 'group_sync':
-                            await self.handle_group_sync(ws, data)
+                            # 按类型查表分发，校验失败或类型未知时回复错误
+                            error = await self.dispatcher.dispatch(session, data)
+                            if error is not None:
+                                await self.send_error(ws, error)
                             
-                        elif message_type == 'test_sync':
-                            await self.handle_test_sync(ws, data)
+                            self.stats['messages_processed'] += 1
+                            self.metric_messages.inc(label=self.dispatcher.label(message_type))
                             
-                        else:
-                            await self.send_error(ws, f"Unknown message type: {message_type}")
-                        
-                        self.stats['messages_processed'] += 1
-                        
-                    except json.JSONDecodeError:
-                        await self.send_error(ws, "Invalid JSON format")
-                    except Exception as e:
-                        logger.error(f"处理消息时出错: {e}")
-                        await self.send_error(ws, f"Server error: {str(e)}")
+                        except Exception as e:
+                            logger.error(f"处理消息时出错: {e}")
+                            await self.send_error(ws, f"Server error: {str(e)}")
                         
                 elif msg.type == WSMsgType.ERROR:
                     logger.error(f'WebSocket错误: {ws.exception()}')
@@ -126,129 +479,715 @@ class VercelSyncServer:
         except Exception as e:
             logger.error(f"WebSocket连接错误: {e}")
         finally:
-            if client_id and client_id in self.clients:
-                del self.clients[client_id]
-                self.stats['active_connections'] -= 1
-                logger.info(f"客户端已移除: {client_id}")
+            self.stats['active_connections'] -= 1
+            self.admission.release(ip)
+            self.websockets.discard(ws)
+            self.binary_sockets.discard(ws)
+            client_id, client_info = session.client_id, session.client_info
+            if client_info is not None:
+                await self.release_client(client_id, client_info)
+            if client_id and self.unregister_client(client_id, client_info):
+                self.msglog.log('disconnect', "客户端已移除: %s", client_id)
         
         return ws
     
-    async def handle_message_sync(self, websocket, data):
-        """处理消息同步"""
-        message_data = data.get('data')
-        if not message_data:
-            await self.send_error(websocket, "Missing message data")
+    def unregister_client(self, client_id, client_info) -> bool:
+        """注销客户端及其订阅，仅当登记的仍是同一个连接时才注销（设备可能已重新注册）"""
+        if self.clients.get(client_id) is not client_info:
+            return False
+        del self.clients[client_id]
+        self.subscriptions.remove_client(client_id)
+        self.reaper.forget(client_id)
+        self.presence.leave(client_id)
+        return True
+    
+    def client_last_seen(self, client_id):
+        """供心跳清理查询客户端最后活跃时间"""
+        client_info = self.clients.get(client_id)
+        return client_info.last_seen / 1000 if client_info else None
+    
+    def expire_clients(self, client_ids):
+        """心跳超时的客户端：注销并关闭连接，连接处理器随后完成清理"""
+        for client_id in client_ids:
+            client_info = self.clients.get(client_id)
+            if client_info is None:
+                continue
+            self.unregister_client(client_id, client_info)
+            client_info.outbound.abort()
+            self.msglog.log('reaped', "心跳超时，断开客户端: %s", client_id)
+    
+    async def start_background_tasks(self, app):
+        """应用启动时运行后台任务"""
+        if self.warm_path:
+            self.load_warm_snapshot()
+        self.reaper.start()
+        self.presence.start()
+        self.msglog.start()
+        if self.bus is not None:
+            await self.bus.start(self.on_bus_message)
+        if self.journal is not None:
+            self.journal.open()
+            self.load_journal()
+            await self.journal.start()
+            if self.checkpoint_interval > 0:
+                self._checkpoint_task = asyncio.ensure_future(self.checkpoint_loop())
+    
+    async def cleanup_background_tasks(self, app):
+        """应用关闭时停止后台任务"""
+        await self.reaper.stop()
+        await self.presence.stop()
+        await self.msglog.stop()
+        if self.bus is not None:
+            await self.bus.close()
+        if self.journal is not None:
+            if self._checkpoint_task is not None:
+                self._checkpoint_task.cancel()
+            await self.journal.close()
+            await self.checkpoint_state()
+        if self.warm_path:
+            snapshot = self.warm_snapshot()
+            loop = asyncio.get_event_loop()
+            try:
+                await loop.run_in_executor(None, save_snapshot, self.warm_path, snapshot)
+                logger.info(f"热启动快照已写入 {self.warm_path}")
+            except OSError as e:
+                logger.error(f"写入热启动快照失败: {e}")
+    
+    async def drain(self, app):
+        """
+        关闭前排空：拒绝新连接，给每个客户端发送带随机退避的重连提示，等待出站队列发完后关闭连接；
+        尚未注册的连接也一并关闭
+        """
+        self.draining = True
+        await self.presence.flush()
+        clients = list(self.clients.items())
+        last_seq = self.message_history.seq
+        for client_id, client_info in clients:
+            client_info.outbound.put(Frame(reconnect_hint(*self.reconnect_backoff, last_seq=last_seq)))
+        
+        deadline = time.monotonic() + self.drain_timeout
+        while clients and time.monotonic() < deadline:
+            if all(info.outbound.idle or info.outbound.closed for _, info in clients):
+                break
+            await asyncio.sleep(0.05)
+        
+        # 出站队列完整发完的客户端已收到last_seq之前的全部消息，其游标可以写入快照
+        self._drained_clients = {
+            client_id: [info.username, last_seq if info.outbound.idle and not info.outbound.closed else None]
+            for client_id, info in clients
+        }
+        websockets = [ws for ws in self.websockets if not ws.closed]
+        await asyncio.gather(*(
+            ws.close(code=WSCloseCode.GOING_AWAY, message=b'Server restarting')
+            for ws in websockets
+        ), return_exceptions=True)
+        if websockets:
+            logger.info(f"已排空 {len(clients)} 个客户端、共 {len(websockets)} 个连接")
+    
+    def warm_snapshot(self):
+        """热启动快照：序号、状态、排空时的客户端登记，以及消息历史（启用持久化日志时历史从日志恢复）"""
+        history = self.message_history
+        snapshot = {
+            'last_seq': history.seq,
+            'state': self.state.export(),
+            'clients': self._drained_clients
+        }
+        if self.journal is None:
+            snapshot['history'] = [[seq, key, frame.data.decode('utf-8')] for seq, key, frame in history.entries()]
+            snapshot['evicted_upto'] = dict(history.evicted_upto)
+        return snapshot
+    
+    def load_warm_snapshot(self):
+        """
+        加载上一个进程的快照。SYNC_WARM_GRACE秒内的快照还会恢复在线列表：重连回来的客户端不再广播上线，
+        宽限期结束仍未重连的才广播离线
+        """
+        snapshot = load_snapshot(self.warm_path)
+        if snapshot is None:
+            return
+        history = self.message_history
+        history.evicted_upto.update(snapshot.get('evicted_upto') or {})
+        for seq, key, text in snapshot.get('history') or ():
+            data = text.encode('utf-8')
+            history.append(key, seq, Frame.from_data(sync_codec.loads(data), data))
+        history.seq = max(history.seq, snapshot.get('last_seq', 0))
+        self.state.restore(snapshot.get('state') or {})
+        
+        clients = snapshot.get('clients') or {}
+        if clients and time.time() - snapshot.get('saved_at', 0) <= self.warm_grace:
+            self.warm_clients = {client_id: seq for client_id, (_, seq) in clients.items()}
+            self.presence.preload({client_id: username for client_id, (username, _) in clients.items()})
+            asyncio.get_event_loop().call_later(self.warm_grace, self.expire_warm_clients)
+        logger.info(f"从热启动快照恢复 {history.count} 条历史消息、{len(self.warm_clients)} 个客户端，最新序号 {history.seq}")
+    
+    def expire_warm_clients(self):
+        """宽限期结束：没有重连回来的客户端从在线列表移除"""
+        for client_id in self.warm_clients:
+            if client_id not in self.clients:
+                self.presence.leave(client_id)
+        self.warm_clients = {}
+    
+    def rebuild_state(self):
+        """从状态检查点和之后日志中的user_sync/group_sync增量重建状态，版本号接着上次继续"""
+        checkpoint_seq, state = self.journal.load_checkpoint()
+        if state is not None:
+            self.state.restore(state)
+        if checkpoint_seq + 1 < self.journal.first_seq <= self.journal.last_seq:
+            logger.warning(f"序号 {checkpoint_seq + 1}~{self.journal.first_seq - 1} 的日志分段已被清理，"
+                           f"其中的状态变更无法恢复，请调小SYNC_JOURNAL_CHECKPOINT_SECS或保留更多分段")
+        applied = 0
+        seq = checkpoint_seq + 1
+        while True:
+            records = self.journal.read(seq, 10000)
+            if not records:
+                break
+            for _, _, data in records:
+                # 先在字节上粗筛，只解析可能是状态增量的记录
+                if b'"user_sync"' not in data and b'"group_sync"' not in data:
+                    continue
+                payload = sync_codec.loads(data)
+                if payload.get('type') in StateStore.KINDS and 'version' in payload:
+                    delta = self.state.apply(
+                        payload['type'], payload['data'],
+                        unset=payload.get('unset'),
+                        add=payload.get('add'),
+                        remove=payload.get('remove'),
+                        base_version=payload['base_version'],
+                        version=payload['version']
+                    )
+                    applied += delta is not None
+            seq = records[-1][0] + 1
+        self._checkpoint_revision = self.state.revision
+        logger.info(f"从状态检查点（序号 {checkpoint_seq}）和 {applied} 条状态增量重建用户/群组状态")
+    
+    async def checkpoint_state(self):
+        """状态有变化时写入检查点"""
+        revision = self.state.revision
+        if revision == self._checkpoint_revision:
             return
+        try:
+            await self.journal.save_checkpoint(self.message_history.seq, self.state.export())
+            self._checkpoint_revision = revision
+        except OSError as e:
+            logger.error(f"写入状态检查点失败: {e}")
+    
+    async def checkpoint_loop(self):
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            await self.checkpoint_state()
+    
+    def load_journal(self):
+        """启动时从持久化日志恢复用户/群组状态和最近的消息历史，序号接着上次继续，客户端的游标仍然有效"""
+        self.rebuild_state()
+        limit = int(os.environ.get('SYNC_JOURNAL_WARM_RECORDS', 50000))
+        last_seq = self.journal.last_seq
+        records = self.journal.read(max(last_seq - limit + 1, 1), limit)
+        for seq, group_id, data in records:
+            payload = sync_codec.loads(data)
+            if payload.get('type') in HISTORY_TYPES:
+                self.message_history.append(group_id, seq, Frame.from_data(payload, data))
+        self.message_history.seq = max(self.message_history.seq, last_seq)
+        logger.info(f"从持久化日志恢复 {self.message_history.count} 条历史消息，最新序号 {last_seq}")
+    
+    async def replay_journal(self, client_id, last_seq):
+        """
+        内存历史不够时从持久化日志补发，读盘在线程池中进行。
+        一次最多读SYNC_JOURNAL_REPLAY_LIMIT条，还有剩余时返回下一页的游标，否则为None
+        """
+        loop = asyncio.get_event_loop()
+        records = await loop.run_in_executor(
+            None, self.journal.read, last_seq + 1, self.journal_replay_limit + 1)
+        truncated = last_seq + 1 < self.journal.first_seq
+        next_cursor = None
+        if len(records) > self.journal_replay_limit:
+            next_cursor = records[self.journal_replay_limit - 1][0]
         
-        # 广播消息给所有其他客户端
-        await self.broadcast_to_others(websocket, {
+        wildcard = self.subscriptions.is_wildcard(client_id)
+        groups = self.subscriptions.groups_of(client_id)
+        frames = [
+            Frame.from_data(sync_codec.loads(data), data)
+            for seq, group_id, data in records[:self.journal_replay_limit]
+            if wildcard or group_id is None or group_id in groups
+        ]
+        return frames, truncated, next_cursor
+    
+    async def handle_register(self, session, data):
+        """注册设备：创建出站队列和登记，回复register_success，按需补发快照和离线消息"""
+        ws = session.websocket
+        if session.client_info is not None:
+            # 同一连接重复注册，先注销旧的登记
+            await self.release_client(session.client_id, session.client_info)
+            self.unregister_client(session.client_id, session.client_info)
+        client_id = data['device_id']
+        # 声明支持batch的客户端开启出站合并
+        batching = bool(data.get('batch'))
+        if data.get('encoding') == 'binary':
+            self.binary_sockets.add(ws)
+        outbound = OutboundQueue(
+            client_id, ws, self.fanout.send,
+            maxsize=self.outbound_maxsize,
+            policy=self.outbound_policy,
+            flush_window=self.flush_window if batching else 0.0,
+            flush_max=self.flush_max,
+            binary=ws in self.binary_sockets
+        )
+        outbound.start()
+        client_info = ClientRecord(ws, data.get('username', 'Unknown'), clock.now_ms(), outbound=outbound)
+        session.client_id, session.client_info = client_id, client_info
+        previous = self.clients.get(client_id)
+        self.clients[client_id] = client_info
+        self.reaper.track(client_id)
+        self.presence.join(client_id, client_info.username)
+        if previous is not None:
+            # 设备换了新连接，旧连接不再接收广播；同时关闭旧连接，释放它占用的连接名额，
+            # 关闭握手在后台进行，不阻塞新连接的注册
+            await self.release_client(client_id, previous)
+            if previous.websocket is not ws and not previous.websocket.closed:
+                asyncio.ensure_future(previous.websocket.close(message=b'Superseded by new connection'))
+        
+        # 带groups的客户端只接收所订阅群组的事件，否则接收全部
+        groups = data.get('groups')
+        if isinstance(groups, list):
+            self.subscriptions.remove_client(client_id)
+            self.subscriptions.subscribe(client_id, groups)
+        else:
+            self.subscriptions.set_wildcard(client_id)
+        
+        # 发送注册成功响应
+        response = {
+            'type': 'register_success',
+            'device_id': client_id,
+            'message': '注册成功',
+            'last_seq': self.message_history.seq,
+            'timestamp': clock.iso()
+        }
+        await self.send_reply(ws, response)
+        self.msglog.log('register', "客户端注册成功: %s (%s)", client_id, client_info.username)
+        
+        # 新加入的客户端一次性获取用户/群组状态快照
+        if data.get('snapshot'):
+            await self.handle_snapshot(session, {})
+        
+        # 重连的客户端带上最后收到的序号，补发离线期间的消息；
+        # 没有带序号但在上一个进程关闭前已收齐消息的客户端，从那个序号补发
+        last_seq = data.get('last_seq')
+        warm_seq = self.warm_clients.pop(client_id, None)
+        if last_seq is None:
+            last_seq = warm_seq
+        if last_seq is not None:
+            await self.handle_resume(session, {'last_seq': last_seq})
+    
+    async def handle_heartbeat(self, session, data):
+        """更新心跳时间，未注册的连接忽略"""
+        if session.client_info is not None:
+            session.client_info.last_heartbeat = clock.now_ms()
+            self.msglog.log('heartbeat', "收到心跳: %s", session.client_id)
+    
+    async def handle_resume(self, session, data):
+        """
+        按游标补发缺失的消息，合并成一个history_replay帧。超过SYNC_REPLAY_MAX_BYTES时只发一页，
+        more为true，客户端用返回的last_seq再次发送resume取下一页
+        """
+        client_id = session.client_id
+        try:
+            last_seq = int(data.get('last_seq') or 0)
+        except (TypeError, ValueError):
+            await self.send_error(session.websocket, "Invalid last_seq")
+            return
+        
+        if self.subscriptions.is_wildcard(client_id):
+            group_ids = None
+        else:
+            group_ids = list(self.subscriptions.groups_of(client_id)) + [GLOBAL_STREAM]
+        frames, truncated = self.message_history.replay(group_ids, last_seq)
+        next_cursor = None
+        if truncated and self.journal is not None and last_seq <= self.message_history.seq:
+            frames, truncated, next_cursor = await self.replay_journal(client_id, last_seq)
+        
+        page = []
+        size = 0
+        for frame in frames:
+            size += len(frame.data) + 1
+            if page and size > self.replay_max_bytes:
+                break
+            page.append(frame)
+        if len(page) < len(frames):
+            next_cursor = page[-1].payload['seq']
+        
+        # 直接拼接历史帧的已编码文本，不重新序列化
+        header = {
+            'type': 'history_replay',
+            'last_seq': self.message_history.seq if next_cursor is None else next_cursor,
+            'truncated': truncated,
+            'more': next_cursor is not None,
+            'count': len(page),
+            'timestamp': clock.iso()
+        }
+        session.client_info.outbound.put(Frame.join(header, page))
+    
+    async def handle_subscription(self, session, data):
+        """处理群组订阅/取消订阅"""
+        if data['type'] == 'subscribe':
+            current = self.subscriptions.subscribe(session.client_id, data['groups'])
+        else:
+            current = self.subscriptions.unsubscribe(session.client_id, data['groups'])
+        
+        response = {
+            'type': f"{data['type']}_success",
+            'groups': sorted(current),
+            'timestamp': clock.iso()
+        }
+        await self.send_reply(session.websocket, response)
+    
+    async def handle_message_sync(self, session, data):
+        """处理消息同步"""
+        websocket = session.websocket
+        message_data = data['data']
+        message_id = message_data.get('id')
+        if message_id is not None and self.dedup is not None:
+            seq = self.dedup.get(message_id)
+            if seq is not None:
+                # 客户端重试：确认原来的序号，不再广播
+                await self.send_message_ack(websocket, message_id, seq, duplicate=True)
+                self.msglog.log('duplicate', "重复消息已忽略: %s", message_id)
+                return
+        
+        group_id = message_data.get('group_id') or message_data.get('conversation_id')
+        seq = self.message_history.next_seq()
+        if message_id is not None and self.dedup is not None:
+            self.dedup.add(message_id, seq)
+        frame = Frame({
             'type': 'message_sync',
+            'seq': seq,
             'data': message_data,
-            'timestamp': datetime.now().isoformat()
+            'timestamp': clock.iso()
         })
+        self.message_history.append(group_id, seq, frame)
+        if self.journal is not None:
+            self.journal.append(seq, group_id, frame.data)
+        
+        if message_id is not None:
+            await self.send_message_ack(websocket, message_id, seq)
         
-        logger.info(f"消息同步: {message_data.get('id', 'unknown')}")
+        # 广播消息给群组内的其他客户端，没有群组的消息广播给所有人
+        await self.broadcast_to_others(websocket, frame, group_id=group_id)
+        
+        self.msglog.log('message_sync', "消息同步: %s", message_id or 'unknown')
     
-    async def handle_user_sync(self, websocket, data):
-        """处理用户同步"""
-        user_data = data.get('data')
-        if not user_data:
-            await self.send_error(websocket, "Missing user data")
-            return
+    async def reject_rate_limited(self, websocket, buckets, name) -> bool:
+        """
+        记录一次限流拒绝。连续被拒绝时只在第一次回复错误，避免洪泛的客户端引来同样多的回复；
+        超过断开阈值时关闭连接并返回True
+        """
+        self.stats['rate_limited'] += 1
+        label = 'frame' if name == FRAME else self.dispatcher.label(name)
+        self.metric_rate_limited.inc(label=label)
+        buckets.rejected += 1
         
-        # 广播用户信息给所有其他客户端
-        await self.broadcast_to_others(websocket, {
-            'type': 'user_sync',
-            'data': user_data,
-            'timestamp': datetime.now().isoformat()
-        })
+        if self.rate_limit_disconnect and buckets.rejected >= self.rate_limit_disconnect:
+            self.stats['rate_limit_disconnects'] += 1
+            logger.warning(f"客户端持续超出限流，断开连接: {label}")
+            await websocket.close(code=WSCloseCode.POLICY_VIOLATION, message=b'rate limited')
+            return True
         
-        logger.info(f"用户同步: {user_data.get('id', 'unknown')}")
+        if buckets.rejected == 1:
+            await self.send_reply(websocket, {
+                'type': 'error',
+                'message': f'Rate limit exceeded: {label}',
+                'retry_after': round(self.rate_limiter.retry_after(buckets, name), 3)
+            })
+        return False
+    
+    async def send_message_ack(self, websocket, message_id, seq, duplicate=False):
+        """确认消息已被服务器接收，客户端据此停止重试"""
+        await self.send_reply(websocket, {
+            'type': 'message_ack',
+            'id': message_id,
+            'seq': seq,
+            'duplicate': duplicate,
+            'timestamp': clock.iso()
+        })
     
-    async def handle_group_sync(self, websocket, data):
-        """处理群组同步"""
-        group_data = data.get('data')
-        if not group_data:
-            await self.send_error(websocket, "Missing group data")
+    async def handle_state_sync(self, session, data):
+        """
+        处理用户/群组同步：更新服务器保存的记录，只把变化的字段广播给其他客户端。
+        带base_version的是字段级补丁，否则data为完整对象
+        """
+        websocket = session.websocket
+        message_type = data['type']
+        kind = 'user' if message_type == 'user_sync' else 'group'
+        record = data['data']
+        
+        try:
+            delta = self.state.apply(
+                message_type, record,
+                unset=data.get('unset'),
+                add=data.get('add'),
+                remove=data.get('remove'),
+                base_version=data.get('base_version')
+            )
+        except StateConflict as e:
+            # 补丁基于过期版本，返回当前完整记录，由客户端合并后重试
+            await self.send_reply(websocket, {
+                'type': 'sync_conflict',
+                'kind': message_type,
+                'version': e.record.version,
+                'data': e.record.data,
+                'timestamp': clock.iso()
+            })
+            return
+        except (TypeError, ValueError) as e:
+            await self.send_error(websocket, f"Invalid {kind} patch: {e}")
             return
         
-        # 广播群组信息给所有其他客户端
-        await self.broadcast_to_others(websocket, {
-            'type': 'group_sync',
-            'data': group_data,
-            'timestamp': datetime.now().isoformat()
-        })
+        current = self.state.get(message_type, record['id'])
+        ack = {
+            'type': 'sync_ack',
+            'kind': message_type,
+            'id': record['id'],
+            'version': current.version if current is not None else 0,
+            'timestamp': clock.iso()
+        }
+        if delta is None:
+            # 没有任何变化，不广播
+            await self.send_reply(websocket, ack)
+            return
+        
+        seq = self.message_history.next_seq()
+        frame = Frame(dict(delta, type=message_type, seq=seq, timestamp=clock.iso()))
+        group_id = record['id'] if message_type == 'group_sync' else None
+        # 和消息一样记入历史，断线重连的客户端凭游标补发时不会漏掉状态变更
+        self.message_history.append(group_id, seq, frame)
+        if self.journal is not None:
+            self.journal.append(seq, group_id, frame.data)
+        ack['seq'] = seq
+        await self.send_reply(websocket, ack)
+        
+        # 用户增量广播给所有其他客户端，群组增量只发给该群组的订阅者
+        if self.bus is not None:
+            # 其他worker不依赖版本连续，按变更字段的当前值和字段版本合并
+            touched = set(delta['data']) | set(delta.get('unset', ())) | set(delta.get('add', ())) | set(delta.get('remove', ()))
+            touched.discard('id')
+            envelope = dict(frame.payload, fields=self.state.field_state(message_type, record['id'], touched))
+            self.bus.publish(group_id, sync_codec.dumps_bytes(envelope))
+        self.deliver_local(websocket, frame, group_id)
         
-        logger.info(f"群组同步: {group_data.get('id', 'unknown')}")
+        self.msglog.log(message_type, "%s同步: %s v%d", '用户' if kind == 'user' else '群组', record['id'], delta['version'])
     
-    async def handle_test_sync(self, websocket, data):
+    async def handle_snapshot(self, session, data):
+        """返回用户/群组状态快照，可用users/groups指定只要部分记录"""
+        client_id = session.client_id
+        users = data.get('users')
+        groups = data.get('groups')
+        if groups is None and not self.subscriptions.is_wildcard(client_id):
+            groups = list(self.subscriptions.groups_of(client_id))
+        
+        if users is None and groups is None:
+            # 全量快照在状态变化前可以被所有客户端复用
+            if self._snapshot_cache is None or self._snapshot_cache[0] != self.state.revision:
+                self._snapshot_cache = (self.state.revision, Frame(self.snapshot_payload(None, None)))
+            frame = self._snapshot_cache[1]
+        else:
+            frame = Frame(self.snapshot_payload(users, groups))
+        session.client_info.outbound.put(frame)
+    
+    async def handle_presence(self, session, data):
+        """返回本进程的在线客户端列表，可用clients指定只查询部分客户端"""
+        client_ids = data.get('clients')
+        if client_ids is None:
+            revision = self.presence.revision
+            if self._presence_cache is None or self._presence_cache[0] != revision:
+                self._presence_cache = (revision, Frame(self.presence_payload(None)))
+            frame = self._presence_cache[1]
+        else:
+            frame = Frame(self.presence_payload(client_ids))
+        session.client_info.outbound.put(frame)
+    
+    def presence_payload(self, client_ids):
+        return {
+            'type': 'presence_snapshot',
+            'clients': self.presence.snapshot(client_ids),
+            'online': len(self.presence),
+            'timestamp': clock.iso()
+        }
+    
+    def snapshot_payload(self, users, groups):
+        return {
+            'type': 'state_snapshot',
+            'users': self.state.snapshot('user_sync', users),
+            'groups': self.state.snapshot('group_sync', groups),
+            'timestamp': clock.iso()
+        }
+    
+    async def handle_test_sync(self, session, data):
         """处理测试同步"""
         test_message = data.get('message', '测试消息')
         
         # 广播测试消息给所有其他客户端
-        await self.broadcast_to_others(websocket, {
+        await self.broadcast_to_others(session.websocket, {
             'type': 'test_sync',
             'message': test_message,
-            'timestamp': datetime.now().isoformat()
+            'timestamp': clock.iso()
         })
         
-        logger.info(f"测试同步: {test_message}")
+        self.msglog.log('test_sync', "测试同步: %s", test_message)
+    
+    async def broadcast_to_others(self, sender_websocket, message, group_id=None):
+        """广播消息给除发送者外的客户端，指定group_id时只发给该群组的订阅者"""
+        frame = Frame.of(message)
+        if self.bus is not None:
+            # 其他worker上的客户端经总线投递
+            self.bus.publish(group_id, frame.data)
+        self.deliver_local(sender_websocket, frame, group_id)
     
-    async def broadcast_to_others(self, sender_websocket, message):
-        """广播消息给除发送者外的所有客户端"""
+    def on_bus_message(self, group_id, data):
+        """其他worker发来的广播：记入本地历史并投递给本进程的客户端"""
+        payload = sync_codec.loads(data)
+        message_type = payload.get('type')
+        if message_type in StateStore.KINDS and 'fields' in payload:
+            self.on_bus_state(group_id, payload)
+            return
+        if message_type == 'state_resync':
+            # 其他worker缺了某条记录的变更，回复本进程保存的全部字段
+            fields = self.state.field_state(payload['kind'], payload['id'])
+            if fields:
+                self.bus.publish(group_id, sync_codec.dumps_bytes({
+                    'type': payload['kind'], 'id': payload['id'], 'fields': fields}))
+            return
+        frame = Frame.from_data(payload, data)
+        if message_type == 'message_sync' and 'seq' in payload:
+            self.message_history.append(group_id, payload['seq'], frame)
+            # 客户端重试时可能连到另一个worker，同样需要识别为重复
+            message_id = (payload.get('data') or {}).get('id')
+            if message_id is not None and self.dedup is not None:
+                self.dedup.add(message_id, payload['seq'])
+        self.deliver_local(None, frame, group_id)
+    
+    def on_bus_state(self, group_id, payload):
+        """
+        合并其他worker的状态变更，本进程客户端收到按本地版本计算的增量。
+        发送方变更前的版本比本地新，说明中间有变更被总线丢弃，请求其他worker重发整条记录
+        """
+        kind = payload['type']
+        record_id = payload['data']['id'] if 'data' in payload else payload['id']
+        current = self.state.get(kind, record_id)
+        if 'base_version' in payload and (current.version if current is not None else 0) < payload['base_version']:
+            logger.warning(f"{kind} {record_id} 缺少版本 {payload['base_version']} 之前的变更，请求其他worker重发")
+            self.bus.publish(group_id, sync_codec.dumps_bytes({'type': 'state_resync', 'kind': kind, 'id': record_id}))
+        
+        delta = self.state.merge(kind, record_id, payload['fields'])
+        if delta is None:
+            return
+        # 重发的整条记录没有序号，在本进程分配一个
+        seq = payload.get('seq') or self.message_history.next_seq()
+        frame = Frame(dict(delta, type=kind, seq=seq, timestamp=payload.get('timestamp') or clock.iso()))
+        self.message_history.append(group_id, seq, frame)
+        self.deliver_local(None, frame, group_id)
+    
+    def deliver_local(self, sender_websocket, frame, group_id=None):
+        """投递给本进程内的客户端"""
         if not self.clients:
             return
+        started = time.perf_counter()
         
-        disconnected_clients = []
+        if group_id is None:
+            candidates = self.clients.items()
+        else:
+            candidates = [
+                (client_id, self.clients[client_id])
+                for client_id in self.subscriptions.recipients(group_id)
+                if client_id in self.clients
+            ]
         
-        for client_id, client_info in self.clients.items():
-            try:
-                if client_info['websocket'] != sender_websocket:
-                    await client_info['websocket'].send_str(json.dumps(message))
-            except Exception as e:
-                logger.error(f"广播消息失败 {client_id}: {e}")
-                disconnected_clients.append(client_id)
-        
-        # 清理断开的连接
-        for client_id in disconnected_clients:
-            if client_id in self.clients:
-                del self.clients[client_id]
-                self.stats['active_connections'] -= 1
-    
-    async def broadcast_user_joined(self, client_id, username):
-        """广播用户加入消息"""
-        message = {
-            'type': 'user_joined',
-            'username': username,
-            'client_id': client_id,
-            'timestamp': datetime.now().isoformat()
-        }
+        targets = [
+            (client_id, client_info.outbound)
+            for client_id, client_info in candidates
+            if client_info.websocket is not sender_websocket
+        ]
+        failed = self.fanout.publish(targets, frame)
         
-        await self.broadcast_to_others(None, message)
+        # 统一清理被驱逐的慢客户端
+        if failed:
+            self.remove_clients(dict(targets), failed)
+        self.metric_fanout_seconds.observe(time.perf_counter() - started)
+    
+    def remove_clients(self, queues, client_ids):
+        """批量移除客户端，仅当登记的仍是同一个连接时才移除（设备可能已重新注册）"""
+        for client_id in client_ids:
+            client_info = self.clients.get(client_id)
+            if client_info and client_info.outbound is queues.get(client_id):
+                self.unregister_client(client_id, client_info)
+                self.stats['slow_consumer_evictions'] += 1
+                self.msglog.log('evicted', "慢客户端已移除: %s", client_id)
+    
+    async def release_client(self, client_id, client_info):
+        """停止客户端的出站写任务，并把它的丢弃/合并计数并入总统计"""
+        outbound = client_info.outbound
+        await outbound.close()
+        self.stats['outbound_dropped'] += outbound.dropped
+        self.stats['outbound_coalesced'] += outbound.coalesced
+        self.stats['outbound_batches'] += outbound.batches
+        outbound.dropped = outbound.coalesced = outbound.batches = 0
+    
+    async def send_reply(self, websocket, message):
+        """直接回复请求方，按连接协商的协议编码"""
+        frame = Frame(message)
+        binary = websocket in self.binary_sockets
+        await frame.send_to(websocket, binary=binary)
+        self.fanout.frames_sent += 1
+        self.fanout.bytes_sent += len(frame.binary if binary else frame.data)
     
     async def send_error(self, websocket, error_message):
         """发送错误消息"""
         error_response = {
             'type': 'error',
             'message': error_message,
-            'timestamp': datetime.now().isoformat()
+            'timestamp': clock.iso()
         }
         
         try:
-            await websocket.send_str(json.dumps(error_response))
+            await self.send_reply(websocket, error_response)
         except Exception as e:
             logger.error(f"发送错误消息失败: {e}")
 
-# 创建全局服务器实例
-server = VercelSyncServer()
-
-# 创建aiohttp应用
-app = web.Application()
+def create_app():
+    """创建服务器实例和aiohttp应用，返回 (server, app)"""
+    # 配置日志：写出在后台线程中进行，不阻塞事件循环
+    sync_logging.setup_logging()
+    
+    # 创建服务器实例
+    server = VercelSyncServer()
+    
+    # 创建aiohttp应用
+    app = web.Application()
+    
+    # 添加路由
+    app.router.add_get('/health', server.health_check)
+    app.router.add_get('/ws', server.websocket_handler)
+    app.router.add_get('/metrics', server.metrics_handler)
+    app.router.add_get('/', server.health_check)  # 根路径也返回健康检查
+    if server.attachments is not None:
+        app.router.add_post('/attachments', server.upload_attachment)
+        app.router.add_get('/attachments/{attachment_id}', server.download_attachment)
+    
+    # 后台任务
+    app.on_startup.append(server.start_background_tasks)
+    app.on_shutdown.append(server.drain)
+    app.on_cleanup.append(server.cleanup_background_tasks)
+    return server, app
 
-# 添加路由
-app.router.add_get('/health', server.health_check)
-app.router.add_get('/ws', server.websocket_handler)
-app.router.add_get('/', server.health_check)  # 根路径也返回健康检查
+def __getattr__(name):
+    """
+    全局的server/app/handler（Vercel需要handler变量）在第一次访问时才创建：
+    只导入模块不会配置日志、读取环境变量或构建应用
+    """
+    global server, app, handler
+    if name not in ('server', 'app', 'handler'):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    server, app = create_app()
+    handler = app
+    return globals()[name]
 
-# Vercel需要这个handler变量
-handler = app
+def __dir__():
+    """Vercel运行时通过dir()查找入口变量，尚未创建的server/app/handler也要列出"""
+    return sorted(set(globals()) | {'server', 'app', 'handler'})
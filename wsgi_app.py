@@ -6,24 +6,31 @@ WSGI兼容的同步服务器
 """
 
 import asyncio
-import json
 import logging
 import os
 from datetime import datetime
 from typing import Dict
-from aiohttp import web, WSMsgType
+from aiohttp import web, WSMsgType, WSCloseCode
 # from aiohttp_wsgi import WSGIHandler  # 暂时注释掉，使用原生aiohttp
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+import sync_codec
+import sync_logging
+from sync_clients import ClientRecord
+from sync_clock import clock
+from sync_restart import reconnect_hint
+
 logger = logging.getLogger(__name__)
 
 class SyncServer:
     def __init__(self):
-        self.clients: Dict[str, Dict] = {}
+        self.clients: Dict[str, ClientRecord] = {}
+        self.msglog = sync_logging.message_log(logger)
+        # 关闭时给客户端的重连提示，退避时间在[min, max]内随机
+        self.draining = False
+        self.reconnect_backoff = (
+            float(os.environ.get('SYNC_RECONNECT_BACKOFF_MIN_MS', 500)) / 1000,
+            float(os.environ.get('SYNC_RECONNECT_BACKOFF_MAX_MS', 15000)) / 1000
+        )
         self.stats = {
             'total_connections': 0,
             'active_connections': 0,
@@ -34,15 +41,19 @@ class SyncServer:
     async def health_check(self, request):
         """健康检查端点"""
         return web.json_response({
-            'status': 'healthy',
+            'status': 'draining' if self.draining else 'healthy',
             'timestamp': datetime.now().isoformat(),
             'uptime': str(datetime.now() - self.stats['start_time']).split('.')[0],
             'active_connections': self.stats['active_connections'],
             'total_connections': self.stats['total_connections']
-        })
+        }, status=503 if self.draining else 200, dumps=sync_codec.dumps)
     
     async def websocket_handler(self, request):
         """WebSocket处理器"""
+        if self.draining:
+            return web.Response(status=503, text='Server restarting',
+                                headers={'Retry-After': str(int(self.reconnect_backoff[1]) or 1)})
+        
         ws = web.WebSocketResponse()
         await ws.prepare(request)
         
@@ -52,36 +63,33 @@ class SyncServer:
             self.stats['total_connections'] += 1
             self.stats['active_connections'] += 1
             
-            logger.info(f"新WebSocket连接: {request.remote}")
+            self.msglog.log('connect', "新WebSocket连接: %s", request.remote)
             
             async for msg in ws:
                 if msg.type == WSMsgType.TEXT:
                     try:
-                        data = json.loads(msg.data)
+                        data = sync_codec.loads(msg.data)
                         message_type = data.get('type')
                         device_id = data.get('device_id')
                         
                         if message_type == 'register' and device_id:
                             client_id = device_id
-                            self.clients[client_id] = {
-                                'websocket': ws,
-                                'username': data.get('username', 'Unknown'),
-                                'connected_at': datetime.now()
-                            }
+                            self.clients[client_id] = ClientRecord(
+                                ws, data.get('username', 'Unknown'), clock.now_ms())
                             
                             response = {
                                 'type': 'register_success',
                                 'device_id': device_id,
                                 'message': '注册成功',
-                                'timestamp': datetime.now().isoformat()
+                                'timestamp': clock.iso()
                             }
-                            await ws.send_str(json.dumps(response))
-                            logger.info(f"客户端注册成功: {client_id}")
+                            await ws.send_str(sync_codec.dumps(response))
+                            self.msglog.log('register', "客户端注册成功: %s", client_id)
                         
                         self.stats['messages_processed'] += 1
                         
-                    except json.JSONDecodeError:
-                        await ws.send_str(json.dumps({
+                    except sync_codec.DecodeError:
+                        await ws.send_str(sync_codec.dumps({
                             'type': 'error',
                             'message': 'Invalid JSON format'
                         }))
@@ -94,20 +102,61 @@ class SyncServer:
             if client_id and client_id in self.clients:
                 del self.clients[client_id]
                 self.stats['active_connections'] -= 1
-                logger.info(f"客户端已移除: {client_id}")
+                self.msglog.log('disconnect', "客户端已移除: %s", client_id)
         
         return ws
+    
+    async def start_background_tasks(self, app):
+        """应用启动时开始周期性日志汇总"""
+        self.msglog.start()
+    
+    async def drain(self, app):
+        """关闭前拒绝新连接，给每个客户端发送带随机退避的重连提示后关闭连接"""
+        self.draining = True
+        
+        async def close(client_info):
+            hint = reconnect_hint(*self.reconnect_backoff)
+            await client_info.websocket.send_str(sync_codec.dumps(hint))
+            await client_info.websocket.close(code=WSCloseCode.GOING_AWAY, message=b'Server restarting')
+        
+        await asyncio.gather(*(close(info) for info in list(self.clients.values())), return_exceptions=True)
+    
+    async def cleanup_background_tasks(self, app):
+        await self.msglog.stop()
 
-# 创建服务器实例
-sync_server = SyncServer()
+def create_app():
+    """创建服务器实例和aiohttp应用，返回 (sync_server, app)"""
+    # 配置日志：写出在后台线程中进行，不阻塞事件循环
+    sync_logging.setup_logging()
+    
+    # 创建服务器实例
+    sync_server = SyncServer()
+    
+    # 创建aiohttp应用
+    app = web.Application()
+    
+    # 添加路由
+    app.router.add_get('/health', sync_server.health_check)
+    app.router.add_get('/ws', sync_server.websocket_handler)
+    app.router.add_get('/', sync_server.health_check)
+    
+    # 注册后台任务的启动与清理
+    app.on_startup.append(sync_server.start_background_tasks)
+    app.on_shutdown.append(sync_server.drain)
+    app.on_cleanup.append(sync_server.cleanup_background_tasks)
+    return sync_server, app
 
-# 创建aiohttp应用
-app = web.Application()
+def __getattr__(name):
+    """全局的sync_server/app在第一次访问时才创建，只导入模块不构建应用"""
+    global sync_server, app
+    if name not in ('sync_server', 'app'):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    sync_server, app = create_app()
+    return globals()[name]
 
-# 添加路由
-app.router.add_get('/health', sync_server.health_check)
-app.router.add_get('/ws', sync_server.websocket_handler)
-app.router.add_get('/', sync_server.health_check)
+def __dir__():
+    """部署平台通过dir()查找入口变量，尚未创建的sync_server/app也要列出"""
+    return sorted(set(globals()) | {'sync_server', 'app'})
 
 # 为了兼容某些部署平台
 handler = None
@@ -116,5 +165,13 @@ if __name__ == "__main__":
     # 获取端口
     port = int(os.environ.get('PORT', 8766))
     
+    # SYNC_WORKERS > 1 时以多进程方式运行，共享同一端口
+    workers = int(os.environ.get('SYNC_WORKERS', 1))
+    
     # 启动服务器
-    web.run_app(app, host='0.0.0.0', port=port)
+    if workers > 1:
+        from sync_workers import run_workers
+        run_workers('wsgi_app:app', host='0.0.0.0', port=port, workers=workers)
+    else:
+        _, app = create_app()
+        web.run_app(app, host='0.0.0.0', port=port)